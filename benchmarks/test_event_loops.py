@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Benchmark of the produce path (schedule, fetch, match and publish) on each
+event loop implementation, against a local web server and a broker that
+accepts everything right away"""
+
+import pytest
+from aiohttp import web
+
+from walt import config
+from walt.action_runners import Producer
+from walt.event_loop import ASYNCIO
+from walt.event_loop import UVLOOP
+from walt.event_loop import set_event_loop_policy
+from walt.url_store import URLStore
+
+
+URLS = 50
+CHECKS = 2000
+BODY = "Such quick fox jumps over the many lazy dog wow " * 100
+
+
+class NullKafkaProducer:
+    async def send_and_wait(self, topic, msg):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class BenchmarkProducer(Producer):
+    async def _run_action(self):
+        app = web.Application()
+        app.router.add_get("/{path}", self._handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        _, port = runner.addresses[0][:2]
+        self._url_map = URLStore((f"http://127.0.0.1:{port}/{i}", "lazy dog") for i in range(URLS))
+        try:
+            await super()._run_action()
+        finally:
+            await runner.cleanup()
+
+    @staticmethod
+    async def _handle(request):
+        return web.Response(text=BODY)
+
+    async def _start_kafka_producer(self):
+        self._kafka_producer = NullKafkaProducer()
+
+    async def _incr_counter(self, count=1):
+        await super()._incr_counter(count)
+        if self._counter - count < CHECKS <= self._counter:
+            self._shutdown()
+
+
+@pytest.fixture
+def cfg():
+    return {
+        **config.CONFIG,
+        "url_map": {"placeholder": ""},
+        "interval": 0,
+        "jitter": 0,
+        "concurrent": 20,
+    }
+
+
+@pytest.fixture(autouse=True)
+def _restore_event_loop_policy():
+    yield
+    set_event_loop_policy(ASYNCIO)
+
+
+@pytest.mark.parametrize("event_loop_name", [ASYNCIO, UVLOOP])
+def test_produce(benchmark, cfg, event_loop_name):
+    if event_loop_name == UVLOOP:
+        pytest.importorskip("uvloop")
+    cfg["event_loop"] = event_loop_name
+
+    def produce():
+        assert BenchmarkProducer(cfg).run() >= CHECKS
+
+    benchmark.pedantic(produce, rounds=5)
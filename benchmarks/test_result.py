@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Microbenchmarks of creating Results and binding them to the insert
+queries, recording the bytes allocated per Result, against a replica of the
+former dataclass Result with datetime timestamps and a dict per row"""
+
+import tracemalloc
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from typing import Optional
+
+import pytest
+
+from walt.result import Pattern
+from walt.result import Result
+from walt.result import ResultType
+from walt.result import hash_url
+
+
+RESULTS = 1000
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_utc_now_ms():
+    return round((datetime.utcnow() - EPOCH).total_seconds() * 1e3)
+
+
+@dataclass
+class DataclassResult:
+    result_type: ResultType
+    url: str
+    response_time: float = 0
+    status_code: int = 0
+    pattern: Pattern = Pattern.IRRELEVANT
+    utc_timestamp_ms: int = field(default_factory=datetime_utc_now_ms)
+    dns_time: Optional[float] = None
+    connect_time: Optional[float] = None
+    ttfb: Optional[float] = None
+    body_time: Optional[float] = None
+    url_id: Optional[int] = None
+
+    def __post_init__(self):
+        if self.url_id is None:
+            self.url_id = hash_url(self.url)
+
+    def result_params(self):
+        result = vars(self).copy()
+        result["result_type"] = self.result_type.name
+        result["pattern"] = self.pattern.name
+        return result
+
+
+RESULT_CLASSES = {"dataclass": DataclassResult, "slotted": Result}
+URL_IDS = [hash_url(f"https://wow.url/{i}") for i in range(RESULTS)]
+
+
+def create(result_class):
+    return [
+        result_class(ResultType.RESULT, "", 0.5, 200, Pattern.FOUND, url_id=url_id)
+        for url_id in URL_IDS
+    ]
+
+
+def allocated_bytes(func):
+    tracemalloc.start()
+    try:
+        kept = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+@pytest.mark.parametrize("result_class", RESULT_CLASSES)
+def test_create(benchmark, result_class):
+    cls = RESULT_CLASSES[result_class]
+    benchmark(create, cls)
+    benchmark.extra_info["bytes_per_result"] = allocated_bytes(lambda: create(cls)) / RESULTS
+
+
+@pytest.mark.parametrize("result_class", RESULT_CLASSES)
+def test_bind_params(benchmark, result_class):
+    results = create(RESULT_CLASSES[result_class])
+
+    def bind():
+        return [res.result_params() for res in results]
+
+    benchmark(bind)
+    benchmark.extra_info["bytes_per_result"] = allocated_bytes(bind) / RESULTS
+
+
+@pytest.mark.parametrize("utc_now_ms", ["datetime", "time_ns"])
+def test_timestamp(benchmark, utc_now_ms):
+    from walt.result import utc_now_ms as time_ns_utc_now_ms
+
+    func = datetime_utc_now_ms if utc_now_ms == "datetime" else time_ns_utc_now_ms
+    benchmark(func)
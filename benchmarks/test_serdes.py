@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Benchmark of encoding and decoding a stream of Results with each serde,
+recording the average message size"""
+
+import random
+
+import pytest
+
+from walt.result import Pattern
+from walt.result import Result
+from walt.result import ResultType
+from walt.serdes import MSGPACK
+from walt.serdes import SERDES
+from walt.serdes import DetectingSerde
+
+
+RESULTS = 1000
+
+
+@pytest.fixture(scope="module")
+def results():
+    rand = random.Random(42)
+    results = []
+    for i in range(RESULTS):
+        url = f"https://www.example.com/search?q=doge+meme&page={i % 100}"
+        if rand.random() < 0.9:
+            res = Result(ResultType.RESULT, url, rand.random(), 200, Pattern.FOUND)
+        else:
+            res = Result(ResultType.TIMEOUT_ERROR, url)
+        if i >= 100:
+            res.url = ""  # Only the first result of each URL carries it
+        results.append(res)
+    return results
+
+
+@pytest.fixture(params=list(SERDES))
+def serde(request):
+    if request.param == MSGPACK:
+        pytest.importorskip("msgpack")
+    return SERDES[request.param]
+
+
+def test_encode(benchmark, results, serde):
+    messages = benchmark(lambda: [serde.to_bytes(res) for res in results])
+    benchmark.extra_info["average_size"] = sum(map(len, messages)) / len(messages)
+
+
+def test_decode(benchmark, results, serde):
+    messages = [serde.to_bytes(res) for res in results]
+    decoded = benchmark(lambda: [DetectingSerde.from_bytes(msg) for msg in messages])
+    assert decoded == results
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""Benchmark of storing a stream of Results one at a time, with multi-row
+INSERTs and with COPY in text and binary formats, against the Postgres of the
+configuration (WALT_POSTGRES_* environment variables included) on a database
+of its own"""
+
+import asyncio
+import contextlib
+import os
+import random
+from copy import deepcopy
+
+import psycopg2
+import pytest
+
+from walt import config
+from walt.result import Pattern
+from walt.result import Result
+from walt.result import ResultType
+from walt.storages import COPY_BINARY
+from walt.storages import COPY_TEXT
+from walt.storages import PostgresResultStorage
+
+
+RESULTS = 5000
+BATCH_SIZE = 500
+
+
+@pytest.fixture(scope="module")
+def storage():
+    cfg = config.override_from(deepcopy(config.CONFIG), os.environ)["postgres"]
+    storage = PostgresResultStorage(**{**cfg, "dbname": f"{cfg['dbname']}_benchmark"})
+    try:
+        with contextlib.suppress(psycopg2.errors.DuplicateDatabase):
+            storage.create_database()
+    except psycopg2.OperationalError as err:
+        pytest.skip(f"Postgres is not available: {err}")
+    storage.drop_tables()
+    storage.create_tables()
+    yield storage
+    storage.drop_database()
+
+
+@pytest.fixture(scope="module")
+def results():
+    rand = random.Random(42)
+    results = []
+    for i in range(RESULTS):
+        url = f"https://www.example.com/search?q=doge+meme&page={i % 100}"
+        if rand.random() < 0.9:
+            timings = [rand.random() for _ in range(4)]
+            res = Result(ResultType.RESULT, url, sum(timings), 200, Pattern.FOUND, None, *timings)
+        else:
+            res = Result(ResultType.TIMEOUT_ERROR, url)
+        results.append(res)
+    return results
+
+
+async def save(storage, results):
+    for res in results:
+        await storage.save(res)
+
+
+async def save_many(storage, results):
+    for i in range(0, len(results), BATCH_SIZE):
+        await storage.save_many(results[i : i + BATCH_SIZE])
+
+
+async def copy_text(storage, results):
+    for i in range(0, len(results), BATCH_SIZE):
+        await storage.copy_many(results[i : i + BATCH_SIZE], COPY_TEXT)
+
+
+async def copy_binary(storage, results):
+    for i in range(0, len(results), BATCH_SIZE):
+        await storage.copy_many(results[i : i + BATCH_SIZE], COPY_BINARY)
+
+
+@pytest.mark.parametrize("store", [save, save_many, copy_text, copy_binary])
+def test_store(benchmark, storage, results, store):
+    async def connect_and_store():
+        await storage.connect()
+        try:
+            await store(storage, results)
+        finally:
+            await storage.disconnect()
+
+    benchmark.pedantic(lambda: asyncio.run(connect_and_store()), rounds=3)
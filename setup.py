@@ -32,9 +32,12 @@ extras_require = {
         "pylint",
         "pytest",
         "pytest-asyncio",
+        "pytest-benchmark",
         "pytest-cov",
         "pytest-mock",
     ],
+    "msgpack": ["msgpack"],
+    "uvloop": ["uvloop"],
 }
 
 setup(
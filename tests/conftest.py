@@ -27,6 +27,11 @@ def logger_mock(mocker):
     mocker.patch("walt.logger", logger_mock)
     mocker.patch("walt.action_runners.logger", logger_mock)
     mocker.patch("walt.storages.logger", logger_mock)
+    mocker.patch("walt.supervisor.logger", logger_mock)
+    mocker.patch("walt.circuit.logger", logger_mock)
+    mocker.patch("walt.event_loop.logger", logger_mock)
+    mocker.patch("walt.url_store.logger", logger_mock)
+    mocker.patch("walt.serdes.logger", logger_mock)
     return logger_mock
 
 
@@ -42,21 +47,37 @@ def async_magic_mock():
 
 
 @pytest.fixture
-def resp_text_mock():
-    return AsyncMock()
+def resp_content_mock():
+    async def iter_chunked(size):
+        body = resp_content_mock.body
+        for i in range(0, len(body), size):
+            yield body[i : i + size]
+
+    resp_content_mock = MagicMock(body=b"")
+    resp_content_mock.iter_chunked = MagicMock(side_effect=iter_chunked)
+    return resp_content_mock
 
 
 @pytest.fixture
-def client_session_get_mock(async_magic_mock, resp_text_mock):
+def client_session_get_mock(async_magic_mock, resp_content_mock):
     get_mock = async_magic_mock()
-    get_mock.return_value.__aenter__.return_value.text = resp_text_mock
+    get_mock.return_value.__aenter__.return_value.content = resp_content_mock
+    get_mock.return_value.__aenter__.return_value.charset = None
     return get_mock
 
 
 @pytest.fixture
-def client_session_mock(mocker, async_magic_mock, client_session_get_mock):
+def client_session_head_mock(async_magic_mock):
+    return async_magic_mock()
+
+
+@pytest.fixture
+def client_session_mock(
+    mocker, async_magic_mock, client_session_get_mock, client_session_head_mock
+):
     client_session_mock = async_magic_mock()
     client_session_mock.return_value.__aenter__.return_value.get = client_session_get_mock
+    client_session_mock.return_value.__aenter__.return_value.head = client_session_head_mock
     mocker.patch("walt.action_runners.aiohttp.ClientSession", client_session_mock)
     return client_session_mock
 
@@ -68,4 +89,8 @@ def kafka_producer_mock(mocker):
 
 @pytest.fixture
 def kafka_consumer_mock(mocker):
-    return mocker.patch("walt.action_runners.aiokafka.AIOKafkaConsumer", return_value=AsyncMock())
+    kafka_consumer_mock = mocker.patch(
+        "walt.action_runners.aiokafka.AIOKafkaConsumer", return_value=AsyncMock()
+    )
+    kafka_consumer_mock.return_value.subscribe = MagicMock()
+    return kafka_consumer_mock
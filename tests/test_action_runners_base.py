@@ -9,6 +9,7 @@
 # Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
 import asyncio
+import multiprocessing
 import os
 import signal
 from unittest.mock import AsyncMock
@@ -104,6 +105,24 @@ def test_action_runner_finishes_on_signals_when_no_tasks(signum, action_runner):
     action_runner.run()
 
 
+def test_action_runner_reloads_on_sighup(action_runner, mocker):
+    async def side_effect():
+        os.kill(os.getpid(), signal.SIGHUP)
+        await asyncio.sleep(1e-3)
+
+    reload_mock = mocker.patch.object(action_runner, "_reload")
+    action_runner.register_tasks([AsyncMock(side_effect=side_effect)])
+    action_runner.run()
+    reload_mock.assert_called_once_with()
+
+
+def test_action_runner_does_not_reload_by_default(action_runner, logger_mock):
+    action_runner._reload()
+    logger_mock.warning.assert_called_once_with(
+        "%s doesn't support reloading", "ActionRunnerBaseTester"
+    )
+
+
 def test_action_runner_finishes_on_tasks_cancellation(action_runner, logger_mock):
     async def side_effect():
         for task in asyncio.all_tasks():
@@ -137,3 +156,30 @@ def test_kafka_ssl_context_connector_returns_empty_dict(aiokafka_helpers_mock):
     cfg_kafka = {"cafile": "", "certfile": "", "keyfile": ""}
     assert KafkaSSLConnector({"kafka": cfg_kafka})._ssl_arguments == {}
     aiokafka_helpers_mock.create_ssl_context.assert_not_called()
+
+
+def test_action_runner_reports_stats_periodically(logger_mock):
+    action_runner = ActionRunnerBaseTester(stats_interval=1e-3)
+
+    async def side_effect(self):
+        await self._incr_counter()
+        await asyncio.sleep(1e-2)
+        for task in self._tasks:
+            task.cancel()
+
+    task = AsyncMock(side_effect=side_effect)
+    action_runner.register_tasks([action_runner._report_stats, (task, [action_runner])])
+    action_runner.run()
+    logger_mock.info.assert_any_call("%s stats: %s", "ActionRunnerBaseTester", "counter=1")
+
+
+def test_action_runner_counts_on_shared_counter():
+    shared_counter = multiprocessing.Value("q", 7)
+    action_runner = ActionRunnerBaseTester(shared_counter=shared_counter)
+
+    async def side_effect(self):
+        await self._incr_counter()
+
+    action_runner.register_tasks([(AsyncMock(side_effect=side_effect), [action_runner])] * 3)
+    assert action_runner.run() == 3
+    assert shared_counter.value == 10
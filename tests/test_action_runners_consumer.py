@@ -10,6 +10,7 @@
 
 import asyncio
 import contextlib
+from unittest.mock import ANY
 from unittest.mock import AsyncMock
 from unittest.mock import MagicMock
 from unittest.mock import call
@@ -18,18 +19,27 @@ import aiokafka
 import pytest
 
 from tests.base import ActionRunnerBaseTester
+from walt import envelope
 from walt import result
 from walt.action_runners import Consumer
+from walt.action_runners import DrainOnRevoke
 
 
 def test_consumer_inits_with_a_cfg_and_storage_args():
     cfg_mock = MagicMock()
     consumer = Consumer(cfg_mock, AsyncMock(), result.ResultSerde)
+    assert consumer._stats_interval == cfg_mock["stats_interval"]
+    assert consumer._shared_counter is None
     assert consumer._interval == cfg_mock["interval"]
     assert consumer._timeout == cfg_mock["timeout"]
     assert consumer._kafka_uri == cfg_mock["kafka"]["uri"]
     assert consumer._kafka_topic == cfg_mock["kafka"]["topic"]
     assert consumer._kafka_consumer is None
+    assert consumer._batch_size == cfg_mock["consumer"]["batch_size"]
+    assert consumer._batch_timeout == cfg_mock["consumer"]["batch_timeout"]
+    assert consumer._copy == cfg_mock["consumer"]["copy"]
+    assert consumer._group_id == cfg_mock["consumer"]["group_id"]
+    assert consumer._queue_size == cfg_mock["consumer"]["queue_size"]
 
 
 @pytest.fixture
@@ -38,6 +48,11 @@ def consumer(mocker):
     consumer = Consumer(MagicMock(), AsyncMock(), result.ResultSerde)
     consumer._interval = 1
     consumer._timeout = 1
+    consumer._batch_size = 0
+    consumer._batch_timeout = 1
+    consumer._copy = ""
+    consumer._stats_interval = 0
+    consumer._queue_size = 4
     return consumer
 
 
@@ -54,20 +69,24 @@ async def test_start_kafka_consumer_retries_with_backoff(consumer, kafka_consume
 
 @pytest.mark.asyncio
 async def test_run_action_connects_storage(consumer, kafka_consumer_mock):
-    consumer._process_urls = AsyncMock()
+    consumer._consume = AsyncMock()
     await consumer._run_action()
     consumer._storage.connect.assert_awaited_once()
 
 
 @pytest.mark.asyncio
 async def test_run_action_starts_kafka_consumer(consumer, kafka_consumer_mock):
-    consumer._process_urls = AsyncMock()
+    consumer._consume = AsyncMock()
     await consumer._run_action()
     kafka_consumer_mock.assert_called_once_with(
-        consumer._kafka_topic,
         bootstrap_servers=consumer._kafka_uri,
         request_timeout_ms=consumer._timeout * 1000,
         retry_backoff_ms=consumer._interval * 1000,
+        group_id=consumer._group_id,
+        enable_auto_commit=False,
+    )
+    kafka_consumer_mock.return_value.subscribe.assert_called_once_with(
+        [consumer._kafka_topic], listener=ANY
     )
     kafka_consumer_mock.return_value.start.assert_called_once_with()
 
@@ -106,13 +125,38 @@ def consumer_auto_cancel(mocker):
     consumer.register_tasks([(AsyncMock(side_effect=side_effect), (consumer,))])
     consumer._interval = 1
     consumer._timeout = 1
+    consumer._batch_size = 0
+    consumer._batch_timeout = 1
+    consumer._copy = ""
+    consumer._stats_interval = 0
+    consumer._queue_size = 4
     return consumer
 
 
+def getmany_mock(*batches):
+    """getmany_mock returns a mock of getmany that returns `batches` of
+    messages, in order, and then waits for nothing until the timeout"""
+
+    async def getmany(timeout_ms, max_records):
+        if not batches_left:
+            await asyncio.sleep(timeout_ms / 1000)
+            return {}
+        return {"tp": batches_left.pop(0)}
+
+    batches_left = list(batches)
+    return AsyncMock(side_effect=getmany)
+
+
+def error_msg(offset=0):
+    res = result.Result(result.ResultType.ERROR, "wow.web")
+    msg_value = result.ResultSerde.to_bytes(res)
+    return MagicMock(value=msg_value, topic="walt", partition=0, offset=offset)
+
+
 def test_consumer_consume_one_message(consumer_auto_cancel, kafka_consumer_mock):
     msg_value = b"1\nwow.web\n0.359\n200\n2\n719"
     msg = MagicMock(value=msg_value)
-    kafka_consumer_mock.return_value.__aiter__.return_value = [msg]
+    kafka_consumer_mock.return_value.getmany = getmany_mock([msg])
     consumer_auto_cancel.run()
     expected_result = result.ResultSerde.from_bytes(msg_value)
     consumer_auto_cancel._storage.save.assert_called_once_with(expected_result)
@@ -122,8 +166,184 @@ def test_consumer_consume_messages(consumer_auto_cancel, kafka_consumer_mock):
     total_messages = 10
     msg_value = b"1\nwow.web\n0.359\n200\n2\n719"
     msg = MagicMock(value=msg_value)
-    kafka_consumer_mock.return_value.__aiter__.return_value = [msg] * total_messages
+    kafka_consumer_mock.return_value.getmany = getmany_mock([msg] * total_messages)
     consumer_auto_cancel.run()
     assert consumer_auto_cancel._storage.save.call_count == total_messages
     expected_result = result.ResultSerde.from_bytes(msg_value)
     consumer_auto_cancel._storage.save.assert_any_call(expected_result)
+
+
+def test_consumer_unpacks_envelopes(consumer_auto_cancel, kafka_consumer_mock):
+    results = [result.Result(result.ResultType.RESULT, f"wow-{i}.web") for i in range(3)]
+    msg_value = envelope.pack([result.ResultSerde.to_bytes(res) for res in results])
+    kafka_consumer_mock.return_value.getmany = getmany_mock([MagicMock(value=msg_value)])
+    consumer_auto_cancel.run()
+    saved = [c.args[0] for c in consumer_auto_cancel._storage.save.call_args_list]
+    assert saved == results
+    assert consumer_auto_cancel._counter == 3
+
+
+def test_consumer_saves_batches(consumer_auto_cancel, kafka_consumer_mock):
+    consumer_auto_cancel._batch_size = 5
+    results = [result.Result(result.ResultType.RESULT, f"wow-{i}.web") for i in range(10)]
+    msgs = [MagicMock(value=result.ResultSerde.to_bytes(res)) for res in results]
+    kafka_consumer_mock.return_value.getmany = getmany_mock(msgs[:5], msgs[5:])
+    consumer_auto_cancel.run()
+    consumer_auto_cancel._storage.save_many.assert_has_awaits(
+        [call(results[:5]), call(results[5:])]
+    )
+    consumer_auto_cancel._storage.save.assert_not_called()
+    assert consumer_auto_cancel._counter == 10
+
+
+def test_consumer_copies_batches(consumer_auto_cancel, kafka_consumer_mock):
+    consumer_auto_cancel._batch_size = 5
+    consumer_auto_cancel._copy = "binary"
+    results = [result.Result(result.ResultType.RESULT, f"wow-{i}.web") for i in range(5)]
+    msgs = [MagicMock(value=result.ResultSerde.to_bytes(res)) for res in results]
+    kafka_consumer_mock.return_value.getmany = getmany_mock(msgs)
+    consumer_auto_cancel.run()
+    consumer_auto_cancel._storage.copy_many.assert_awaited_once_with(results, "binary")
+    consumer_auto_cancel._storage.save_many.assert_not_called()
+    assert consumer_auto_cancel._counter == 5
+
+
+def test_consumer_gathers_fetches_into_batches(consumer_auto_cancel, kafka_consumer_mock):
+    consumer_auto_cancel._batch_size = 5
+    msg = error_msg()
+    kafka_consumer_mock.return_value.getmany = getmany_mock([msg] * 3, [msg] * 2)
+    consumer_auto_cancel.run()
+    getmany_calls = kafka_consumer_mock.return_value.getmany.await_args_list
+    assert all(c.kwargs["max_records"] == 5 for c in getmany_calls)
+    assert len(consumer_auto_cancel._storage.save_many.await_args_list[0].args[0]) == 5
+
+
+def test_consumer_drops_undecodable_messages(
+    consumer_auto_cancel, kafka_consumer_mock, logger_mock
+):
+    consumer_auto_cancel._batch_size = 4
+    consumer_auto_cancel._batch_timeout = 1e-3
+    bad_msg = MagicMock(value=b"such\ngarbage", topic="walt", partition=0, offset=1)
+    bad_envelope = MagicMock(value=envelope.pack([b"wow"]), topic="walt", partition=0, offset=3)
+    msgs = [error_msg(0), bad_msg, error_msg(2), bad_envelope]
+    kafka_consumer_mock.return_value.getmany = getmany_mock(msgs)
+    consumer_auto_cancel.run()
+    consumer_auto_cancel._storage.save_many.assert_awaited_once()
+    assert len(consumer_auto_cancel._storage.save_many.await_args.args[0]) == 2
+    kafka_consumer_mock.return_value.commit.assert_awaited_once_with(
+        {aiokafka.TopicPartition("walt", 0): 4}
+    )
+    assert logger_mock.error.call_count == 2
+    assert consumer_auto_cancel._stats()["undecodable"] == 2
+
+
+@pytest.mark.asyncio
+async def test_consumer_decoder_stops_at_the_batch_timeout(consumer):
+    consumer._batch_size = 5
+    consumer._batch_timeout = 0.01
+    consumer._fetches, consumer._batches = asyncio.Queue(), asyncio.Queue()
+    await consumer._fetches.put([error_msg(7)])
+    decoder = asyncio.create_task(consumer._decoder())
+    batch, offsets = await asyncio.wait_for(consumer._batches.get(), 1)
+    decoder.cancel()
+    assert len(batch) == 1
+    assert offsets == {aiokafka.TopicPartition("walt", 0): 8}
+
+
+def test_consumer_commits_after_storing_each_fetch(consumer_auto_cancel, kafka_consumer_mock):
+    kafka_consumer_mock.return_value.getmany = getmany_mock([error_msg(0)], [error_msg(1)])
+    calls = []
+    consumer_auto_cancel._storage.save.side_effect = lambda res: calls.append("save")
+    kafka_consumer_mock.return_value.commit.side_effect = lambda offsets: calls.append(offsets)
+    consumer_auto_cancel.run()
+    tp = aiokafka.TopicPartition("walt", 0)
+    assert calls == ["save", {tp: 1}, "save", {tp: 2}]
+
+
+def test_consumer_commits_after_storing_each_batch(consumer_auto_cancel, kafka_consumer_mock):
+    consumer_auto_cancel._batch_size = 5
+    msgs = [error_msg(offset) for offset in range(10)]
+    kafka_consumer_mock.return_value.getmany = getmany_mock(msgs[:5], msgs[5:])
+    calls = []
+    consumer_auto_cancel._storage.save_many.side_effect = lambda batch: calls.append("save")
+    kafka_consumer_mock.return_value.commit.side_effect = lambda offsets: calls.append(offsets)
+    consumer_auto_cancel.run()
+    tp = aiokafka.TopicPartition("walt", 0)
+    assert calls == ["save", {tp: 5}, "save", {tp: 10}]
+
+
+def test_consumer_fetches_while_storing(consumer_auto_cancel, kafka_consumer_mock):
+    consumer_auto_cancel._batch_size = 1
+    consumer_auto_cancel._queue_size = 1
+    kafka_consumer_mock.return_value.getmany = getmany_mock(*[[error_msg()]] * 10)
+
+    async def save_many(batch):
+        await asyncio.Event().wait()
+
+    consumer_auto_cancel._storage.save_many.side_effect = save_many
+    consumer_auto_cancel.run()
+    consumer_auto_cancel._storage.save_many.assert_awaited_once()
+    # One batch being stored, one queued, one being queued, one fetch queued, one being queued
+    assert kafka_consumer_mock.return_value.getmany.await_count == 5
+
+
+@pytest.mark.asyncio
+async def test_consumer_retries_storing_before_committing(consumer, mocker):
+    sleep_mock = mocker.patch("walt.action_runners.asyncio.sleep", AsyncMock())
+    consumer._kafka_consumer = AsyncMock()
+    consumer._storage.save.side_effect = [ConnectionError, ConnectionError, None]
+    consumer._batches = asyncio.Queue()
+    offsets = {aiokafka.TopicPartition("walt", 0): 1}
+    await consumer._batches.put(([result.Result(result.ResultType.ERROR, "wow.web")], offsets))
+    storer = asyncio.create_task(consumer._storer())
+    await asyncio.wait_for(consumer._batches.join(), 1)
+    storer.cancel()
+    assert consumer._storage.save.await_count == 3
+    sleep_mock.assert_has_awaits([call(1), call(2)])
+    consumer._kafka_consumer.commit.assert_awaited_once_with(offsets)
+
+
+@pytest.mark.asyncio
+async def test_consumer_logs_failed_commits(consumer, logger_mock):
+    consumer._kafka_consumer = AsyncMock()
+    consumer._kafka_consumer.commit.side_effect = aiokafka.errors.CommitFailedError
+    await consumer._commit({})
+    logger_mock.exception.assert_called_once_with("Failed to commit offsets")
+
+
+@pytest.mark.asyncio
+async def test_consumer_drain_waits_for_fetched_results_to_be_stored(consumer):
+    consumer._fetches, consumer._batches = asyncio.Queue(), asyncio.Queue()
+    await consumer._batches.put(([], {}))
+    drain = asyncio.create_task(DrainOnRevoke(consumer._drain).on_partitions_revoked(set()))
+    await asyncio.sleep(1e-3)
+    assert not drain.done()
+    consumer._batches.get_nowait()
+    consumer._batches.task_done()
+    await asyncio.wait_for(drain, 1)
+
+
+@pytest.mark.asyncio
+async def test_consumer_drain_returns_before_consuming(consumer):
+    await asyncio.wait_for(consumer._drain(), 1)
+
+
+@pytest.mark.asyncio
+async def test_consumer_counts_on_the_shared_counter(mocker):
+    shared_counter = MagicMock(value=0)
+    consumer = Consumer(MagicMock(), AsyncMock(), result.ResultSerde, shared_counter)
+    await consumer._incr_counter(3)
+    assert shared_counter.value == 3
+
+
+def test_consumer_reports_stats(consumer_auto_cancel, kafka_consumer_mock, logger_mock):
+    consumer_auto_cancel._stats_interval = 1e-3
+    consumer_auto_cancel._batch_size = 5
+    kafka_consumer_mock.return_value.getmany = getmany_mock()
+    consumer_auto_cancel.run()
+    reports = [c.args[2] for c in logger_mock.info.call_args_list if "stats" in c.args[0]]
+    assert reports[0].startswith(
+        "counter=0 decode_queue_depth=0 store_queue_depth=0 undecodable=0 fetch_latency_count=0"
+    )
+    assert "decode_latency_mean=0 " in reports[0]
+    assert "store_latency_max=0" in reports[0]
@@ -22,63 +22,100 @@ import pytest
 from aiohttp.client_exceptions import ClientOSError
 
 from tests.base import ActionRunnerBaseTester
+from walt import config
+from walt import envelope
 from walt import result
 from walt.action_runners import Producer
+from walt.circuit import CircuitBreaker
+from walt.http_client import PhaseTimings
+from walt.matcher import search_window
+from walt.serdes import DetectingSerde
+from walt.sharding import HashRing
+from walt.url_store import URLStore
+from walt.url_store import load_urls
 
 
-def test_producer_inits_with_a_cfg_arg():
+def test_producer_inits_with_a_cfg_arg(mocker):
+    load_urls = mocker.patch("walt.action_runners.load_urls")
     cfg_mock = MagicMock()
     producer = Producer(cfg_mock)
+    load_urls.assert_called_once_with(cfg_mock["url_map"], cfg_mock["url_source"], 0, 1)
+    assert producer._reload_config is None
+    assert producer._announce_interval == cfg_mock["announce_interval"]
+    assert producer._url_map == load_urls.return_value
+    assert producer._stats_interval == cfg_mock["stats_interval"]
+    assert producer._http == cfg_mock["http"]
     assert producer._headers == {"User-Agent": cfg_mock["user_agent"], **cfg_mock["headers"]}
+    assert isinstance(producer._serde, DetectingSerde)
     assert producer._interval == cfg_mock["interval"]
+    assert producer._interval_map == cfg_mock["interval_map"]
+    assert producer._jitter == cfg_mock["jitter"]
     assert producer._concurrent == cfg_mock["concurrent"]
+    assert producer._concurrency == cfg_mock["concurrency"]
+    assert producer._limiter is None
+    assert producer._host_limit == cfg_mock["host_limit"]
+    assert producer._host_limiter is None
+    assert producer._circuit == cfg_mock["circuit"]
+    assert producer._breaker is None
     assert producer._timeout == cfg_mock["timeout"]
+    assert producer._max_body_bytes == cfg_mock["max_body_bytes"]
+    assert producer._body_chunk_size == cfg_mock["body_chunk_size"]
+    assert producer._pattern_overlap == cfg_mock["pattern_overlap"]
+    assert producer._pattern_pool_cfg == cfg_mock["pattern_pool"]
+    assert producer._pattern_pool is None
+    assert producer._headers_only == cfg_mock["headers_only"]
+    assert producer._headers_only_map == cfg_mock["headers_only_map"]
+    assert producer._scheduler is None
     assert producer._session is None
+    assert producer._pool_stats is None
     assert producer._kafka_uri == cfg_mock["kafka"]["uri"]
     assert producer._kafka_topic == cfg_mock["kafka"]["topic"]
     assert producer._kafka_producer is None
+    assert producer._publish_queue_size == cfg_mock["kafka"]["publish_queue_size"]
+    assert producer._max_in_flight == cfg_mock["kafka"]["max_in_flight"]
+    assert producer._batch_results == cfg_mock["kafka"]["batch_results"]
+    assert producer._batch_interval == cfg_mock["kafka"]["batch_interval"]
+    assert producer._linger_ms == cfg_mock["kafka"]["linger_ms"]
+    assert producer._max_batch_size == cfg_mock["kafka"]["max_batch_size"]
+    assert producer._compression_type == cfg_mock["kafka"]["compression_type"]
+    assert producer._results is None
+    assert producer._cluster == cfg_mock["cluster"]
+    assert producer._membership is None
+    assert producer._ring is None
 
 
 @pytest.fixture
 def producer(mocker):
     mocker.patch.object(Producer, "_ssl_arguments", new_callable=lambda: {})
+    mocker.patch("walt.action_runners.load_urls")
     producer = Producer(MagicMock())
+    producer._stats_interval = 0
+    producer._http = config.CONFIG["http"]
+    producer._publish_queue_size = 10
+    producer._max_in_flight = 2
+    producer._batch_results = 1
+    producer._batch_interval = 0
+    producer._linger_ms = 0
+    producer._max_batch_size = 16384
+    producer._compression_type = ""
+    producer._cluster = config.CONFIG["cluster"]
+    producer._concurrency = config.CONFIG["concurrency"]
+    producer._host_limit = config.CONFIG["host_limit"]
+    producer._circuit = config.CONFIG["circuit"]
+    producer._pattern_pool_cfg = config.CONFIG["pattern_pool"]
     producer._interval = 1
+    producer._interval_map = {}
+    producer._jitter = 0
     producer._timeout = 1
+    producer._max_body_bytes = 1024
+    producer._body_chunk_size = 8
+    producer._pattern_overlap = 16
+    producer._headers_only = ""
+    producer._headers_only_map = {}
+    producer._announce_interval = 0
     return producer
 
 
-def test_compile_url_patterns_copies_url_map(producer):
-    url_map_mock = MagicMock()
-    producer._compile_url_patterns(url_map_mock)
-    url_map_mock.copy.assert_called_once_with()
-
-
-def test_compile_url_patterns_compiles_no_empty_url_map(producer):
-    assert producer._compile_url_patterns({}) == {}
-
-
-def test_compile_url_patterns_compiles_no_empty_pattern(producer):
-    url_map = {"wow-url.doge": "", "much-web.doge": ""}
-    assert producer._compile_url_patterns(url_map) == url_map
-
-
-def test_compile_url_patterns_compiles_patterns(producer):
-    url_map = {"wow-url.doge": "many-pat+ern", "much-web.doge": "(very-regular)*"}
-    new_url_map = producer._compile_url_patterns(url_map)
-    assert len(new_url_map) == len(url_map)
-    assert new_url_map != url_map
-
-
-def test_compile_url_patterns_nullifies_erroneous_patterns(producer, logger_mock):
-    url_map = {"wow-url.doge": "(many-error", "much-web.doge": "*very-failure"}
-    expected = {"wow-url.doge": None, "much-web.doge": None}
-    new_url_map = producer._compile_url_patterns(url_map)
-    assert len(new_url_map) == len(url_map)
-    assert new_url_map == expected
-    assert logger_mock.error.call_count == len(url_map)
-
-
 @pytest.mark.asyncio
 async def test_run_action_does_nothing_when_no_urls(producer, logger_mock):
     producer._url_map = {}
@@ -92,7 +129,51 @@ async def test_run_action_starts_a_client_session_with_headers(
 ):
     producer._process_urls = AsyncMock()
     await producer._run_action()
-    client_session_mock.assert_called_once_with(headers=producer._headers)
+    client_session_mock.assert_called_once_with(
+        headers=producer._headers, connector=ANY, trace_configs=[]
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_action_configures_the_connection_pool(
+    producer, client_session_mock, kafka_producer_mock, mocker
+):
+    tcp_connector_mock = mocker.patch("walt.http_client.aiohttp.TCPConnector")
+    producer._process_urls = AsyncMock()
+    producer._http = {
+        "limit": 17,
+        "limit_per_host": 3,
+        "ttl_dns_cache": 300,
+        "keepalive_timeout": 42,
+        "reuse_tls_context": True,
+        "trace_phases": False,
+    }
+    await producer._run_action()
+    tcp_connector_mock.assert_called_once_with(
+        limit=17,
+        limit_per_host=3,
+        ttl_dns_cache=300,
+        use_dns_cache=True,
+        keepalive_timeout=42,
+        ssl=ANY,
+    )
+    _, kwargs = client_session_mock.call_args
+    assert kwargs["connector"] is tcp_connector_mock.return_value
+
+
+@pytest.mark.asyncio
+async def test_run_action_traces_connections_when_reporting_stats(
+    producer, client_session_mock, kafka_producer_mock
+):
+    producer._process_urls = AsyncMock()
+    producer._create_task = MagicMock()
+    producer._stats_interval = 60
+    await producer._run_action()
+    _, kwargs = client_session_mock.call_args
+    assert len(kwargs["trace_configs"]) == 1
+    assert producer._pool_stats is not None
+    producer._create_task.assert_called_once_with(producer._report_stats)
+    assert "reuse_ratio" in producer._stats()
 
 
 @pytest.mark.asyncio
@@ -105,10 +186,23 @@ async def test_run_action_starts_kafka_producer(
         bootstrap_servers=producer._kafka_uri,
         request_timeout_ms=producer._timeout * 1000,
         retry_backoff_ms=producer._interval * 1000,
+        linger_ms=0,
+        max_batch_size=16384,
+        compression_type=None,
     )
     kafka_producer_mock.return_value.start.assert_called_once_with()
 
 
+@pytest.mark.asyncio
+async def test_run_action_configures_kafka_compression(
+    producer, client_session_mock, kafka_producer_mock
+):
+    producer._process_urls = AsyncMock()
+    producer._compression_type = "zstd"
+    await producer._run_action()
+    assert kafka_producer_mock.call_args.kwargs["compression_type"] == "zstd"
+
+
 @pytest.mark.asyncio
 async def test_start_kafka_producer_retries_with_backoff(producer, kafka_producer_mock, mocker):
     sleep_mocker = mocker.patch("walt.action_runners.asyncio.sleep", AsyncMock())
@@ -133,7 +227,7 @@ async def test_start_kafka_producer_logs_exception(
 
 @pytest.fixture
 def producer_process(producer):
-    producer._create_urls_queue = MagicMock(return_value=AsyncMock())
+    producer._url_map = URLStore([("very.url", ""), ("wow.wow.web", "")])
     producer._create_task = MagicMock()
     return producer
 
@@ -145,13 +239,33 @@ async def test_process_urls_creates_concurrent_worker_tasks(
 ):
     producer_process._concurrent = concurrent
     await producer_process._process_urls()
-    assert producer_process._create_task.call_count == concurrent
+    assert producer_process._create_task.call_count == concurrent + 2
+    producer_process._create_task.assert_any_call(producer_process._publisher)
+    producer_process._create_task.assert_any_call(producer_process._dispatcher, (ANY,))
     for i in range(concurrent):
         producer_process._create_task.assert_any_call(
             producer_process._worker, (f"producer-{i+1}", ANY)
         )
 
 
+@pytest.mark.asyncio
+async def test_process_urls_schedules_all_urls(producer_process, kafka_producer_mock):
+    await producer_process._process_urls()
+    assert len(producer_process._scheduler) == len(producer_process._url_map)
+    for url in producer_process._url_map:
+        assert url in producer_process._scheduler
+
+
+@pytest.mark.asyncio
+async def test_process_urls_schedules_urls_with_own_intervals(
+    producer_process, kafka_producer_mock
+):
+    producer_process._interval_map = {"very.url": 17}
+    await producer_process._process_urls()
+    assert producer_process._scheduler.interval("very.url") == 17
+    assert producer_process._scheduler.interval("wow.wow.web") == producer_process._interval
+
+
 class ProducerTester(ActionRunnerBaseTester, Producer):
     def run(self):
         with contextlib.suppress(KeyboardInterrupt):
@@ -171,12 +285,35 @@ def producer_auto_cancel(mocker):
             task.cancel()
 
     mocker.patch.object(ProducerTester, "_ssl_arguments", new_callable=lambda: {})
+    mocker.patch("walt.action_runners.load_urls")
     producer = ProducerTester(MagicMock())
     producer.register_tasks([(AsyncMock(side_effect=side_effect), (producer,))])
+    producer._stats_interval = 0
+    producer._http = config.CONFIG["http"]
+    producer._publish_queue_size = 10
+    producer._max_in_flight = 2
+    producer._batch_results = 1
+    producer._batch_interval = 0
+    producer._linger_ms = 0
+    producer._max_batch_size = 16384
+    producer._compression_type = ""
+    producer._cluster = config.CONFIG["cluster"]
+    producer._concurrency = config.CONFIG["concurrency"]
+    producer._host_limit = config.CONFIG["host_limit"]
+    producer._circuit = config.CONFIG["circuit"]
+    producer._pattern_pool_cfg = config.CONFIG["pattern_pool"]
     producer._interval = 1
+    producer._interval_map = {}
+    producer._jitter = 0
     producer._concurrent = 1
     producer._timeout = 1
-    producer._url_map = {"very.url": "", "wow.wow.web": ""}
+    producer._max_body_bytes = 1024
+    producer._body_chunk_size = 8
+    producer._pattern_overlap = 16
+    producer._headers_only = ""
+    producer._headers_only_map = {}
+    producer._announce_interval = 0
+    producer._url_map = URLStore([("very.url", ""), ("wow.wow.web", "")])
     return producer
 
 
@@ -185,14 +322,196 @@ def test_producer_sends_messages_successfully(
 ):
     client_session_get_mock.return_value.__aenter__.return_value.status = 200
     producer_auto_cancel.run()
-    res = result.ResultSerde.from_bytes(producer_auto_cancel._kafka_producer.send.call_args[0][1])
+    send_and_wait = producer_auto_cancel._kafka_producer.send_and_wait
+    res = result.ResultSerde.from_bytes(send_and_wait.call_args[0][1])
     assert res.result_type is result.ResultType.RESULT
     assert any(res.url == url for url in producer_auto_cancel._url_map)
     assert isinstance(res.response_time, float) and res.response_time > 0
     assert res.status_code == 200
     assert res.pattern == result.Pattern.NO_PATTERN
     assert isinstance(res.utc_timestamp_ms, int) and res.utc_timestamp_ms > 0
-    assert producer_auto_cancel._kafka_producer.send.await_count == producer_auto_cancel._counter
+    assert send_and_wait.await_count == producer_auto_cancel._counter
+
+
+def test_producer_sends_head_requests_in_headers_only_mode(
+    producer_auto_cancel,
+    client_session_mock,
+    client_session_get_mock,
+    client_session_head_mock,
+    kafka_producer_mock,
+):
+    resp = client_session_head_mock.return_value.__aenter__.return_value
+    resp.status = 204
+    resp.close = MagicMock()
+    producer_auto_cancel._headers_only = "HEAD"
+    producer_auto_cancel.run()
+    client_session_get_mock.assert_not_called()
+    client_session_head_mock.assert_any_call("very.url", timeout=1, allow_redirects=True)
+    resp.close.assert_called_with()
+    send_and_wait = producer_auto_cancel._kafka_producer.send_and_wait
+    res = result.ResultSerde.from_bytes(send_and_wait.call_args[0][1])
+    assert res.status_code == 204
+    assert res.pattern == result.Pattern.NO_PATTERN
+
+
+def test_producer_closes_get_requests_after_headers_in_headers_only_mode(
+    producer_auto_cancel,
+    client_session_mock,
+    client_session_get_mock,
+    client_session_head_mock,
+    resp_content_mock,
+    kafka_producer_mock,
+):
+    resp = client_session_get_mock.return_value.__aenter__.return_value
+    resp.status = 200
+    resp.close = MagicMock()
+    producer_auto_cancel._headers_only = "get"
+    producer_auto_cancel.run()
+    client_session_head_mock.assert_not_called()
+    resp.close.assert_called_with()
+    resp_content_mock.iter_chunked.assert_not_called()
+    send_and_wait = producer_auto_cancel._kafka_producer.send_and_wait
+    res = result.ResultSerde.from_bytes(send_and_wait.call_args[0][1])
+    assert res.status_code == 200
+    assert res.pattern == result.Pattern.NO_PATTERN
+
+
+def test_producer_traces_request_phases_if_asked_to(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.return_value.__aenter__.return_value.status = 200
+    producer_auto_cancel._http = {**config.CONFIG["http"], "trace_phases": True}
+    producer_auto_cancel.run()
+    _, kwargs = client_session_mock.call_args
+    assert len(kwargs["trace_configs"]) == 1
+    _, kwargs = client_session_get_mock.call_args
+    assert isinstance(kwargs["trace_request_ctx"], PhaseTimings)
+
+
+def test_producer_adapts_concurrency_if_asked_to(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.return_value.__aenter__.return_value.status = 200
+    concurrency = {**config.CONFIG["concurrency"], "adaptive": True, "max": 3}
+    producer_auto_cancel._concurrency = concurrency
+    producer_auto_cancel.run()
+    assert producer_auto_cancel._counter > 0
+    assert producer_auto_cancel._limiter.in_flight == 0
+    stats = producer_auto_cancel._stats()
+    assert 1 <= stats["concurrency_limit"] <= 3
+    assert "loop_lag" in stats
+
+
+def test_producer_postpones_checks_of_throttled_hosts(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.return_value.__aenter__.return_value.status = 200
+    producer_auto_cancel._url_map = URLStore(
+        [("http://so.host/wow", ""), ("http://so.host/such", "")]
+    )
+    producer_auto_cancel._host_limit = {"rate": 1, "burst": 1, "concurrent": 0}
+    producer_auto_cancel.run()
+    assert producer_auto_cancel._counter == 1
+    assert producer_auto_cancel._stats()["throttled"] > 0
+    assert len(producer_auto_cancel._scheduler) == 2
+
+
+def test_producer_opens_circuits_of_failing_urls(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.side_effect = aiohttp.ClientError
+    producer_auto_cancel._url_map = URLStore([("http://so.host/wow", "")])
+    producer_auto_cancel._interval = 1e-3
+    producer_auto_cancel._circuit = {"failure_threshold": 2, "backoff": 60, "max_backoff": 60}
+    producer_auto_cancel.run()
+    assert client_session_get_mock.call_count == 2
+    send_and_wait = producer_auto_cancel._kafka_producer.send_and_wait
+    res = result.ResultSerde.from_bytes(send_and_wait.call_args[0][1])
+    assert res.result_type is result.ResultType.CIRCUIT_OPEN
+    assert producer_auto_cancel._stats()["open_circuits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_producer_keeps_half_open_circuits_open_on_errors(producer, mocker):
+    producer._url_map = URLStore([("http://so.host/wow", "")])
+    producer._breaker = CircuitBreaker(failure_threshold=1, backoff=0, max_backoff=0)
+    producer._breaker.record("http://so.host/wow", "so.host", failed=True)
+    error = result.Result(result.ResultType.ERROR, "http://so.host/wow")
+    mocker.patch.object(producer, "_fetch", AsyncMock(return_value=error))
+    assert await producer._session_get("http://so.host/wow") is error
+    assert producer._breaker.open_circuits == 2
+
+
+@pytest.fixture
+def reloading_producer(producer):
+    producer._url_map = URLStore(
+        [("such.url", "doge"), ("many.url", ""), ("gone.url", ""), ("very.url", "wow")]
+    )
+    producer._interval = 10
+    producer._scheduler = producer._create_scheduler()
+    return producer
+
+
+def test_producer_applies_reloaded_urls(reloading_producer, mocker):
+    mocker.patch("walt.scheduler.time.monotonic", return_value=0)
+    scheduler = reloading_producer._scheduler
+    kept = ("many.url", "such.url", "very.url")
+    scheduler.postpone("such.url", 3)
+    dues = {url: scheduler.due(url) for url in kept}
+    url_map = URLStore(
+        [("such.url", "doge"), ("many.url", ""), ("very.url", "changed"), ("new.url", "")]
+    )
+    reloading_producer._apply_urls(url_map, {"many.url": 60})
+    assert reloading_producer._url_map is url_map
+    assert reloading_producer._url_map["very.url"].pattern == "changed"
+    assert sorted(url for url in url_map if url in scheduler) == [
+        "many.url",
+        "new.url",
+        "such.url",
+        "very.url",
+    ]
+    assert "gone.url" not in scheduler
+    assert all(scheduler.due(url) == dues[url] for url in kept)
+    assert scheduler.due("such.url") == pytest.approx(3, abs=1e-3)
+    assert scheduler.interval("many.url") == 60
+    assert reloading_producer._interval_map == {"many.url": 60}
+
+
+def test_producer_reloads_urls_from_the_config(reloading_producer, mocker):
+    cfg = {**config.CONFIG, "url_map": {"such.url": "doge", "new.url": ""}}
+    reloading_producer._reload_config = MagicMock(return_value=cfg)
+    mocker.patch("walt.action_runners.load_urls", side_effect=load_urls)
+    mocker.patch.object(reloading_producer, "_create_task")
+    reloading_producer._reload()
+    reload_urls = reloading_producer._create_task.call_args[0][0]
+    reloading_producer._loop.run_until_complete(reload_urls())
+    scheduler = reloading_producer._scheduler
+    assert sorted(url for url in reloading_producer._url_map if url in scheduler) == [
+        "new.url",
+        "such.url",
+    ]
+    assert len(scheduler) == 2
+
+
+def test_producer_keeps_urls_if_reloading_fails(reloading_producer, logger_mock):
+    reloading_producer._reload_config = MagicMock(side_effect=ValueError)
+    reloading_producer._loop.run_until_complete(reloading_producer._reload_urls())
+    assert len(reloading_producer._scheduler) == 4
+    assert logger_mock.exception.call_count == 1
+
+
+def test_producer_cannot_reload_without_a_config_file(producer, logger_mock):
+    producer._reload_config = None
+    producer._reload()
+    logger_mock.warning.assert_called_once_with("Cannot reload without a config file")
+
+
+def test_producer_headers_only_map_overrides_headers_only(producer):
+    producer._headers_only = "HEAD"
+    producer._headers_only_map = {"such.web": "", "much.regexp": "HEAD"}
+    assert producer._headers_only_method("wow.url", None) == "HEAD"
+    assert producer._headers_only_method("such.web", None) == ""
+    assert producer._headers_only_method("much.regexp", re.compile("doge")) == ""
 
 
 @pytest.mark.parametrize(
@@ -201,6 +520,8 @@ def test_producer_sends_messages_successfully(
         ("", None, result.Pattern.NO_PATTERN),
         (r"\w{,6}", None, result.Pattern.FOUND),
         (r"\w{6,}", None, result.Pattern.NOT_FOUND),
+        (r"jumps over", None, result.Pattern.FOUND),
+        (r"wow$", None, result.Pattern.FOUND),
         ("", aiohttp.ClientError, result.Pattern.IRRELEVANT),
         (r".*", aiohttp.ClientError, result.Pattern.IRRELEVANT),
     ],
@@ -212,17 +533,18 @@ def test_producer_sends_messages_with_pattern_result(
     producer_auto_cancel,
     client_session_mock,
     client_session_get_mock,
-    resp_text_mock,
+    resp_content_mock,
     kafka_producer_mock,
 ):
     client_session_get_mock.return_value.__aenter__.return_value.status = 200
-    resp_text_mock.return_value = "Such quick fox jumps over the many lazy dog wow"
+    resp_content_mock.body = b"Such quick fox jumps over the many lazy dog wow"
     client_session_get_mock.side_effect = side_effect
-    producer_auto_cancel._url_map = {"such.web": re.compile(regexp) if regexp else None}
+    producer_auto_cancel._url_map = URLStore([("such.web", regexp)])
     producer_auto_cancel.run()
-    res = result.ResultSerde.from_bytes(producer_auto_cancel._kafka_producer.send.call_args[0][1])
+    send_and_wait = producer_auto_cancel._kafka_producer.send_and_wait
+    res = result.ResultSerde.from_bytes(send_and_wait.call_args[0][1])
     assert res.pattern == pattern
-    assert producer_auto_cancel._kafka_producer.send.await_count == producer_auto_cancel._counter
+    assert send_and_wait.await_count == producer_auto_cancel._counter
 
 
 @pytest.mark.parametrize(
@@ -245,12 +567,13 @@ def test_producer_sends_messages_on_client_failure(
 ):
     client_session_get_mock.side_effect = side_effect
     producer_auto_cancel.run()
-    res = result.ResultSerde.from_bytes(producer_auto_cancel._kafka_producer.send.call_args[0][1])
+    send_and_wait = producer_auto_cancel._kafka_producer.send_and_wait
+    res = result.ResultSerde.from_bytes(send_and_wait.call_args[0][1])
     assert res.result_type is result_type
     assert res.response_time == 0
     assert res.status_code == 0
     assert res.pattern == result.Pattern.IRRELEVANT
-    assert producer_auto_cancel._kafka_producer.send.await_count == producer_auto_cancel._counter
+    assert send_and_wait.await_count == producer_auto_cancel._counter
 
 
 @pytest.mark.parametrize(
@@ -274,14 +597,449 @@ def test_producer_logs_on_client_failure(
 ):
     client_session_get_mock.side_effect = side_effect
     producer_auto_cancel.run()
-    getattr(logger_mock, logger_func).assert_called_once()
+    assert getattr(logger_mock, logger_func).call_count == len(producer_auto_cancel._url_map)
 
 
 def test_producer_worker_logs_exception_on_kafka_send_failure(
     producer_auto_cancel, client_session_mock, kafka_producer_mock, logger_mock
 ):
-    kafka_producer_mock.return_value.send = AsyncMock(
+    kafka_producer_mock.return_value.send_and_wait = AsyncMock(
         side_effect=aiokafka.errors.KafkaTimeoutError
     )
     producer_auto_cancel.run()
-    logger_mock.exception.assert_called_once()
+    assert logger_mock.exception.call_count == len(producer_auto_cancel._url_map)
+    msg, count, size, topic = logger_mock.exception.call_args.args
+    assert msg == "Failed to send %d results (%d bytes) to %s!"
+    assert (count, topic) == (1, producer_auto_cancel._kafka_topic)
+    assert isinstance(size, int)
+    assert producer_auto_cancel._counter == 0
+    assert producer_auto_cancel._failed_results == len(producer_auto_cancel._url_map)
+
+
+def test_producer_checks_due_urls_without_waiting_for_other_urls(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.return_value.__aenter__.return_value.status = 200
+    producer_auto_cancel._interval = 1e-3
+    producer_auto_cancel._interval_map = {"wow.wow.web": 1e3}
+    producer_auto_cancel.run()
+    sent = [
+        result.ResultSerde.from_bytes(args[0][1]).url_id
+        for args in producer_auto_cancel._kafka_producer.send_and_wait.call_args_list
+    ]
+    assert sent.count(result.hash_url("wow.wow.web")) == 1
+    assert sent.count(result.hash_url("very.url")) > 1
+
+
+def test_producer_marks_its_results_with_its_producer_id(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.return_value.__aenter__.return_value.status = 200
+    producer_auto_cancel._cluster = {**config.CONFIG["cluster"], "node_id": "doge"}
+    producer_auto_cancel.run()
+    sent = [
+        result.ResultSerde.from_bytes(args[0][1]).producer_id
+        for args in producer_auto_cancel._kafka_producer.send_and_wait.call_args_list
+    ]
+    assert sent and set(sent) == {result.hash_node("doge")}
+
+
+def test_producer_sends_each_url_along_with_its_first_result_only(
+    producer_auto_cancel, client_session_mock, client_session_get_mock, kafka_producer_mock
+):
+    client_session_get_mock.return_value.__aenter__.return_value.status = 200
+    producer_auto_cancel._interval = 1e-3
+    producer_auto_cancel.run()
+    sent = [
+        result.ResultSerde.from_bytes(args[0][1])
+        for args in producer_auto_cancel._kafka_producer.send_and_wait.call_args_list
+    ]
+    assert len(sent) > len(producer_auto_cancel._url_map)
+    urls = [res.url for res in sent if res.url]
+    assert sorted(urls) == sorted(producer_auto_cancel._url_map)
+    assert {res.url_id for res in sent} == {result.hash_url(url) for url in urls}
+
+
+def test_producer_announces_urls_again_every_announce_interval(producer, mocker):
+    monotonic = mocker.patch("walt.action_runners.time.monotonic", return_value=0)
+    producer._url_map = URLStore([("wow.url", ""), ("such.url", "")])
+    producer._announce_interval = 60
+    producer._forget_announced_urls()
+
+    def sent_url(url):
+        res = result.Result(result.ResultType.RESULT, url)
+        producer._strip_announced_url(res)
+        return res.url
+
+    assert sent_url("wow.url") == "wow.url"
+    monotonic.return_value = 59
+    assert sent_url("wow.url") == ""
+    assert sent_url("such.url") == "such.url"
+    monotonic.return_value = 60
+    assert sent_url("wow.url") == "wow.url"
+    assert sent_url("such.url") == "such.url"
+    assert sent_url("wow.url") == ""
+
+
+def test_producer_announces_urls_once_without_announce_interval(producer, mocker):
+    monotonic = mocker.patch("walt.action_runners.time.monotonic", return_value=0)
+    producer._url_map = URLStore([("wow.url", "")])
+    producer._forget_announced_urls()
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    producer._strip_announced_url(res)
+    monotonic.return_value = 1e9
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    producer._strip_announced_url(res)
+    assert res.url == ""
+
+
+def test_producer_announces_urls_again_after_failing_to_send(producer):
+    producer._url_map = URLStore([("wow.url", "")])
+    producer._announced_urls = bytearray(b"\x01")
+    producer._kafka_producer = AsyncMock()
+    producer._kafka_producer.send_and_wait.side_effect = Exception("such failure")
+    asyncio.run(producer._kafka_send(b"wow"))
+    assert not any(producer._announced_urls)
+
+
+@pytest.fixture
+def resp_mock(resp_content_mock):
+    return MagicMock(content=resp_content_mock, charset=None)
+
+
+@pytest.mark.asyncio
+async def test_check_pattern_stops_reading_once_pattern_is_found(producer, resp_mock):
+    chunks_read = 0
+
+    async def iter_chunked(size):
+        nonlocal chunks_read
+        for chunk in (b"such ", b"doge", b" wow", b" many", b" bytes"):
+            chunks_read += 1
+            yield chunk
+
+    resp_mock.content.iter_chunked.side_effect = iter_chunked
+    regexp = re.compile("doge")
+    assert await producer._check_pattern("such.web", regexp, resp_mock) is result.Pattern.FOUND
+    assert chunks_read == 3
+
+
+@pytest.mark.asyncio
+async def test_check_pattern_reads_at_most_max_body_bytes(producer, resp_mock):
+    resp_mock.content.body = b"x" * 64 + b"doge"
+    regexp = re.compile("doge")
+    producer._max_body_bytes = 64
+    assert await producer._check_pattern("such.web", regexp, resp_mock) is result.Pattern.NOT_FOUND
+    producer._max_body_bytes = 68
+    assert await producer._check_pattern("such.web", regexp, resp_mock) is result.Pattern.FOUND
+
+
+@pytest.mark.asyncio
+async def test_check_pattern_decodes_body_with_response_charset(producer, resp_mock):
+    resp_mock.content.body = "Olá, cão!".encode("latin-1")
+    resp_mock.charset = "latin-1"
+    regexp = re.compile("cão")
+    assert await producer._check_pattern("such.web", regexp, resp_mock) is result.Pattern.FOUND
+
+
+@pytest.mark.asyncio
+async def test_check_pattern_searches_large_windows_in_the_pattern_pool(producer, resp_mock):
+    resp_mock.content.body = b"such doge wow"
+    regexp = re.compile("doge")
+    producer._body_chunk_size = 4
+    producer._pattern_overlap = 4
+    producer._pattern_pool_cfg = {"min_size": 8, "budget": 0}
+    producer._pattern_pool = MagicMock()
+    producer._pattern_pool.search = AsyncMock(side_effect=lambda window, _: search_window(window))
+    assert await producer._check_pattern("such.web", regexp, resp_mock) is result.Pattern.FOUND
+    searched = [c.args[0].text for c in producer._pattern_pool.search.call_args_list]
+    assert searched and all(len(text) >= 8 for text in searched)
+    assert producer._pattern_pool.search.call_args.args[1] is None
+
+
+@pytest.mark.asyncio
+async def test_check_pattern_takes_search_time_from_the_budget(producer, resp_mock, mocker):
+    resp_mock.content.body = b"x" * 32
+    regexp = re.compile("doge")
+    producer._body_chunk_size = 8
+    producer._pattern_pool_cfg = {"min_size": 1, "budget": 10}
+    producer._pattern_pool = MagicMock(search=AsyncMock(return_value=False))
+    mocker.patch("walt.action_runners.time.monotonic", side_effect=range(0, 100, 3))
+    assert await producer._check_pattern("such.web", regexp, resp_mock) is result.Pattern.NOT_FOUND
+    budgets = [c.args[1] for c in producer._pattern_pool.search.call_args_list]
+    assert budgets == [10, 7, 4, 1, -2]
+
+
+@pytest.mark.asyncio
+async def test_check_pattern_gives_up_when_over_budget(producer, resp_mock, logger_mock):
+    resp_mock.content.body = b"such doge wow"
+    regexp = re.compile("doge")
+    producer._pattern_pool_cfg = {"min_size": 1, "budget": 1}
+    producer._pattern_pool = MagicMock(search=AsyncMock(side_effect=asyncio.TimeoutError))
+    pattern = await producer._check_pattern("such.web", regexp, resp_mock)
+    assert pattern is result.Pattern.BUDGET_EXCEEDED
+    logger_mock.warning.assert_called_once_with("Searching %s exceeded its budget", "such.web")
+
+
+@pytest.fixture
+def cluster_producer(producer):
+    producer._url_map = URLStore((f"wow-{i}.url", "") for i in range(200))
+    producer._membership = MagicMock(node_id="doge")
+    producer._ring = HashRing(["doge"])
+    return producer
+
+
+def test_producer_owns_all_urls_without_a_cluster(producer):
+    assert producer._owns("wow.url")
+
+
+def test_producer_owns_urls_assigned_to_it_by_the_ring(cluster_producer):
+    cluster_producer._rebalance(["doge", "kabosu"])
+    owned = [url for url in cluster_producer._url_map if cluster_producer._owns(url)]
+    ring = HashRing(["doge", "kabosu"])
+    assert owned == [url for url in cluster_producer._url_map if ring.node_for(url) == "doge"]
+    assert 0 < len(owned) < len(cluster_producer._url_map)
+
+
+@pytest.mark.asyncio
+async def test_producer_rebalances_only_urls_that_move(cluster_producer):
+    cluster_producer._scheduler = cluster_producer._create_scheduler()
+    assert len(cluster_producer._scheduler) == len(cluster_producer._url_map)
+    cluster_producer._rebalance(["doge", "kabosu"])
+    kept = {url for url in cluster_producer._url_map if url in cluster_producer._scheduler}
+    assert kept == {url for url in cluster_producer._url_map if cluster_producer._owns(url)}
+    cluster_producer._rebalance(["cheems", "doge", "kabosu"])
+    now_kept = {url for url in cluster_producer._url_map if url in cluster_producer._scheduler}
+    assert now_kept < kept
+    cluster_producer._rebalance(["doge"])
+    assert len(cluster_producer._scheduler) == len(cluster_producer._url_map)
+    assert cluster_producer._ring.nodes == {"doge"}
+
+
+@pytest.mark.asyncio
+async def test_producer_joins_and_leaves_the_cluster(
+    producer, client_session_mock, kafka_producer_mock, kafka_consumer_mock, mocker
+):
+    mocker.patch("walt.action_runners.asyncio.sleep", AsyncMock())
+    producer._process_urls = AsyncMock()
+    producer._create_task = MagicMock()
+    producer._cluster = {**config.CONFIG["cluster"], "enabled": True, "node_id": "doge"}
+    await producer._run_action()
+    assert producer._membership.node_id == "doge"
+    assert producer._ring.nodes == {"doge"}
+    producer._create_task.assert_any_call(producer._membership.listen, (ANY,))
+    kafka_consumer_mock.return_value.start.assert_awaited_once_with()
+    kafka_consumer_mock.return_value.stop.assert_awaited_once_with()
+    kafka_producer_mock.return_value.send_and_wait.assert_awaited_once_with(
+        "walt-control", b'{"node": "doge", "state": "leaving"}'
+    )
+
+
+def test_producer_reschedules_url_when_worker_fails(
+    producer_auto_cancel, client_session_mock, kafka_producer_mock, mocker
+):
+    mocker.patch.object(ProducerTester, "_session_get", AsyncMock(side_effect=RuntimeError))
+    producer_auto_cancel._url_map = URLStore([("very.url", "")])
+    producer_auto_cancel.run()
+    assert "very.url" in producer_auto_cancel._scheduler
+    assert producer_auto_cancel._scheduler._heap
+
+
+@pytest.fixture
+def publishing_producer(producer, kafka_producer_mock):
+    producer._kafka_producer = kafka_producer_mock.return_value
+    producer._results = asyncio.Queue(maxsize=producer._publish_queue_size)
+    producer._in_flight = asyncio.Semaphore(producer._max_in_flight)
+    return producer
+
+
+@pytest.mark.asyncio
+async def test_publisher_keeps_at_most_max_in_flight_sends(publishing_producer):
+    release = asyncio.Event()
+    in_flight, max_in_flight = 0, 0
+
+    async def send_and_wait(topic, msg):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await release.wait()
+        in_flight -= 1
+
+    publishing_producer._kafka_producer.send_and_wait.side_effect = send_and_wait
+    for i in range(5):
+        publishing_producer._results.put_nowait(f"wow-{i}".encode())
+    publisher = asyncio.create_task(publishing_producer._publisher())
+    await asyncio.sleep(1e-2)
+    assert max_in_flight == publishing_producer._max_in_flight
+    assert publishing_producer._stats()["sends_in_flight"] == 2
+    assert publishing_producer._stats()["publish_queue_depth"] == 2
+    release.set()
+    await asyncio.sleep(1e-2)
+    publisher.cancel()
+    assert publishing_producer._counter == 5
+    assert publishing_producer._kafka_producer.send_and_wait.await_count == 5
+
+
+@pytest.mark.asyncio
+async def test_publisher_counts_failed_sends_apart(publishing_producer):
+    publishing_producer._batch_results = 2
+    publishing_producer._kafka_producer.send_and_wait.side_effect = [
+        aiokafka.errors.KafkaTimeoutError,
+        None,
+    ]
+    for i in range(4):
+        publishing_producer._results.put_nowait(f"wow-{i}".encode())
+    await publishing_producer._flush_results()
+    stats = publishing_producer._stats()
+    assert stats["counter"] == 2
+    assert stats["failed_results"] == 2
+    assert stats["send_latency_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_workers_wait_while_publish_queue_is_full(publishing_producer, mocker):
+    publishing_producer._url_map = URLStore([("very.url", "")])
+    publishing_producer._scheduler = publishing_producer._create_scheduler()
+    publishing_producer._announced_urls = bytearray(1)
+    mocker.patch.object(
+        publishing_producer,
+        "_session_get",
+        AsyncMock(return_value=result.Result(result.ResultType.RESULT, "very.url")),
+    )
+    publishing_producer._publish_queue_size = 1
+    publishing_producer._results = asyncio.Queue(maxsize=1)
+    due_urls = asyncio.Queue()
+    for _ in range(3):
+        due_urls.put_nowait("very.url")
+    worker = asyncio.create_task(publishing_producer._check_urls("producer-1", due_urls))
+    await asyncio.sleep(1e-2)
+    assert publishing_producer._results.full()
+    assert due_urls.qsize() == 1
+    worker.cancel()
+
+
+@pytest.fixture
+def racing_producer(publishing_producer, mocker):
+    publishing_producer._url_map = URLStore([("very.url", ""), ("gone.url", "")])
+    publishing_producer._scheduler = publishing_producer._create_scheduler()
+    publishing_producer._announced_urls = bytearray(2)
+
+    async def session_get(url):
+        return result.Result(result.ResultType.RESULT, url)
+
+    mocker.patch.object(publishing_producer, "_session_get", AsyncMock(side_effect=session_get))
+    return publishing_producer
+
+
+@pytest.mark.asyncio
+async def test_worker_drops_urls_removed_by_a_reload_while_queued(racing_producer):
+    due_urls = asyncio.Queue()
+    due_urls.put_nowait("gone.url")
+    due_urls.put_nowait("very.url")
+    racing_producer._apply_urls(URLStore([("very.url", "")]), {})
+    worker = asyncio.create_task(racing_producer._worker("producer-1", due_urls))
+    await asyncio.sleep(1e-2)
+    assert not worker.done()
+    worker.cancel()
+    racing_producer._session_get.assert_awaited_once_with("very.url")
+    assert racing_producer._results.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_worker_drops_urls_removed_by_a_reload_while_limited(racing_producer):
+    racing_producer._concurrent = 1
+    racing_producer._concurrency = {**config.CONFIG["concurrency"], "min": 1, "max": 1}
+    racing_producer._limiter = racing_producer._create_limiter()
+    started = await racing_producer._limiter.acquire()
+    due_urls = asyncio.Queue()
+    due_urls.put_nowait("gone.url")
+    worker = asyncio.create_task(racing_producer._worker("producer-1", due_urls))
+    await asyncio.sleep(1e-3)
+    racing_producer._apply_urls(URLStore([("very.url", "")]), {})
+    racing_producer._limiter.release(started)
+    await asyncio.sleep(1e-2)
+    assert not worker.done()
+    worker.cancel()
+    racing_producer._session_get.assert_not_awaited()
+    assert racing_producer._limiter.in_flight == 0
+    assert racing_producer._results.empty()
+
+
+@pytest.mark.asyncio
+async def test_session_get_searches_urls_removed_by_a_reload_while_fetching(producer, resp_mock):
+    producer._url_map = URLStore([("such.web", "doge")])
+    producer._timeout = 1
+    producer._max_body_bytes = 1024
+    producer._body_chunk_size = 8
+    producer._pattern_overlap = 16
+    producer._pattern_pool_cfg = config.CONFIG["pattern_pool"]
+    resp_mock.content.body = b"such doge wow"
+    resp_mock.status = 200
+
+    async def reload_and_respond():
+        producer._url_map = URLStore([("very.url", "")])
+        return resp_mock
+
+    request = MagicMock()
+    request.__aenter__.side_effect = reload_and_respond
+    producer._session = MagicMock(get=MagicMock(return_value=request))
+    res = await producer._session_get("such.web")
+    assert res.result_type is result.ResultType.RESULT
+    assert res.pattern is result.Pattern.FOUND
+    assert await producer._session_get("such.web") is None
+    assert producer._session.get.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_publisher_sends_batches_of_results_in_envelopes(publishing_producer):
+    publishing_producer._batch_results = 3
+    publishing_producer._batch_interval = 1
+    for i in range(4):
+        publishing_producer._results.put_nowait(f"wow-{i}".encode())
+    publisher = asyncio.create_task(publishing_producer._publisher())
+    await asyncio.sleep(1e-2)
+    send_and_wait = publishing_producer._kafka_producer.send_and_wait
+    assert send_and_wait.await_count == 1
+    assert envelope.unpack(send_and_wait.call_args.args[1]) == [b"wow-0", b"wow-1", b"wow-2"]
+    assert publishing_producer._batch == [b"wow-3"]
+    publishing_producer._results.put_nowait(b"wow-4")
+    publishing_producer._results.put_nowait(b"wow-5")
+    await asyncio.sleep(1e-2)
+    publisher.cancel()
+    assert send_and_wait.await_count == 2
+    assert publishing_producer._counter == 6
+
+
+@pytest.mark.asyncio
+async def test_publisher_sends_a_partial_batch_after_batch_interval(publishing_producer):
+    publishing_producer._batch_results = 3
+    publishing_producer._batch_interval = 1e-2
+    publishing_producer._results.put_nowait(b"wow-0")
+    publishing_producer._results.put_nowait(b"wow-1")
+    publisher = asyncio.create_task(publishing_producer._publisher())
+    await asyncio.sleep(5e-2)
+    publisher.cancel()
+    send_and_wait = publishing_producer._kafka_producer.send_and_wait
+    assert envelope.unpack(send_and_wait.call_args.args[1]) == [b"wow-0", b"wow-1"]
+
+
+@pytest.mark.asyncio
+async def test_flush_results_sends_batched_results(publishing_producer):
+    publishing_producer._batch_results = 2
+    publishing_producer._batch = [b"wow-0"]
+    for i in range(1, 4):
+        publishing_producer._results.put_nowait(f"wow-{i}".encode())
+    await publishing_producer._flush_results()
+    sent = [c.args[1] for c in publishing_producer._kafka_producer.send_and_wait.call_args_list]
+    assert [envelope.unpack(msg) for msg in sent] == [[b"wow-0", b"wow-1"], [b"wow-2", b"wow-3"]]
+    assert publishing_producer._counter == 4
+
+
+@pytest.mark.asyncio
+async def test_flush_results_sends_queued_results(publishing_producer):
+    for i in range(5):
+        publishing_producer._results.put_nowait(f"wow-{i}".encode())
+    await publishing_producer._flush_results()
+    assert publishing_producer._kafka_producer.send_and_wait.await_count == 5
+    assert publishing_producer._results.empty()
+    assert not publishing_producer._sends
+    assert publishing_producer._stats()["send_latency_count"] == 5
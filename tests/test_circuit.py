@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import pytest
+
+from walt.circuit import CircuitBreaker
+
+
+@pytest.fixture
+def monotonic_mock(mocker):
+    return mocker.patch("walt.circuit.time.monotonic", return_value=0)
+
+
+@pytest.fixture
+def breaker(monotonic_mock):
+    return CircuitBreaker(failure_threshold=3, backoff=10, max_backoff=25)
+
+
+def fail(breaker, times, url="http://wow.host/such", host="wow.host"):
+    for _ in range(times):
+        breaker.record(url, host, failed=True)
+
+
+def test_circuit_breaker_opens_after_consecutive_failures(breaker, logger_mock):
+    fail(breaker, 2)
+    assert breaker.allow("http://wow.host/such", "wow.host")
+    fail(breaker, 1)
+    assert not breaker.allow("http://wow.host/such", "wow.host")
+    assert breaker.open_circuits == 2
+    logger_mock.warning.assert_any_call("Circuit of %s open, probing it in %ss", "wow.host", 10)
+
+
+def test_circuit_breaker_counts_consecutive_failures_only(breaker):
+    fail(breaker, 2)
+    breaker.record("http://wow.host/such", "wow.host", failed=False)
+    fail(breaker, 2)
+    assert breaker.allow("http://wow.host/such", "wow.host")
+
+
+def test_circuit_breaker_opens_circuits_of_hosts(breaker):
+    fail(breaker, 1, "http://wow.host/such")
+    fail(breaker, 1, "http://wow.host/many")
+    fail(breaker, 1, "http://wow.host/very")
+    assert not breaker.allow("http://wow.host/much", "wow.host")
+    assert breaker.allow("http://such.host/", "such.host")
+
+
+def test_circuit_breaker_lets_a_single_probe_through(breaker, monotonic_mock):
+    fail(breaker, 3)
+    monotonic_mock.return_value = 10
+    assert breaker.allow("http://wow.host/such", "wow.host")
+    assert not breaker.allow("http://wow.host/such", "wow.host")
+    assert not breaker.allow("http://wow.host/many", "wow.host")
+
+
+def test_circuit_breaker_closes_after_a_successful_probe(breaker, monotonic_mock, logger_mock):
+    fail(breaker, 3)
+    monotonic_mock.return_value = 10
+    breaker.allow("http://wow.host/such", "wow.host")
+    breaker.record("http://wow.host/such", "wow.host", failed=False)
+    assert breaker.allow("http://wow.host/such", "wow.host")
+    assert breaker.open_circuits == 0
+    logger_mock.info.assert_any_call("Circuit of %s closed", "wow.host")
+
+
+def test_circuit_breaker_backs_off_exponentially(breaker, monotonic_mock):
+    fail(breaker, 3)
+    for now, backoff in [(10, 20), (30, 25), (55, 25)]:
+        monotonic_mock.return_value = now
+        assert breaker.allow("http://wow.host/such", "wow.host")
+        fail(breaker, 1)
+        monotonic_mock.return_value = now + backoff - 1
+        assert not breaker.allow("http://wow.host/such", "wow.host")
+
+
+def test_circuit_breaker_ignores_late_failures_of_open_circuits(breaker, monotonic_mock):
+    fail(breaker, 5)
+    monotonic_mock.return_value = 10
+    assert breaker.allow("http://wow.host/such", "wow.host")
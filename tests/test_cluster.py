@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import call
+
+import pytest
+
+from walt.cluster import Membership
+
+
+def message(node, state="alive"):
+    return json.dumps({"node": node, "state": state}).encode()
+
+
+@pytest.fixture
+def on_change():
+    return MagicMock()
+
+
+@pytest.fixture
+def membership(on_change):
+    return Membership("doge", 1, 10, on_change)
+
+
+def test_membership_starts_with_itself(membership, on_change):
+    assert membership.members == ["doge"]
+    on_change.assert_not_called()
+
+
+def test_membership_adds_joining_nodes(membership, on_change):
+    membership.handle(message("kabosu"))
+    membership.handle(message("cheems"))
+    assert membership.members == ["cheems", "doge", "kabosu"]
+    on_change.assert_has_calls([call(["doge", "kabosu"]), call(["cheems", "doge", "kabosu"])])
+
+
+def test_membership_does_not_change_on_heartbeats_of_known_nodes(membership, on_change):
+    membership.handle(message("kabosu"))
+    membership.handle(message("kabosu"))
+    assert on_change.call_count == 1
+
+
+def test_membership_ignores_its_own_messages(membership, on_change):
+    membership.handle(message("doge"))
+    membership.handle(message("doge", "leaving"))
+    assert membership.members == ["doge"]
+    on_change.assert_not_called()
+
+
+def test_membership_removes_leaving_nodes(membership, on_change):
+    membership.handle(message("kabosu"))
+    membership.handle(message("kabosu", "leaving"))
+    membership.handle(message("cheems", "leaving"))
+    assert membership.members == ["doge"]
+    assert on_change.call_args_list == [call(["doge", "kabosu"]), call(["doge"])]
+
+
+@pytest.mark.parametrize("value", [b"wow", b"{}", b"[]", b'{"node": "kabosu"}'])
+def test_membership_logs_invalid_messages(value, membership, on_change, mocker):
+    logger_mock = mocker.patch("walt.cluster.logger")
+    membership.handle(value)
+    logger_mock.error.assert_called_once()
+    on_change.assert_not_called()
+
+
+def test_membership_expires_silent_nodes(membership, on_change, mocker):
+    monotonic_mock = mocker.patch("walt.cluster.time.monotonic", return_value=100)
+    membership.handle(message("kabosu"))
+    monotonic_mock.return_value = 105
+    membership.handle(message("cheems"))
+    monotonic_mock.return_value = 112
+    membership.expire()
+    assert membership.members == ["cheems", "doge"]
+    assert on_change.call_args == call(["cheems", "doge"])
+
+
+@pytest.mark.asyncio
+async def test_membership_sends_heartbeats_and_expires(membership, mocker):
+    sleep_mock = mocker.patch(
+        "walt.cluster.asyncio.sleep", AsyncMock(side_effect=[None, Exception])
+    )
+    mocker.patch.object(membership, "expire")
+    send = AsyncMock()
+    with pytest.raises(Exception):
+        await membership.heartbeat(send)
+    send.assert_awaited_with(message("doge"))
+    assert send.await_count == 2
+    assert membership.expire.call_count == 2
+    sleep_mock.assert_awaited_with(1)
+
+
+@pytest.mark.asyncio
+async def test_membership_leaves(membership):
+    send = AsyncMock()
+    await membership.leave(send)
+    send.assert_awaited_once_with(message("doge", "leaving"))
+
+
+@pytest.mark.asyncio
+async def test_membership_listens_to_consumer(membership):
+    consumer = MagicMock()
+    consumer.__aiter__.return_value = [MagicMock(value=message("kabosu"))]
+    await membership.listen(consumer)
+    assert membership.members == ["doge", "kabosu"]
+
+
+class FlakyConsumer:
+    def __init__(self, failures, messages):
+        self._failures = failures
+        self._messages = messages
+
+    async def __aiter__(self):
+        if self._failures:
+            self._failures -= 1
+            raise asyncio.TimeoutError
+        for msg in self._messages:
+            yield msg
+
+
+@pytest.mark.asyncio
+async def test_membership_keeps_listening_when_consumer_fails(membership, mocker):
+    sleep_mock = mocker.patch("walt.asyncio.sleep", AsyncMock())
+    logger_mock = mocker.patch("walt.logger")
+    consumer = FlakyConsumer(2, [MagicMock(value=message("kabosu"))])
+    await membership.listen(consumer)
+    assert logger_mock.exception.call_count == 2
+    assert sleep_mock.await_count == 2
+    assert membership.members == ["doge", "kabosu"]
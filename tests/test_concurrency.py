@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import asyncio
+
+import pytest
+
+from walt.concurrency import AIMDLimiter
+
+
+def test_aimd_limiter_starts_within_bounds():
+    assert AIMDLimiter(1000, 2, 10).limit == 10
+    assert AIMDLimiter(0, 2, 10).limit == 2
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_bounds_checks_in_flight():
+    limiter = AIMDLimiter(2, 1, 10)
+    await limiter.acquire()
+    started = await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(1e-3)
+    assert not waiter.done()
+    limiter.release(started)
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_grows_additively_while_checks_wait():
+    limiter = AIMDLimiter(2, 1, 10)
+    for _ in range(2):
+        await limiter.acquire()
+    waiters = [asyncio.create_task(limiter.acquire()) for _ in range(5)]
+    await asyncio.sleep(1e-3)
+    for _ in range(4):
+        limiter.release(0, latency=0.1)
+    assert limiter.limit == 3
+    for waiter in waiters:
+        waiter.cancel()
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_does_not_grow_without_waiting_checks():
+    limiter = AIMDLimiter(2, 1, 10)
+    for _ in range(10):
+        started = await limiter.acquire()
+        limiter.release(started, latency=0.1)
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_shrinks_once_per_burst_of_timeouts():
+    limiter = AIMDLimiter(10, 1, 10, backoff=0.5)
+    started = [await limiter.acquire() for _ in range(3)]
+    for s in started:
+        limiter.release(s, timed_out=True)
+    assert limiter.limit == 5
+    limiter.release(await limiter.acquire(), timed_out=True)
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_does_not_shrink_below_minimum():
+    limiter = AIMDLimiter(2, 2, 10, backoff=0.5)
+    limiter.release(await limiter.acquire(), timed_out=True)
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_shrinks_when_latency_rises():
+    limiter = AIMDLimiter(10, 1, 10, backoff=0.5, latency_tolerance=2)
+    for _ in range(10):
+        limiter.release(await limiter.acquire(), latency=0.1)
+    assert limiter.limit == 10
+    for _ in range(3):
+        limiter.release(await limiter.acquire(), latency=1)
+    assert limiter.limit < 10
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_shrinks_when_the_loop_lags():
+    limiter = AIMDLimiter(10, 1, 10, backoff=0.5, max_loop_lag=0.1)
+    limiter.loop_lag = 0.2
+    limiter.release(await limiter.acquire(), latency=0.1)
+    assert limiter.limit == 5
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_hands_slots_of_cancelled_waiters_over():
+    limiter = AIMDLimiter(1, 1, 10)
+    started = await limiter.acquire()
+    cancelled = asyncio.create_task(limiter.acquire())
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(1e-3)
+    cancelled.cancel()
+    limiter.release(started)
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_aimd_limiter_monitors_loop_lag():
+    limiter = AIMDLimiter(1, 1, 10)
+    monitor = asyncio.create_task(limiter.monitor_loop_lag(1e-3))
+    await asyncio.sleep(5e-3)
+    monitor.cancel()
+    assert 0 <= limiter.loop_lag < 1
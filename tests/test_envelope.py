@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import pytest
+
+from walt import envelope
+
+
+def test_envelope_round_trips_messages():
+    messages = [b"wow", b"", b"such\ndoge"]
+    value = envelope.pack(messages)
+    assert envelope.is_envelope(value)
+    assert envelope.unpack(value) == messages
+
+
+def test_envelope_unpacks_memoryviews_of_the_value():
+    unpacked = envelope.unpack(envelope.pack([b"wow"]))
+    assert isinstance(unpacked[0], memoryview)
+
+
+@pytest.mark.parametrize("value", [b"1\nwow.web\n0.359\n200\n2\n719", b"\x01wow", b""])
+def test_envelope_passes_other_values_through(value):
+    assert not envelope.is_envelope(value)
+    assert envelope.unpack(value) == [value]
+
+
+@pytest.mark.parametrize("cut", [3, -1])
+def test_envelope_rejects_truncated_envelopes(cut):
+    value = envelope.pack([b"wow", b"doge"])
+    with pytest.raises(ValueError):
+        envelope.unpack(value[:cut])
+
+
+def test_envelope_rejects_trailing_bytes():
+    with pytest.raises(ValueError):
+        envelope.unpack(envelope.pack([b"wow"]) + b"doge")
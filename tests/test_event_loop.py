@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import asyncio
+import os
+import signal
+import sys
+from unittest.mock import AsyncMock
+
+import pytest
+
+from tests.base import ActionRunnerBaseTester
+from walt.event_loop import ASYNCIO
+from walt.event_loop import UVLOOP
+from walt.event_loop import get_event_loop
+from walt.event_loop import set_event_loop_policy
+
+
+@pytest.fixture(autouse=True)
+def _restore_event_loop_policy():
+    yield
+    set_event_loop_policy(ASYNCIO)
+
+
+def test_set_event_loop_policy_keeps_asyncio_by_default():
+    assert set_event_loop_policy(ASYNCIO) == ASYNCIO
+    assert isinstance(asyncio.get_event_loop_policy(), asyncio.DefaultEventLoopPolicy)
+
+
+def test_set_event_loop_policy_falls_back_to_asyncio_on_unknown_loops(logger_mock):
+    assert set_event_loop_policy("doge-loop") == ASYNCIO
+    logger_mock.warning.assert_called_once_with(
+        "Unknown event loop %s, falling back to asyncio", "doge-loop"
+    )
+
+
+def test_set_event_loop_policy_falls_back_to_asyncio_without_uvloop(logger_mock, mocker):
+    mocker.patch.dict(sys.modules, {"uvloop": None})
+    assert set_event_loop_policy(UVLOOP) == ASYNCIO
+    logger_mock.warning.assert_called_once_with("uvloop is not installed, falling back to asyncio")
+
+
+def test_get_event_loop_returns_a_uvloop_loop():
+    uvloop = pytest.importorskip("uvloop")
+    assert isinstance(get_event_loop(UVLOOP), uvloop.Loop)
+    assert get_event_loop(UVLOOP) is get_event_loop(UVLOOP)
+
+
+@pytest.mark.parametrize("signum", [signal.SIGINT, signal.SIGTERM])
+def test_action_runner_finishes_on_signals_on_uvloop(signum):
+    uvloop = pytest.importorskip("uvloop")
+
+    async def side_effect():
+        os.kill(os.getpid(), signum)
+        await asyncio.sleep(1e3)
+
+    action_runner = ActionRunnerBaseTester(event_loop=UVLOOP)
+    assert isinstance(action_runner._loop, uvloop.Loop)
+    action_runner.register_tasks([AsyncMock(side_effect=side_effect)])
+    action_runner.run()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import ssl
+from unittest.mock import MagicMock
+
+import pytest
+
+from walt import config
+from walt import result
+from walt.http_client import ConnectionPoolStats
+from walt.http_client import FreshTLSContextConnector
+from walt.http_client import PhaseTimings
+from walt.http_client import create_connector
+from walt.http_client import phase_trace_config
+from walt.http_client import url_host
+
+
+def test_url_host_tells_hosts_apart():
+    assert url_host("https://wow.host/such?q=doge") == "wow.host"
+    assert url_host("http://wow.host:8080/") == "wow.host:8080"
+
+
+@pytest.fixture
+def tcp_connector_mock(mocker):
+    return mocker.patch("walt.http_client.aiohttp.TCPConnector")
+
+
+@pytest.fixture
+def http_cfg():
+    return dict(config.CONFIG["http"])
+
+
+def test_create_connector_shares_a_tls_context(tcp_connector_mock, http_cfg):
+    create_connector(http_cfg)
+    _, kwargs = tcp_connector_mock.call_args
+    assert isinstance(kwargs["ssl"], ssl.SSLContext)
+
+
+@pytest.mark.asyncio
+async def test_create_connector_creates_a_tls_context_per_connection(http_cfg):
+    http_cfg["reuse_tls_context"] = False
+    connector = create_connector(http_cfg)
+    req = MagicMock(ssl=True)
+    req.is_ssl.return_value = True
+    try:
+        assert isinstance(connector, FreshTLSContextConnector)
+        first, second = connector._get_ssl_context(req), connector._get_ssl_context(req)
+        assert isinstance(first, ssl.SSLContext)
+        assert first is not second
+        assert first.verify_mode == ssl.CERT_REQUIRED
+    finally:
+        await connector.close()
+
+
+@pytest.mark.asyncio
+async def test_fresh_tls_context_connector_keeps_plain_and_unverified_requests(http_cfg):
+    http_cfg["reuse_tls_context"] = False
+    connector = create_connector(http_cfg)
+    plain_req, unverified_req = MagicMock(), MagicMock(ssl=False)
+    plain_req.is_ssl.return_value = False
+    unverified_req.is_ssl.return_value = True
+    try:
+        assert connector._get_ssl_context(plain_req) is None
+        assert connector._get_ssl_context(unverified_req).verify_mode == ssl.CERT_NONE
+    finally:
+        await connector.close()
+
+
+def test_create_connector_disables_dns_cache(tcp_connector_mock, http_cfg):
+    http_cfg["ttl_dns_cache"] = 0
+    create_connector(http_cfg)
+    _, kwargs = tcp_connector_mock.call_args
+    assert kwargs["use_dns_cache"] is False
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_stats_counts_connections():
+    stats = ConnectionPoolStats()
+    trace_config = stats.trace_config()
+    for _ in range(3):
+        await trace_config.on_connection_create_end[0](None, None, None)
+    await trace_config.on_connection_reuseconn[0](None, None, None)
+    assert stats.created == 3
+    assert stats.reused == 1
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_stats_reports_since_last_report(mocker):
+    monotonic_mock = mocker.patch("walt.http_client.time.monotonic", return_value=0)
+    stats = ConnectionPoolStats()
+    stats.created, stats.reused = 2, 6
+    monotonic_mock.return_value = 4
+    report = stats.report()
+    assert report["reuse_ratio"] == 0.75
+    assert report["new_connections_per_second"] == 0.5
+    stats.created, stats.reused = 10, 6
+    monotonic_mock.return_value = 8
+    report = stats.report()
+    assert report["connections_created"] == 10
+    assert report["reuse_ratio"] == 0
+    assert report["new_connections_per_second"] == 2
+
+
+def test_connection_pool_stats_reports_nothing_without_connections():
+    report = ConnectionPoolStats().report()
+    assert report["reuse_ratio"] == 0
+
+
+@pytest.mark.asyncio
+async def test_phase_timings_measure_each_phase(mocker):
+    monotonic_mock = mocker.patch("walt.http_client.time.monotonic")
+    trace_config, timings = phase_trace_config(), PhaseTimings()
+    ctx = mocker.MagicMock(trace_request_ctx=timings)
+    for hook, now in [
+        (trace_config.on_request_start, 10),
+        (trace_config.on_connection_create_start, 11),
+        (trace_config.on_dns_resolvehost_start, 11),
+        (trace_config.on_dns_resolvehost_end, 13),
+        (trace_config.on_connection_create_end, 17),
+        (trace_config.on_request_end, 20),
+    ]:
+        monotonic_mock.return_value = now
+        await hook[0](None, ctx, None)
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    monotonic_mock.return_value = 25
+    timings.fill(res)
+    assert res.dns_time == 2
+    assert res.connect_time == 4
+    assert res.ttfb == 10
+    assert res.body_time == 5
+
+
+@pytest.mark.asyncio
+async def test_phase_timings_of_reused_connections_skip_dns_and_connect(mocker):
+    monotonic_mock = mocker.patch("walt.http_client.time.monotonic", return_value=1)
+    trace_config, timings = phase_trace_config(), PhaseTimings()
+    ctx = mocker.MagicMock(trace_request_ctx=timings)
+    await trace_config.on_request_start[0](None, ctx, None)
+    monotonic_mock.return_value = 3
+    await trace_config.on_request_end[0](None, ctx, None)
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    timings.fill(res)
+    assert (res.dns_time, res.connect_time, res.ttfb, res.body_time) == (0, 0, 2, 0)
+
+
+@pytest.mark.asyncio
+async def test_phase_trace_config_ignores_untraced_requests(mocker):
+    trace_config = phase_trace_config()
+    ctx = mocker.MagicMock(trace_request_ctx=None)
+    await trace_config.on_request_start[0](None, ctx, None)
+    await trace_config.on_request_end[0](None, ctx, None)
+
+
+def test_phase_timings_leave_results_without_headers_untouched():
+    res = result.Result(result.ResultType.TIMEOUT_ERROR, "wow.url")
+    PhaseTimings().fill(res)
+    assert res.ttfb is None
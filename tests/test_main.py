@@ -8,6 +8,9 @@
 # https://opensource.org/licenses/BSD-3-Clause
 # Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
+from unittest.mock import ANY
+from unittest.mock import MagicMock
+
 import pytest
 
 from walt import main
@@ -15,7 +18,14 @@ from walt import main
 
 @pytest.fixture
 def cfg():
-    return {"postgres": {"so": "arg"}}
+    return {
+        "postgres": {"so": "arg"},
+        "processes": 1,
+        "stats_interval": 0,
+        "serde": "binary",
+        "url_map": {},
+        "cluster": {"enabled": False},
+    }
 
 
 @pytest.fixture
@@ -50,15 +60,100 @@ def test_drop_tables(cfg, pg_res_storage):
 def test_produce(cfg, mocker):
     producer = mocker.patch("walt.main.Producer")
     main.produce(cfg)
-    producer.assert_called_once_with(cfg)
+    producer.assert_called_once_with(cfg, reload_config=None)
     producer.return_value.run.assert_called_once_with()
 
 
+def test_produce_with_processes_runs_a_supervisor(cfg, mocker):
+    producer = mocker.patch("walt.main.Producer")
+    supervisor = mocker.patch("walt.main.Supervisor")
+    cfg["processes"] = 4
+    main.produce(cfg)
+    producer.assert_not_called()
+    supervisor.assert_called_once_with("Producer", ANY, 4, stats_interval=0)
+    supervisor.return_value.run.assert_called_once_with()
+    target = supervisor.call_args[0][1]
+    counter = MagicMock()
+    target(1, 4, counter)
+    producer.assert_called_once_with(ANY, counter, 1, 4, reload_config=None)
+
+
+def test_produce_shard_runs_a_producer_with_a_shard_of_urls(cfg, mocker):
+    producer = mocker.patch("walt.main.Producer")
+    for shard in range(3):
+        main.produce_shard(cfg, shard, 3, None)
+    assert producer.return_value.run.call_count == 3
+    assert [c.args for c in producer.call_args_list] == [(cfg, None, s, 3) for s in range(3)]
+
+
 def test_consume(cfg, pg_res_storage, mocker):
     consumer = mocker.patch("walt.main.Consumer")
-    serde = mocker.patch("walt.main.ResultSerde")
+    get_serde = mocker.patch("walt.main.get_serde")
     main.consume(cfg)
     pg_res_storage.assert_called_once_with(so="arg")
-    consumer.assert_called_once_with(cfg, pg_res_storage.return_value, serde)
+    get_serde.assert_called_once_with(cfg["serde"])
+    consumer.assert_called_once_with(cfg, pg_res_storage.return_value, get_serde.return_value)
     consumer.return_value.run.assert_called_once_with()
     assert pg_res_storage.return_value.method_calls == []
+
+
+def test_consume_with_processes_runs_a_supervisor(cfg, pg_res_storage, mocker):
+    consumer = mocker.patch("walt.main.Consumer")
+    get_serde = mocker.patch("walt.main.get_serde")
+    supervisor = mocker.patch("walt.main.Supervisor")
+    cfg["processes"] = 4
+    cfg["stats_interval"] = 10
+    main.consume(cfg)
+    consumer.assert_not_called()
+    supervisor.assert_called_once_with("Consumer", ANY, 4, stats_interval=10)
+    supervisor.return_value.run.assert_called_once_with()
+    target = supervisor.call_args[0][1]
+    counter = MagicMock()
+    target(1, 4, counter)
+    consumer.assert_called_once_with(
+        cfg, pg_res_storage.return_value, get_serde.return_value, counter
+    )
+    consumer.return_value.run.assert_called_once_with()
+
+
+def test_produce_shard_runs_a_cluster_member_per_process(cfg, mocker):
+    producer = mocker.patch("walt.main.Producer")
+    cfg["url_map"] = {f"wow-{i}.url": "" for i in range(10)}
+    cfg["cluster"] = {"enabled": True, "node_id": "doge"}
+    for shard in range(3):
+        main.produce_shard(cfg, shard, 3, None)
+    cfgs = [args[0][0] for args in producer.call_args_list]
+    assert [c["cluster"]["node_id"] for c in cfgs] == ["doge-0", "doge-1", "doge-2"]
+    assert all(c["url_map"] == cfg["url_map"] for c in cfgs)
+    assert all(len(args[0]) == 2 for args in producer.call_args_list)
+
+
+def test_config_reloader_reloads_the_config_file(cfg, mocker):
+    load_config = mocker.patch("walt.main.load_config")
+    cfg["config_path"] = "wow.toml"
+    reload_config = main.config_reloader(cfg)
+    assert reload_config() == load_config.return_value
+    load_config.assert_called_once_with("wow.toml", strict=True)
+
+
+def test_config_reloader_needs_a_config_file(cfg):
+    assert main.config_reloader(cfg) is None
+
+
+def test_load_config_raises_errors_if_strict(tmp_path):
+    path = tmp_path / "wow.toml"
+    path.write_text("such = [invalid")
+    assert main.load_config(str(path))["url_map"]
+    with pytest.raises(Exception):
+        main.load_config(str(path), strict=True)
+
+
+def test_load_config_warns_of_pattern_pools_never_used(tmp_path, mocker):
+    logger = mocker.patch("walt.config.logger")
+    path = tmp_path / "wow.toml"
+    path.write_text("body_chunk_size = 8\npattern_overlap = 4\n[pattern_pool]\nmin_size = 13")
+    main.load_config(str(path))
+    logger.warning.assert_not_called()
+    path.write_text("body_chunk_size = 8\npattern_overlap = 4\n[pattern_pool]\nmin_size = 14")
+    main.load_config(str(path))
+    logger.warning.assert_called_once_with(ANY, 14, 13)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import asyncio
+import re
+
+import pytest
+
+from walt.matcher import PatternPool
+from walt.matcher import StreamMatcher
+from walt.matcher import Window
+from walt.matcher import search_window
+
+
+def feed_all(matcher, chunks):
+    for chunk in chunks:
+        matcher.feed(chunk)
+    return matcher.feed(b"", final=True)
+
+
+@pytest.mark.parametrize(
+    "chunks, found",
+    [
+        ([b"such doge wow"], True),
+        ([b"such doge", b" wow"], True),
+        ([b"such do", b"ge wow"], True),
+        ([b"such d", b"o", b"g", b"e wow"], True),
+        ([b"such cat", b" wow"], False),
+        ([], False),
+    ],
+)
+def test_stream_matcher_finds_patterns_across_chunks(chunks, found):
+    matcher = StreamMatcher(re.compile("doge"), overlap=8)
+    assert feed_all(matcher, chunks) is found
+    assert matcher.found is found
+
+
+def test_stream_matcher_misses_matches_longer_than_overlap():
+    matcher = StreamMatcher(re.compile("much doge"), overlap=2)
+    assert feed_all(matcher, [b"wow much ", b"doge"]) is False
+
+
+def test_stream_matcher_keeps_found_after_a_match():
+    regexp = re.compile("doge")
+    matcher = StreamMatcher(regexp, overlap=8)
+    assert matcher.feed(b"doge wow")
+    assert matcher.feed(b"cat")
+    assert matcher.feed(b"", final=True)
+
+
+def test_stream_matcher_decodes_multibyte_characters_split_across_chunks():
+    encoded = "cão".encode()
+    matcher = StreamMatcher(re.compile("cão"), overlap=8)
+    assert feed_all(matcher, [encoded[:2], encoded[2:]]) is True
+
+
+@pytest.mark.parametrize("encoding", ["latin-1", "utf-16", None, "such-unknown-charset"])
+def test_stream_matcher_decodes_body_with_given_encoding(encoding):
+    encoded = "wow, cão!".encode(encoding if encoding in ("latin-1", "utf-16") else "utf-8")
+    matcher = StreamMatcher(re.compile("cão"), encoding, overlap=8)
+    assert feed_all(matcher, [encoded[:5], encoded[5:]]) is True
+
+
+def test_stream_matcher_replaces_undecodable_bytes():
+    matcher = StreamMatcher(re.compile("wow.doge"), overlap=8)
+    assert feed_all(matcher, [b"wow\xffdoge"]) is True
+
+
+@pytest.mark.parametrize(
+    "pattern, chunks, found",
+    [
+        (r"wow$", [b"such wow", b"ser"], False),
+        (r"wow$", [b"such wow", b"ser wow"], True),
+        (r"wow$", [b"such wow\n", b"much"], False),
+        (r"(?m)wow$", [b"such wow\n", b"much"], True),
+        (r"wow\Z", [b"such wow", b" much"], False),
+        (r"wow\b", [b"such wow", b"ser"], False),
+        (r"wow(?!ser)", [b"such wow", b"ser"], False),
+        (r"^much", [b"such wow ", b"much doge"], False),
+        (r"\Amuch", [b"such wow ", b"much doge"], False),
+        (r"^such", [b"such wow ", b"much doge"], True),
+        (r"(?m)^much", [b"such wow\n", b"much doge"], True),
+        (r"\bmuch", [b"suchmuch", b" doge"], False),
+        (r"\bdoge", [b"such wow", b" doge"], True),
+    ],
+)
+def test_stream_matcher_keeps_anchors_meaning_across_chunks(pattern, chunks, found):
+    matcher = StreamMatcher(re.compile(pattern), overlap=16)
+    assert feed_all(matcher, chunks) is found
+    assert (re.search(pattern, b"".join(chunks).decode()) is not None) is found
+
+
+def test_stream_matcher_does_not_report_end_anchored_match_before_the_body_ends():
+    matcher = StreamMatcher(re.compile(r"wow$"), overlap=16)
+    assert matcher.feed(b"such wow") is False
+    assert matcher.feed(b"", final=True) is True
+
+
+def test_stream_matcher_misses_greedy_matches_starting_before_overlap():
+    matcher = StreamMatcher(re.compile(r"a.*"), overlap=4)
+    assert feed_all(matcher, [b"a" + b"x" * 8, b"x" * 8]) is False
+
+
+def test_stream_matcher_windows_can_be_searched_elsewhere():
+    matcher = StreamMatcher(re.compile("doge"), overlap=8)
+    window = matcher.window(b"such do")
+    assert window == Window(matcher._regexp, "such do", 0, False)
+    assert matcher.update(search_window(window)) is False
+    window = matcher.window(b"ge wow")
+    assert window.text == "such doge wow"
+    assert matcher.update(search_window(window)) is True
+    assert matcher.update(False) is True
+
+
+def test_search_window_does_not_trust_matches_at_the_end_unless_final():
+    assert search_window(Window(re.compile("wow"), "such wow", 0, False)) is False
+    assert search_window(Window(re.compile("wow"), "such wow", 0, True)) is True
+    assert search_window(Window(re.compile("such"), "such wow", 1, True)) is False
+
+
+@pytest.fixture
+def pattern_pool():
+    pattern_pool = PatternPool(1)
+    yield pattern_pool
+    pattern_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pattern_pool_searches_windows(pattern_pool):
+    assert await pattern_pool.search(Window(re.compile("doge"), "such doge", 0, True))
+    assert not await pattern_pool.search(Window(re.compile("cat"), "such doge", 0, True))
+
+
+@pytest.mark.asyncio
+async def test_pattern_pool_gives_up_on_searches_over_the_timeout(pattern_pool):
+    runaway = Window(re.compile(r"(a+)+$"), "a" * 40 + "!", 0, True)
+    with pytest.raises(asyncio.TimeoutError):
+        await pattern_pool.search(runaway, timeout=0.5)
+    assert await pattern_pool.search(Window(re.compile("doge"), "such doge", 0, True), 10)
+
+
+@pytest.mark.asyncio
+async def test_pattern_pool_retries_searches_caught_in_a_restart(pattern_pool):
+    runaway = Window(re.compile(r"(a+)+$"), "a" * 40 + "!", 0, True)
+    caught = asyncio.ensure_future(
+        pattern_pool.search(Window(re.compile("doge"), "such doge", 0, True), 10)
+    )
+    with pytest.raises(asyncio.TimeoutError):
+        await pattern_pool.search(runaway, timeout=0.5)
+    assert await caught
@@ -8,12 +8,16 @@
 # https://opensource.org/licenses/BSD-3-Clause
 # Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
 
+import struct
 from unittest.mock import AsyncMock
+from unittest.mock import call
 
+import psycopg2
 import pytest
 
 from walt import queries
 from walt import result
+from walt import storages
 from walt.storages import PostgresResultStorage
 
 
@@ -32,6 +36,13 @@ def execute_mock(conn_mock):
     return conn_mock.cursor.return_value.__enter__.return_value.execute
 
 
+@pytest.fixture
+def cur_mock(conn_mock):
+    cur_mock = conn_mock.cursor.return_value.__enter__.return_value
+    cur_mock.fetchone.return_value = (False,)
+    return cur_mock
+
+
 @pytest.fixture
 def init_args():
     return {
@@ -76,19 +87,56 @@ def test_create_database_creates_database(pg_res_storage, init_args, execute_moc
     execute_mock.assert_any_call(f"CREATE DATABASE {init_args['dbname']}")
 
 
-def test_create_methods_create_cursor(pg_res_storage, conn_mock):
+def test_create_methods_create_cursor(pg_res_storage, conn_mock, cur_mock):
     pg_res_storage.create_database()
     assert conn_mock.cursor.call_count == 1
     pg_res_storage.create_tables()
     assert conn_mock.cursor.call_count == 2
 
 
-def test_create_tables_creates_tables(pg_res_storage, execute_mock):
+def test_create_tables_creates_tables(pg_res_storage, cur_mock):
+    pg_res_storage.create_tables()
+    cur_mock.execute.assert_any_call(queries.TABLES_EXIST_SQL)
+    cur_mock.execute.assert_any_call(queries.CREATE_TABLES_SQL)
+
+
+def test_create_tables_migrates_existing_tables(pg_res_storage, cur_mock, conn_mock):
+    cur_mock.fetchone.side_effect = [(True,), (True,), (False,)]
+    cur_mock.fetchall.return_value = [("wow.url",), ("such.url",)]
+    pg_res_storage.create_tables()
+    assert queries.CREATE_TABLES_SQL not in [c.args[0] for c in cur_mock.execute.call_args_list]
+    for query in queries.ADD_ENUM_VALUES_SQLS:
+        cur_mock.execute.assert_any_call(query)
+    cur_mock.execute.assert_any_call(queries.MIGRATE_TABLES_SQL)
+    cur_mock.executemany.assert_called_once_with(
+        queries.URL_INSERT_SQL,
+        [(result.hash_url("wow.url"), "wow.url"), (result.hash_url("such.url"), "such.url")],
+    )
+    cur_mock.execute.assert_any_call(queries.MIGRATE_URL_IDS_SQL)
+    cur_mock.execute.assert_called_with(queries.MIGRATE_DEDUPE_SQL)
+
+
+def test_create_tables_skips_migrations_if_done(pg_res_storage, cur_mock):
+    cur_mock.fetchone.side_effect = [(True,), (False,), (True,)]
+    pg_res_storage.create_tables()
+    cur_mock.execute.assert_called_with(queries.DEDUPE_INDEXES_EXIST_SQL)
+    cur_mock.executemany.assert_not_called()
+
+
+def test_create_tables_adds_enum_values_out_of_transaction(
+    pg_res_storage, psycopg2_mock, cur_mock, conn_mock
+):
+    cur_mock.fetchone.side_effect = [(True,), (False,), (True,)]
+    conn_mock.set_isolation_level.side_effect = lambda level: cur_mock.execute(level)
     pg_res_storage.create_tables()
-    execute_mock.assert_any_call(queries.CREATE_TABLES_SQL)
+    extensions = psycopg2_mock.extensions
+    executed = [c.args[0] for c in cur_mock.execute.call_args_list]
+    start = executed.index(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    end = executed.index(extensions.ISOLATION_LEVEL_DEFAULT)
+    assert tuple(executed[start + 1 : end]) == queries.ADD_ENUM_VALUES_SQLS
 
 
-def test_create_tables_calls_connect(pg_res_storage, psycopg2_mock, dsn_with_dbname):
+def test_create_tables_calls_connect(cur_mock, pg_res_storage, psycopg2_mock, dsn_with_dbname):
     pg_res_storage.create_tables()
     assert psycopg2_mock.connect.call_count == 1
     psycopg2_mock.connect.assert_any_call(dsn_with_dbname)
@@ -180,8 +228,8 @@ async def test_connect_creates_a_pool(pg_res_storage, init_args, create_pool_moc
 async def test_save_inserts_result_result(pg_res_storage, result_result, cursor_mock):
     await pg_res_storage.connect()
     await pg_res_storage.save(result_result)
-    cursor_mock.execute.assert_awaited_once_with(
-        queries.RESULT_INSERT_SQL, result_result.as_dict()
+    cursor_mock.execute.assert_awaited_with(
+        queries.RESULT_INSERT_SQL, result_result.result_params()
     )
 
 
@@ -189,10 +237,235 @@ async def test_save_inserts_result_result(pg_res_storage, result_result, cursor_
 async def test_save_inserts_error_result(pg_res_storage, error_result, cursor_mock):
     await pg_res_storage.connect()
     await pg_res_storage.save(error_result)
-    cursor_mock.execute.assert_awaited_once_with(queries.ERROR_INSERT_SQL, error_result.as_dict())
+    cursor_mock.execute.assert_awaited_with(queries.ERROR_INSERT_SQL, error_result.error_params())
+
+
+@pytest.mark.asyncio
+async def test_save_inserts_the_url_if_present(pg_res_storage, result_result, cursor_mock):
+    await pg_res_storage.connect()
+    await pg_res_storage.save(result_result)
+    assert cursor_mock.execute.await_count == 2
+    cursor_mock.execute.assert_any_await(queries.URL_INSERT_SQL, result_result.url_params())
+
+
+@pytest.mark.asyncio
+async def test_save_skips_the_url_if_absent(pg_res_storage, result_result, cursor_mock):
+    result_result.url = ""
+    await pg_res_storage.connect()
+    await pg_res_storage.save(result_result)
+    cursor_mock.execute.assert_awaited_once_with(
+        queries.RESULT_INSERT_SQL, result_result.result_params()
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_logs_and_raises_exception_when_not_connected(pg_res_storage, logger_mock):
+    with pytest.raises(RuntimeError):
+        await pg_res_storage.save(None)
+    logger_mock.exception.assert_called_once_with("Failed to save result %s", "'None'")
+
+
+@pytest.mark.asyncio
+async def test_save_drops_bad_results(pg_res_storage, result_result, cursor_mock, logger_mock):
+    cursor_mock.execute.side_effect = psycopg2.errors.NumericValueOutOfRange
+    await pg_res_storage.connect()
+    await pg_res_storage.save(result_result)
+    logger_mock.exception.assert_called_once_with(
+        "Dropping bad result %s", repr(str(result_result))
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_many_inserts_in_a_transaction(pg_res_storage, result_result, cursor_mock):
+    await pg_res_storage.connect()
+    await pg_res_storage.save_many([result_result])
+    cursor_mock.begin.assert_called_once_with()
+    assert cursor_mock.execute.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_save_many_inserts_multiple_rows(
+    pg_res_storage, result_result, error_result, cursor_mock
+):
+    error_result.url = ""
+    await pg_res_storage.connect()
+    await pg_res_storage.save_many([result_result, result_result, error_result])
+    cursor_mock.execute.assert_has_awaits(
+        [
+            call(
+                queries.URL_INSERT_MANY_SQL.format(values=queries.URL_VALUES),
+                result_result.url_params(),
+            ),
+            call(
+                queries.RESULT_INSERT_MANY_SQL.format(
+                    values=f"{queries.RESULT_VALUES}, {queries.RESULT_VALUES}"
+                ),
+                result_result.result_params() * 2,
+            ),
+            call(
+                queries.ERROR_INSERT_MANY_SQL.format(values=queries.ERROR_VALUES),
+                error_result.error_params(),
+            ),
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_many_skips_empty_inserts(pg_res_storage, error_result, cursor_mock):
+    error_result.url = ""
+    await pg_res_storage.connect()
+    await pg_res_storage.save_many([error_result])
+    cursor_mock.execute.assert_awaited_once_with(
+        queries.ERROR_INSERT_SQL, error_result.error_params()
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_many_logs_and_raises_exception_when_not_connected(pg_res_storage, logger_mock):
+    with pytest.raises(RuntimeError):
+        await pg_res_storage.save_many([])
+    logger_mock.exception.assert_called_once_with("Failed to save %d results", 0)
+
+
+@pytest.mark.asyncio
+async def test_save_many_saves_one_by_one_if_a_result_is_bad(
+    pg_res_storage, result_result, error_result, cursor_mock, mocker
+):
+    cursor_mock.execute.side_effect = psycopg2.errors.NumericValueOutOfRange
+    save_mock = mocker.patch.object(pg_res_storage, "save", AsyncMock())
+    await pg_res_storage.connect()
+    await pg_res_storage.save_many([result_result, error_result])
+    save_mock.assert_has_awaits([call(result_result), call(error_result)])
+
+
+def test_inserts_skip_duplicates():
+    for query in (queries.RESULT_INSERT_SQL, queries.ERROR_INSERT_SQL):
+        assert "ON CONFLICT (url_id, timestamp, producer_id) DO NOTHING" in query
+
+
+@pytest.fixture
+def copy_cur_mock(conn_mock):
+    return conn_mock.cursor.return_value.__enter__.return_value
+
+
+def copied(copy_cur_mock):
+    """copied returns the queries and file contents passed to copy_expert"""
+    return [(c.args[0], c.args[1].getvalue()) for c in copy_cur_mock.copy_expert.call_args_list]
 
 
 @pytest.mark.asyncio
-async def test_save_logs_exception_when_not_connected(pg_res_storage, logger_mock):
-    await pg_res_storage.save(None)
-    logger_mock.exception.called_once()
+async def test_copy_many_copies_in_text_format(
+    pg_res_storage, result_result, error_result, copy_cur_mock, psycopg2_mock, dsn_with_dbname
+):
+    result_result.utc_timestamp_ms = error_result.utc_timestamp_ms = 1609459200000
+    await pg_res_storage.copy_many([result_result, error_result], "text")
+    psycopg2_mock.connect.assert_called_once_with(dsn_with_dbname)
+    url_params = result_result.url_params() + error_result.url_params()
+    copy_cur_mock.execute.assert_has_calls(
+        [
+            call(queries.COPY_TABLES_SQL),
+            call(
+                queries.URL_INSERT_MANY_SQL.format(
+                    values=f"{queries.URL_VALUES}, {queries.URL_VALUES}"
+                ),
+                url_params,
+            ),
+            call(queries.RESULT_COPY_INSERT_SQL),
+            call(queries.ERROR_COPY_INSERT_SQL),
+        ]
+    )
+    url_id, error_url_id = result_result.url_id, error_result.url_id
+    assert copied(copy_cur_mock) == [
+        (
+            queries.RESULT_COPY_SQL.format(copy_format="text"),
+            f"{url_id}\t0.359\t200\tNO_PATTERN\t2021-01-01 00:00:00+00:00"
+            "\t\\N\t\\N\t\\N\t\\N\t0\n",
+        ),
+        (
+            queries.ERROR_COPY_SQL.format(copy_format="text"),
+            f"{error_url_id}\tERROR\t2021-01-01 00:00:00+00:00\t0\n",
+        ),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_copy_many_copies_in_binary_format(pg_res_storage, error_result, copy_cur_mock):
+    error_result.url = ""
+    error_result.utc_timestamp_ms = 946684800001
+    error_result.producer_id = 42
+    await pg_res_storage.copy_many([error_result], "binary")
+    copy_cur_mock.execute.assert_has_calls(
+        [call(queries.COPY_TABLES_SQL), call(queries.ERROR_COPY_INSERT_SQL)]
+    )
+    [(query, data)] = copied(copy_cur_mock)
+    assert query == queries.ERROR_COPY_SQL.format(copy_format="binary")
+    assert data == (
+        storages.BINARY_HEADER
+        + struct.pack(">hiqi5siqiq", 4, 8, error_result.url_id, 5, b"ERROR", 8, 1000, 8, 42)
+        + storages.BINARY_TRAILER
+    )
+
+
+@pytest.mark.asyncio
+async def test_copy_many_copies_nulls_in_binary_format(
+    pg_res_storage, result_result, copy_cur_mock
+):
+    await pg_res_storage.copy_many([result_result], "binary")
+    [(_, data)] = copied(copy_cur_mock)
+    assert data.endswith(struct.pack(">4iiq", -1, -1, -1, -1, 8, 0) + storages.BINARY_TRAILER)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (0, (0, 0, 0, 0)),
+        (200, (1, 0, 0, 0, 200)),
+        (0.359, (1, -1, 0, 3, 3590)),
+        (12345.678, (3, 1, 0, 3, 1, 2345, 6780)),
+        (1e-05, (1, -2, 0, 5, 1000)),
+        (-3.5, (2, 0, 0x4000, 1, 3, 5000)),
+        (20000, (1, 1, 0, 0, 2)),
+    ],
+)
+def test_numeric_encodes_base_10000_digits(value, expected):
+    assert storages._numeric(value) == struct.pack(f">hhHH{len(expected) - 4}H", *expected)
+
+
+@pytest.mark.asyncio
+async def test_copy_many_reuses_its_connection(pg_res_storage, error_result, psycopg2_mock):
+    psycopg2_mock.connect.return_value.closed = False
+    await pg_res_storage.copy_many([error_result])
+    await pg_res_storage.copy_many([error_result])
+    psycopg2_mock.connect.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_copy_many_saves_one_by_one_if_copy_fails(
+    pg_res_storage, result_result, error_result, copy_cur_mock, mocker
+):
+    copy_cur_mock.copy_expert.side_effect = psycopg2.errors.InvalidTextRepresentation
+    save_mock = mocker.patch.object(pg_res_storage, "save", AsyncMock())
+    await pg_res_storage.copy_many([result_result, error_result])
+    save_mock.assert_has_awaits([call(result_result), call(error_result)])
+
+
+@pytest.mark.asyncio
+async def test_copy_many_logs_and_raises_other_exceptions(
+    pg_res_storage, error_result, psycopg2_mock, logger_mock
+):
+    psycopg2_mock.connect.side_effect = psycopg2.OperationalError
+    with pytest.raises(psycopg2.OperationalError):
+        await pg_res_storage.copy_many([error_result])
+    logger_mock.exception.assert_called_once_with("Failed to copy %d results", 1)
+
+
+@pytest.mark.asyncio
+async def test_copy_many_rejects_unknown_formats(
+    pg_res_storage, error_result, copy_cur_mock, logger_mock, mocker
+):
+    mocker.patch.object(pg_res_storage, "save", AsyncMock())
+    await pg_res_storage.copy_many([error_result], "csv")
+    copy_cur_mock.copy_expert.assert_not_called()
+    logger_mock.exception.assert_called_once_with(
+        "Failed to copy %d results, saving them one by one", 1
+    )
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import pytest
+
+from walt.ratelimit import BUSY_RETRY_DELAY
+from walt.ratelimit import HostRateLimiter
+
+
+@pytest.fixture
+def monotonic_mock(mocker):
+    return mocker.patch("walt.ratelimit.time.monotonic", return_value=0)
+
+
+def test_host_rate_limiter_limits_nothing_by_default():
+    limiter = HostRateLimiter()
+    assert all(limiter.acquire("https://wow.host/") == 0 for _ in range(100))
+    assert limiter.throttled == 0
+
+
+def test_host_rate_limiter_limits_requests_per_second(monotonic_mock):
+    limiter = HostRateLimiter(rate=2, burst=1)
+    assert limiter.acquire("https://wow.host/such") == 0
+    assert limiter.acquire("https://wow.host/many") == 0.5
+    monotonic_mock.return_value = 0.25
+    assert limiter.acquire("https://wow.host/many") == 0.25
+    monotonic_mock.return_value = 0.5
+    assert limiter.acquire("https://wow.host/many") == 0
+    assert limiter.throttled == 2
+
+
+def test_host_rate_limiter_allows_bursts(monotonic_mock):
+    limiter = HostRateLimiter(rate=1, burst=3)
+    assert [limiter.acquire("https://wow.host/") for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_host_rate_limiter_limits_hosts_independently(monotonic_mock):
+    limiter = HostRateLimiter(rate=1)
+    assert limiter.acquire("https://wow.host/") == 0
+    assert limiter.acquire("https://such.host/") == 0
+    assert limiter.acquire("https://wow.host/") > 0
+
+
+def test_host_rate_limiter_limits_concurrent_checks():
+    limiter = HostRateLimiter(concurrent=2)
+    assert limiter.acquire("https://wow.host/such") == 0
+    assert limiter.acquire("https://wow.host/many") == 0
+    assert limiter.acquire("https://wow.host/very") == BUSY_RETRY_DELAY
+    limiter.release("https://wow.host/such")
+    assert limiter.acquire("https://wow.host/very") == 0
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import pytest
+
+from walt import result
+
+
+def test_result_round_trips_through_its_representation():
+    res = result.Result(
+        result.ResultType.RESULT, "wow.url", 0.5, 200, result.Pattern.FOUND, 1612732800000
+    )
+    assert result.Result.from_str(repr(res)) == res
+
+
+def test_result_round_trips_with_phase_timings():
+    res = result.Result(result.ResultType.RESULT, "wow.url", 0.5, 200)
+    res.dns_time, res.connect_time, res.ttfb, res.body_time = 0.01, 0.02, 0.3, 0.2
+    assert result.Result.from_str(repr(res)) == res
+
+
+def test_result_parses_representations_without_phase_timings():
+    res = result.Result.from_str("1\nwow.url\n0.5\n200\n1\n1612732800000")
+    assert res.url == "wow.url"
+    assert res.pattern is result.Pattern.FOUND
+    assert res.ttfb is None
+
+
+def test_result_rejects_invalid_representations():
+    with pytest.raises(ValueError):
+        result.Result.from_str("1\nwow.url\n0.5")
+
+
+def test_hash_url_is_a_stable_signed_64_bit_id():
+    url_id = result.hash_url("wow.url")
+    assert url_id == result.hash_url("wow.url")
+    assert url_id != result.hash_url("such.url")
+    assert -(2 ** 63) <= url_id < 2 ** 63
+
+
+def test_result_computes_its_url_id():
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    assert res.url_id == result.hash_url("wow.url")
+
+
+def test_result_round_trips_without_url():
+    res = result.Result(result.ResultType.ERROR, "", url_id=result.hash_url("wow.url"))
+    parsed = result.Result.from_str(repr(res))
+    assert parsed == res
+    assert parsed.url == ""
+    assert parsed.url_id == result.hash_url("wow.url")
+
+
+def test_result_computes_the_url_id_of_legacy_representations():
+    res = result.Result.from_str("1\nwow.url\n0.5\n200\n1\n1612732800000")
+    assert res.url_id == result.hash_url("wow.url")
+
+
+def test_result_round_trips_its_producer_id():
+    res = result.Result(result.ResultType.ERROR, "wow.url", producer_id=result.hash_node("doge"))
+    assert result.Result.from_str(repr(res)).producer_id == result.hash_node("doge")
+
+
+def test_result_parses_representations_without_producer_id():
+    res = result.Result.from_str("1\nwow.url\n0.5\n200\n1\n1612732800000\n\n\n\n\n42")
+    assert res.url_id == 42
+    assert res.producer_id == 0
+
+
+def test_hash_node_tells_producers_apart():
+    assert result.hash_node("doge-1") == result.hash_node("doge-1")
+    assert result.hash_node("doge-1") != result.hash_node("doge-2")
+
+
+@pytest.fixture
+def traced_result():
+    res = result.Result(
+        result.ResultType.RESULT, "wow.url/é", 0.5, 200, result.Pattern.FOUND, 1612732800000
+    )
+    res.dns_time, res.connect_time, res.ttfb, res.body_time = 0.01, 0.02, 0.3, 0.2
+    res.producer_id = result.hash_node("doge")
+    return res
+
+
+def test_result_serde_round_trips_through_the_binary_format(traced_result):
+    result_bytes = result.ResultSerde.to_bytes(traced_result)
+    assert result_bytes[0] == result.BINARY_VERSION
+    phases_size = 4 * result.PHASE.size
+    assert len(result_bytes) == result.BINARY_HEADER.size + phases_size + len("wow.url/é".encode())
+    assert result.ResultSerde.from_bytes(result_bytes) == traced_result
+
+
+def test_result_serde_round_trips_without_phase_timings_and_url():
+    res = result.Result(result.ResultType.TIMEOUT_ERROR, "", url_id=42)
+    result_bytes = result.ResultSerde.to_bytes(res)
+    assert len(result_bytes) == result.BINARY_HEADER.size
+    assert result.ResultSerde.from_bytes(result_bytes) == res
+
+
+def test_result_serde_round_trips_some_phase_timings(traced_result):
+    traced_result.dns_time = traced_result.connect_time = None
+    result_bytes = result.ResultSerde.to_bytes(traced_result)
+    assert result.ResultSerde.from_bytes(result_bytes) == traced_result
+
+
+def test_result_serde_still_reads_the_text_format(traced_result):
+    assert result.ResultSerde.from_bytes(repr(traced_result).encode()) == traced_result
+
+
+def test_result_serde_still_reads_the_binary_format_without_producer_id(traced_result):
+    result_bytes = result.ResultSerde.to_bytes(traced_result)
+    header = list(result.BINARY_HEADER.unpack_from(result_bytes))
+    header[0] = result.LEGACY_BINARY_VERSION
+    del header[-2]
+    legacy_bytes = (
+        result.LEGACY_BINARY_HEADER.pack(*header) + result_bytes[result.BINARY_HEADER.size :]
+    )
+    traced_result.producer_id = 0
+    assert result.ResultSerde.from_bytes(legacy_bytes) == traced_result
+
+
+@pytest.mark.parametrize("cut", [1, result.BINARY_HEADER.size - 1, -1])
+def test_result_serde_rejects_truncated_binary_results(traced_result, cut):
+    result_bytes = result.ResultSerde.to_bytes(traced_result)
+    with pytest.raises(ValueError):
+        result.ResultSerde.from_bytes(result_bytes[:cut])
+
+
+def test_result_has_no_instance_dict():
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    assert not hasattr(res, "__dict__")
+    with pytest.raises(AttributeError):
+        res.such_attribute = "wow"
+
+
+def test_result_equality_compares_all_attributes():
+    res = result.Result(result.ResultType.RESULT, "wow.url", 0.5, 200, utc_timestamp_ms=1)
+    assert res == result.Result(result.ResultType.RESULT, "wow.url", 0.5, 200, utc_timestamp_ms=1)
+    assert res != result.Result(result.ResultType.RESULT, "wow.url", 0.5, 200, utc_timestamp_ms=2)
+    assert res != repr(res)
+
+
+def test_result_timestamps_default_to_now(mocker):
+    mocker.patch("walt.result.time.time_ns", return_value=1612732800123456789)
+    res = result.Result(result.ResultType.RESULT, "wow.url")
+    assert res.utc_timestamp_ms == 1612732800123
+
+
+def test_result_params_follow_the_insert_queries(traced_result):
+    assert traced_result.url_params() == (result.hash_url("wow.url/é"), "wow.url/é")
+    assert traced_result.result_params() == (
+        result.hash_url("wow.url/é"),
+        0.5,
+        200,
+        "FOUND",
+        1612732800000,
+        0.01,
+        0.02,
+        0.3,
+        0.2,
+        result.hash_node("doge"),
+    )
+    error = result.Result(result.ResultType.TIMEOUT_ERROR, "wow.url", utc_timestamp_ms=1)
+    assert error.error_params() == (result.hash_url("wow.url"), "TIMEOUT_ERROR", 1, 0)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import asyncio
+import time
+
+import pytest
+
+from walt.scheduler import TICK
+from walt.scheduler import Scheduler
+from walt.url_store import URLStore
+
+
+URLS = URLStore(
+    (url, "")
+    for url in ("wow.url", "such.web", "much.later", "very.first", "so.second", "very.soon")
+)
+
+
+@pytest.fixture
+def scheduler():
+    return Scheduler(URLS, 1)
+
+
+def test_scheduler_adds_urls(scheduler):
+    scheduler.add("wow.url")
+    scheduler.add("such.web")
+    assert len(scheduler) == 2
+    assert "wow.url" in scheduler
+    assert "such.web" in scheduler
+
+
+def test_scheduler_adds_only_urls_of_the_store(scheduler):
+    with pytest.raises(KeyError):
+        scheduler.add("many.unknown")
+    assert len(scheduler) == 0
+
+
+def test_scheduler_adds_all_urls_accepted(scheduler):
+    scheduler.add_all(lambda url: url.startswith("very."))
+    assert len(scheduler) == 2
+    assert "very.first" in scheduler
+    assert "wow.url" not in scheduler
+    scheduler.add_all()
+    assert len(scheduler) == len(URLS)
+
+
+def test_scheduler_removes_urls(scheduler):
+    scheduler.add("wow.url")
+    scheduler.remove("wow.url")
+    scheduler.remove("many.unknown")
+    assert len(scheduler) == 0
+    assert "wow.url" not in scheduler
+
+
+def test_scheduler_returns_url_intervals():
+    scheduler = Scheduler(URLS, 2, intervals={"wow.url": 17})
+    assert scheduler.interval("wow.url") == 17
+    assert scheduler.interval("such.web") == 2
+
+
+@pytest.mark.asyncio
+async def test_scheduler_returns_urls_in_due_order(scheduler):
+    now = time.monotonic()
+    scheduler.add("much.later", now - 1)
+    scheduler.add("very.first", now - 3)
+    scheduler.add("so.second", now - 2)
+    assert await scheduler.next_due() == "very.first"
+    assert await scheduler.next_due() == "so.second"
+    assert await scheduler.next_due() == "much.later"
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_removed_urls(scheduler):
+    now = time.monotonic()
+    scheduler.add("very.first", now - 2)
+    scheduler.add("so.second", now - 1)
+    scheduler.remove("very.first")
+    assert await scheduler.next_due() == "so.second"
+
+
+@pytest.mark.asyncio
+async def test_scheduler_waits_until_url_is_due(scheduler):
+    scheduler.add("wow.url", time.monotonic() + 0.05)
+    start = time.monotonic()
+    assert await scheduler.next_due() == "wow.url"
+    assert time.monotonic() - start >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_scheduler_wakes_up_when_an_earlier_url_is_added(scheduler):
+    scheduler.add("much.later", time.monotonic() + 1e3)
+    next_due = asyncio.create_task(scheduler.next_due())
+    await asyncio.sleep(1e-3)
+    scheduler.add("very.soon")
+    assert await asyncio.wait_for(next_due, 1) == "very.soon"
+
+
+@pytest.mark.asyncio
+async def test_scheduler_waits_for_urls_when_empty(scheduler):
+    next_due = asyncio.create_task(scheduler.next_due())
+    await asyncio.sleep(1e-3)
+    assert not next_due.done()
+    scheduler.add("wow.url")
+    assert await asyncio.wait_for(next_due, 1) == "wow.url"
+
+
+def test_scheduler_reschedules_one_interval_after_previous_due(scheduler):
+    due = time.monotonic() + 10
+    scheduler.add("wow.url", due)
+    scheduler.reschedule("wow.url")
+    assert scheduler.due("wow.url") == pytest.approx(due + 1, abs=TICK)
+
+
+def test_scheduler_reschedules_late_urls_after_now(scheduler):
+    scheduler.add("wow.url", time.monotonic() - 10)
+    scheduler.reschedule("wow.url")
+    assert scheduler.due("wow.url") >= time.monotonic() - TICK
+
+
+def test_scheduler_does_not_reschedule_removed_urls(scheduler):
+    scheduler.add("wow.url")
+    scheduler.remove("wow.url")
+    scheduler.reschedule("wow.url")
+    assert "wow.url" not in scheduler
+    assert scheduler.due("wow.url") is None
+
+
+def test_scheduler_spreads_urls_within_jitter_window():
+    urls = URLStore((f"wow-{i}.url", "") for i in range(100))
+    scheduler = Scheduler(urls, 10, jitter=0.5)
+    now = time.monotonic()
+    scheduler.add_all()
+    dues = [scheduler.due(url) for url in urls]
+    assert all(now - TICK <= due <= now + 5 + TICK for due in dues)
+    assert len(set(dues)) > 1
+
+
+def test_scheduler_jitters_rescheduled_urls():
+    scheduler = Scheduler(URLS, 10, jitter=0.5)
+    due = time.monotonic() + 10
+    scheduler.add("wow.url", due)
+    scheduler.reschedule("wow.url")
+    assert due + 10 - 2.5 - TICK <= scheduler.due("wow.url") <= due + 10 + 2.5 + TICK
+
+
+def test_scheduler_jitter_does_not_accumulate_over_reschedules(mocker):
+    mocker.patch("walt.scheduler.time.monotonic", return_value=0)
+    scheduler = Scheduler(URLS, 10, jitter=0.5)
+    scheduler.add("wow.url", 0)
+    for i in range(1, 1001):
+        scheduler.reschedule("wow.url")
+        assert abs(scheduler.due("wow.url") - i * 10) <= 2.5 + TICK
+
+
+def test_scheduler_postpones_urls_keeping_their_cadence(mocker):
+    mocker.patch("walt.scheduler.time.monotonic", return_value=0)
+    scheduler = Scheduler(URLS, 10)
+    scheduler.add("wow.url", 0)
+    scheduler.postpone("wow.url", 3)
+    assert scheduler.due("wow.url") == 3
+    scheduler.reschedule("wow.url")
+    assert scheduler.due("wow.url") == 10
+
+
+def test_scheduler_does_not_postpone_removed_urls(scheduler):
+    scheduler.postpone("wow.url", 3)
+    assert "wow.url" not in scheduler
+
+
+@pytest.mark.asyncio
+async def test_scheduler_keeps_urls_on_schedule_across_stores(scheduler):
+    now = time.monotonic()
+    scheduler.add("wow.url", now + 5)
+    scheduler.add("very.first", now - 2)
+    scheduler.add("so.second", now - 1)
+    scheduler.postpone("such.web", 3)
+    scheduler.set_urls(URLStore([("new.url", ""), ("so.second", ""), ("wow.url", "")]))
+    assert len(scheduler) == 2
+    assert "very.first" not in scheduler
+    assert "new.url" not in scheduler
+    assert scheduler.due("wow.url") == pytest.approx(now + 5, abs=TICK)
+    assert await scheduler.next_due() == "so.second"
+    scheduler.add("new.url", now - 1)
+    assert await scheduler.next_due() == "new.url"
+
+
+@pytest.mark.asyncio
+async def test_scheduler_does_not_return_urls_in_flight_again_across_stores(scheduler):
+    now = time.monotonic()
+    scheduler.add("wow.url", now - 2)
+    scheduler.add("such.web", now - 1)
+    scheduler.add("much.later", now + 1e3)
+    assert [await scheduler.next_due(), await scheduler.next_due()] == ["wow.url", "such.web"]
+    urls = URLStore([("wow.url", ""), ("such.web", ""), ("much.later", ""), ("new.url", "")])
+    scheduler.set_urls(urls)
+    assert len(scheduler) == 3
+    assert "wow.url" in scheduler and scheduler.due("wow.url") is None
+    next_due = asyncio.create_task(scheduler.next_due())
+    await asyncio.sleep(1e-3)
+    assert not next_due.done()
+    scheduler.reschedule("wow.url")
+    scheduler.postpone("such.web", 1e3)
+    assert scheduler.due("wow.url") <= time.monotonic() + TICK
+    assert await asyncio.wait_for(next_due, 1) == "wow.url"
+
+
+def test_scheduler_keeps_no_object_per_url():
+    urls = URLStore((f"wow-{i}.url", "") for i in range(1000))
+    scheduler = Scheduler(urls, 10, jitter=0.5)
+    scheduler.add_all()
+    assert len(scheduler._heap) == 1000
+    assert all(isinstance(entry, int) for entry in scheduler._heap)
+    assert scheduler._base.itemsize == scheduler._due.itemsize == 8
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import pytest
+
+from walt import result
+from walt import serdes
+
+
+@pytest.fixture
+def res():
+    res = result.Result(
+        result.ResultType.RESULT, "wow.url/é", 0.5, 200, result.Pattern.FOUND, 1612732800000
+    )
+    res.dns_time, res.ttfb = 0.01, 0.3
+    res.producer_id = result.hash_node("doge")
+    return res
+
+
+@pytest.fixture(params=list(serdes.SERDES))
+def serde_name(request):
+    if request.param == serdes.MSGPACK:
+        pytest.importorskip("msgpack")
+    return request.param
+
+
+def test_serdes_round_trip_results(serde_name, res):
+    serde = serdes.SERDES[serde_name]
+    assert serde.from_bytes(serde.to_bytes(res)) == res
+
+
+def test_serdes_round_trip_results_without_url(serde_name):
+    serde = serdes.SERDES[serde_name]
+    res = result.Result(result.ResultType.TIMEOUT_ERROR, "", url_id=42)
+    assert serde.from_bytes(serde.to_bytes(res)) == res
+
+
+def test_detecting_serde_detects_every_serde(serde_name, res):
+    result_bytes = serdes.SERDES[serde_name].to_bytes(res)
+    assert serdes.DetectingSerde.from_bytes(result_bytes) == res
+    assert serdes.DetectingSerde.from_bytes(memoryview(result_bytes)) == res
+
+
+def test_get_serde_serializes_with_the_named_serde(serde_name, res):
+    serde = serdes.get_serde(serde_name)
+    assert serde.to_bytes(res) == serdes.SERDES[serde_name].to_bytes(res)
+
+
+def test_get_serde_falls_back_to_binary_if_unknown(res, logger_mock):
+    serde = serdes.get_serde("xml")
+    assert serde.to_bytes(res) == result.ResultSerde.to_bytes(res)
+    logger_mock.warning.assert_called_once_with(
+        "Unknown serde %s, falling back to %s", "xml", serdes.BINARY
+    )
+
+
+def test_get_serde_falls_back_to_binary_without_msgpack(res, logger_mock, mocker):
+    mocker.patch("walt.serdes.msgpack", None)
+    serde = serdes.get_serde(serdes.MSGPACK)
+    assert serde.to_bytes(res) == result.ResultSerde.to_bytes(res)
+    logger_mock.warning.assert_called_once_with(
+        "msgpack is not installed, falling back to %s", serdes.BINARY
+    )
+
+
+def test_msgpack_serde_tells_msgpack_is_missing(mocker):
+    mocker.patch("walt.serdes.msgpack", None)
+    with pytest.raises(ValueError, match="msgpack is not installed"):
+        serdes.DetectingSerde.from_bytes(serdes.MSGPACK_MAGIC + b"\x9b")
+
+
+@pytest.mark.parametrize(
+    "result_bytes",
+    [b'{"result_type": "WOW"}', b"{}", b"[1]" + b"\x00", b'{"url": "wow.url"}'],
+)
+def test_json_serde_rejects_invalid_results(result_bytes):
+    with pytest.raises(ValueError):
+        serdes.JSONSerde.from_bytes(result_bytes)
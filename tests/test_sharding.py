@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+
+from walt.sharding import HashRing
+from walt.sharding import in_shard
+from walt.sharding import stable_hash
+
+
+def test_stable_hash_is_the_same_across_processes():
+    code = "from walt.sharding import stable_hash; print(stable_hash('wow.url'))"
+    out = subprocess.check_output([sys.executable, "-c", code])
+    assert int(out) == stable_hash("wow.url")
+
+
+@pytest.mark.parametrize("shards", [1, 2, 7])
+def test_in_shard_splits_urls_into_disjoint_shards(shards):
+    urls = [f"https://wow-{i}.url" for i in range(100)]
+    for url in urls:
+        assert sum(in_shard(url, shard, shards) for shard in range(shards)) == 1
+
+
+@pytest.fixture
+def urls():
+    return [f"https://wow-{i}.url/such?q={i}" for i in range(2000)]
+
+
+def assignments(ring, urls):
+    return {url: ring.node_for(url) for url in urls}
+
+
+def test_hash_ring_returns_none_when_empty():
+    assert HashRing().node_for("wow.url") is None
+
+
+def test_hash_ring_assigns_all_keys_to_a_single_node(urls):
+    ring = HashRing(["doge"])
+    assert set(assignments(ring, urls).values()) == {"doge"}
+
+
+def test_hash_ring_spreads_keys_among_nodes(urls):
+    ring = HashRing(["doge", "cheems", "kabosu", "walter"])
+    counts = Counter(assignments(ring, urls).values())
+    assert set(counts) == ring.nodes
+    assert all(count > len(urls) / 4 / 2 for count in counts.values())
+
+
+def test_hash_ring_is_the_same_regardless_of_node_order(urls):
+    ring = HashRing(["doge", "cheems", "kabosu"])
+    other_ring = HashRing(["kabosu", "doge", "cheems"])
+    assert assignments(ring, urls) == assignments(other_ring, urls)
+
+
+def test_hash_ring_moves_only_keys_taken_by_a_joining_node(urls):
+    ring = HashRing(["doge", "cheems", "kabosu"])
+    before = assignments(ring, urls)
+    ring.add("walter")
+    after = assignments(ring, urls)
+    moved = [url for url in urls if before[url] != after[url]]
+    assert all(after[url] == "walter" for url in moved)
+    assert len(moved) < len(urls) / 4 * 1.5
+
+
+def test_hash_ring_moves_only_keys_of_a_leaving_node(urls):
+    ring = HashRing(["doge", "cheems", "kabosu", "walter"])
+    before = assignments(ring, urls)
+    ring.remove("walter")
+    after = assignments(ring, urls)
+    moved = [url for url in urls if before[url] != after[url]]
+    assert moved == [url for url in urls if before[url] == "walter"]
+    assert "walter" not in ring.nodes
+    assert "walter" not in after.values()
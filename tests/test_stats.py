@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+from walt.stats import LatencyStats
+
+
+def test_latency_stats_reports_nothing_without_latencies():
+    assert LatencyStats("wow").report() == {"wow_count": 0, "wow_mean": 0, "wow_max": 0}
+
+
+def test_latency_stats_reports_count_mean_and_max():
+    stats = LatencyStats("wow")
+    for latency in (0.1, 0.2, 0.6):
+        stats.add(latency)
+    assert stats.report() == {"wow_count": 3, "wow_mean": 0.3, "wow_max": 0.6}
+
+
+def test_latency_stats_resets_after_reporting():
+    stats = LatencyStats("wow")
+    stats.add(0.1)
+    stats.report()
+    stats.add(0.3)
+    assert stats.report() == {"wow_count": 1, "wow_mean": 0.3, "wow_max": 0.3}
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import functools
+import os
+import signal
+import sys
+import time
+from unittest.mock import call
+
+import pytest
+
+from walt.supervisor import Supervisor
+
+
+@pytest.fixture(autouse=True)
+def _restore_signal_handlers():
+    signums = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+    handlers = {signum: signal.getsignal(signum) for signum in signums}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def count(counter, times):
+    for _ in range(times):
+        with counter.get_lock():
+            counter.value += 1
+
+
+def count_shard(shard, shards, counter):
+    count(counter, shard + 10)
+
+
+def crash_once_shard(marker_dir, shard, shards, counter):
+    count(counter, 5)
+    marker = os.path.join(marker_dir, f"crashed-{shard}")
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(3)
+
+
+def sleepy_shard(shard, shards, counter):
+    count(counter, 1)
+    time.sleep(1e3)
+
+
+def reloading_shard(shard, shards, counter):
+    def reload(signum, frame):
+        count(counter, 1)
+        sys.exit(0)
+
+    signal.signal(signal.SIGHUP, reload)
+    count(counter, 1)
+    time.sleep(1e3)
+
+
+def test_supervisor_sums_counters_of_all_processes():
+    supervisor = Supervisor("Doge", count_shard, 3)
+    assert supervisor.run() == 10 + 11 + 12
+
+
+def test_supervisor_restarts_crashed_processes(tmp_path, logger_mock):
+    target = functools.partial(crash_once_shard, str(tmp_path))
+    supervisor = Supervisor("Doge", target, 2, backoff=0)
+    assert supervisor.run() == 2 * 5 * 2
+    assert logger_mock.error.call_count == 2
+    assert sorted(os.listdir(tmp_path)) == ["crashed-0", "crashed-1"]
+
+
+def test_supervisor_stops_processes_on_signals(mocker):
+    supervisor = Supervisor("Doge", sleepy_shard, 2)
+    supervise = supervisor._supervise
+
+    def side_effect():
+        if all(counter.value for counter in supervisor._counters):
+            supervisor._signal_handler(signal.SIGTERM, None)
+        supervise()
+
+    mocker.patch.object(supervisor, "_supervise", side_effect=side_effect)
+    assert supervisor.run() == 2
+
+
+def test_supervisor_passes_sighup_on_to_processes(mocker):
+    supervisor = Supervisor("Doge", reloading_shard, 2)
+    supervise = supervisor._supervise
+    sent = False
+
+    def side_effect():
+        nonlocal sent
+        if not sent and all(counter.value for counter in supervisor._counters):
+            supervisor._sighup_handler(signal.SIGHUP, None)
+            sent = True
+        supervise()
+
+    mocker.patch.object(supervisor, "_supervise", side_effect=side_effect)
+    assert supervisor.run() == 4
+
+
+def test_supervisor_reports_the_sum_of_counters(mocker, logger_mock):
+    supervisor = Supervisor("Doge", sleepy_shard, 2, stats_interval=1e-3)
+    supervise = supervisor._supervise
+    report = call("%s stats: counter=%d counters=%s", "Doge", 2, "1,1")
+
+    def side_effect():
+        if report in logger_mock.info.call_args_list:
+            supervisor._signal_handler(signal.SIGTERM, None)
+        supervise()
+
+    mocker.patch.object(supervisor, "_supervise", side_effect=side_effect)
+    assert supervisor.run() == 2
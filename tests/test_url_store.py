@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+import json
+
+import pytest
+
+from walt.url_store import URLStore
+from walt.url_store import align
+from walt.url_store import load_urls
+from walt.url_store import read_url_source
+
+
+def test_url_store_is_empty_without_urls():
+    store = URLStore()
+    assert len(store) == 0
+    assert not store
+    assert "wow-url.doge" not in store
+
+
+def test_url_store_compiles_no_empty_pattern():
+    store = URLStore({"wow-url.doge": "", "much-web.doge": None}.items())
+    assert store["wow-url.doge"] is None
+    assert store["much-web.doge"] is None
+
+
+def test_url_store_compiles_patterns():
+    store = URLStore([("wow-url.doge", "many-pat+ern"), ("much-web.doge", "(very-regular)*")])
+    assert len(store) == 2
+    assert store["wow-url.doge"].search("many-pattttern")
+    assert store["much-web.doge"].pattern == "(very-regular)*"
+
+
+def test_url_store_nullifies_erroneous_patterns(logger_mock):
+    store = URLStore([("wow-url.doge", "(many-error"), ("much-web.doge", "*very-failure")])
+    assert store["wow-url.doge"] is None
+    assert store["much-web.doge"] is None
+    assert logger_mock.error.call_count == 2
+
+
+def test_url_store_compiles_each_pattern_once():
+    store = URLStore((f"wow-{i}.doge", "such pattern") for i in range(100))
+    assert len({id(store[url]) for url in store}) == 1
+    assert len(store._patterns) == 2
+
+
+def test_url_store_iterates_over_urls():
+    urls = [f"wow-{i}.doge" for i in range(10)]
+    store = URLStore((url, "") for url in reversed(urls))
+    assert sorted(store) == urls
+    assert all(url in store for url in urls)
+
+
+def test_url_store_keeps_last_pattern_of_repeated_urls():
+    store = URLStore([("wow.doge", "first"), ("such.doge", ""), ("wow.doge", "last")])
+    assert len(store) == 2
+    assert store["wow.doge"].pattern == "last"
+
+
+def test_url_store_raises_key_error_for_unknown_urls():
+    with pytest.raises(KeyError):
+        URLStore([("wow.doge", "")])["many-unknown.doge"]
+
+
+def test_url_store_finds_urls_by_position():
+    store = URLStore([("wow.doge", "such"), ("cão.doge", ""), ("much.doge", "")])
+    assert [store.position(url) for url in ("cão.doge", "much.doge", "wow.doge")] == [0, 1, 2]
+    assert store.position("many-unknown.doge") is None
+    assert [store.url(position) for position in range(3)] == ["cão.doge", "much.doge", "wow.doge"]
+    assert store.pattern(2).pattern == "such"
+    assert store.pattern(0) is None
+
+
+def test_url_store_keeps_urls_in_a_single_buffer():
+    store = URLStore((f"wow-{i}.doge", "") for i in range(100))
+    assert isinstance(store._blob, bytearray)
+    assert len(store._offsets) == len(store) + 1
+    assert all(url.startswith("wow-") for url in store)
+
+
+def test_align_pairs_positions_of_urls_in_either_store():
+    old = URLStore([("gone.doge", ""), ("kept.doge", ""), ("so.kept.doge", "")])
+    new = URLStore([("added.doge", ""), ("kept.doge", ""), ("so.kept.doge", ""), ("z.doge", "")])
+    assert list(align(old, new)) == [(None, 0), (0, None), (1, 1), (2, 2), (None, 3)]
+    assert list(align(URLStore(), old)) == [(None, 0), (None, 1), (None, 2)]
+    assert list(align(old, URLStore())) == [(0, None), (1, None), (2, None)]
+
+
+def test_read_url_source_reads_csv_files(tmp_path):
+    path = tmp_path / "urls.csv"
+    path.write_text('# comment\nhttps://wow.url,"such, pattern"\n\nhttps://much.url\n')
+    assert list(read_url_source(str(path))) == [
+        ("https://wow.url", "such, pattern"),
+        ("https://much.url", ""),
+    ]
+
+
+def test_read_url_source_reads_jsonl_files(tmp_path, logger_mock):
+    path = tmp_path / "urls.jsonl"
+    lines = [json.dumps({"url": "https://wow.url", "pattern": "doge"}), "", "{invalid"]
+    lines.append(json.dumps({"url": "https://much.url"}))
+    path.write_text("\n".join(lines))
+    urls = list(read_url_source(str(path)))
+    assert urls == [("https://wow.url", "doge"), ("https://much.url", "")]
+    assert logger_mock.error.call_count == 1
+
+
+def test_read_url_source_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        read_url_source("urls.xml")
+
+
+def test_read_url_source_reads_lazily(tmp_path):
+    path = tmp_path / "urls.csv"
+    path.write_text("https://wow.url\n")
+    urls = read_url_source(str(path))
+    path.unlink()
+    with pytest.raises(FileNotFoundError):
+        next(urls)
+
+
+def test_load_urls_loads_url_map_and_url_source(tmp_path):
+    path = tmp_path / "urls.csv"
+    path.write_text("https://wow.url,doge\n")
+    store = load_urls({"https://much.url": ""}, str(path))
+    assert sorted(store) == ["https://much.url", "https://wow.url"]
+    assert store["https://wow.url"].pattern == "doge"
+
+
+@pytest.mark.parametrize("shards", [2, 7])
+def test_load_urls_loads_a_shard_of_urls(shards):
+    url_map = {f"https://wow-{i}.url": f"pattern-{i}" for i in range(100)}
+    stores = [load_urls(url_map, "", shard, shards) for shard in range(shards)]
+    assert sum(len(store) for store in stores) == len(url_map)
+    assert {url: store[url].pattern for store in stores for url in store} == url_map
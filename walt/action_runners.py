@@ -11,7 +11,7 @@
 """action_runners declares action runners used in walt, mostly a Producer and a Consumer"""
 
 import asyncio
-import re
+import math
 import signal
 import time
 
@@ -20,24 +20,57 @@ import aiokafka
 import aiokafka.helpers
 
 from walt import async_backoff
+from walt import envelope
 from walt import logger
 from walt import result
+from walt.circuit import CircuitBreaker
+from walt.cluster import Membership
+from walt.cluster import default_node_id
+from walt.concurrency import AIMDLimiter
+from walt.event_loop import ASYNCIO
+from walt.event_loop import get_event_loop
+from walt.http_client import ConnectionPoolStats
+from walt.http_client import PhaseTimings
+from walt.http_client import create_connector
+from walt.http_client import phase_trace_config
+from walt.http_client import url_host
+from walt.matcher import PatternPool
+from walt.matcher import StreamMatcher
+from walt.matcher import search_window
+from walt.ratelimit import HostRateLimiter
+from walt.scheduler import Scheduler
+from walt.serdes import get_serde
+from walt.sharding import HashRing
+from walt.stats import LatencyStats
+from walt.url_store import align
+from walt.url_store import load_urls
 
 
 class ActionRunnerBase:
     """ActionRunnerBase is a base class for action runners"""
 
-    def __init__(self):
-        self._loop = asyncio.get_event_loop()
+    def __init__(self, stats_interval=0, shared_counter=None, event_loop=ASYNCIO):
+        self._loop = get_event_loop(event_loop)
         self._tasks = []
         for signum in (signal.SIGINT, signal.SIGTERM):
             self._loop.add_signal_handler(signum, self._sigint_handler)
+        self._loop.add_signal_handler(signal.SIGHUP, self._sighup_handler)
         self._counter, self._counter_lock = 0, asyncio.Lock()
+        self._shared_counter = shared_counter
+        self._stats_interval = stats_interval
 
     def _sigint_handler(self):
         logger.info("Stopping %s", self.__class__.__name__)
         self._shutdown()
 
+    def _sighup_handler(self):
+        logger.info("Reloading %s", self.__class__.__name__)
+        self._reload()
+
+    def _reload(self):
+        """_reload reloads the configuration, for the actions that support it"""
+        logger.warning("%s doesn't support reloading", self.__class__.__name__)
+
     def _shutdown(self):
         logger.debug("Stopping %s tasks", len(self._tasks))
         for task in self._tasks:
@@ -48,11 +81,12 @@ class ActionRunnerBase:
                 task.cancel()
 
     def run(self):
-        """run runs the action until completion"""
+        """run runs the action until completion and returns the counter"""
         try:
             self._loop.run_until_complete(self._run_action())
         except asyncio.CancelledError:
             logger.info("%s finished", self.__class__.__name__)
+        return self._counter
 
     def _create_task(self, task, args=None, kwargs=None):
         """_create_task creates the async `task` with arguments `args` and
@@ -64,10 +98,24 @@ class ActionRunnerBase:
     async def _run_action(self):
         await asyncio.gather(*self._tasks, return_exceptions=True)
 
-    async def _incr_counter(self):
+    async def _incr_counter(self, count=1):
         logger.debug("Incrementing counter")
         async with self._counter_lock:
-            self._counter += 1
+            self._counter += count
+        if self._shared_counter is not None:
+            with self._shared_counter.get_lock():
+                self._shared_counter.value += count
+
+    def _stats(self):
+        """_stats returns a dictionary of statistics to be reported"""
+        return {"counter": self._counter}
+
+    async def _report_stats(self):
+        """_report_stats logs statistics every `stats_interval` seconds"""
+        while True:
+            await asyncio.sleep(self._stats_interval)
+            stats = " ".join(f"{key}={value}" for key, value in self._stats().items())
+            logger.info("%s stats: %s", self.__class__.__name__, stats)
 
 
 class KafkaSSLConnector:
@@ -95,32 +143,60 @@ class KafkaSSLConnector:
 class Producer(ActionRunnerBase, KafkaSSLConnector):
     """Producer produces website verification result into a Kafka topic"""
 
-    def __init__(self, cfg):
-        ActionRunnerBase.__init__(self)
+    def __init__(self, cfg, shared_counter=None, shard=0, shards=1, reload_config=None):
+        ActionRunnerBase.__init__(self, cfg["stats_interval"], shared_counter, cfg["event_loop"])
         KafkaSSLConnector.__init__(self, cfg)
+        self._http = cfg["http"]
         self._headers = {"User-Agent": cfg["user_agent"], **cfg["headers"]}
-        self._url_map = self._compile_url_patterns(cfg["url_map"])
+        self._serde = get_serde(cfg["serde"])
+        self._shard, self._shards = shard, shards
+        self._reload_config = reload_config
+        self._url_map = load_urls(cfg["url_map"], cfg["url_source"], shard, shards)
+        self._announce_interval = cfg["announce_interval"]
+        self._announced_urls = bytearray()
+        self._announce_deadline = math.inf
         self._interval = cfg["interval"]
+        self._interval_map = cfg["interval_map"]
+        self._jitter = cfg["jitter"]
         self._concurrent = cfg["concurrent"]
+        self._concurrency = cfg["concurrency"]
+        self._limiter = None
+        self._host_limit = cfg["host_limit"]
+        self._host_limiter = None
+        self._circuit = cfg["circuit"]
+        self._breaker = None
         self._timeout = cfg["timeout"]
+        self._max_body_bytes = cfg["max_body_bytes"]
+        self._body_chunk_size = cfg["body_chunk_size"]
+        self._pattern_overlap = cfg["pattern_overlap"]
+        self._pattern_pool_cfg = cfg["pattern_pool"]
+        self._pattern_pool = None
+        self._headers_only = cfg["headers_only"]
+        self._headers_only_map = cfg["headers_only_map"]
+        self._scheduler = None
         self._session = None
+        self._pool_stats = None
         self._kafka_uri = cfg["kafka"]["uri"]
         self._kafka_topic = cfg["kafka"]["topic"]
         self._kafka_producer = None
-
-    def _compile_url_patterns(self, url_map):
-        """_compile_url_patterns compiles all regexp patterns skipping those
-        empty or erroneous"""
-        new_url_map = url_map.copy()
-        for url, regexp in url_map.items():
-            if not regexp:
-                continue
-            try:
-                new_url_map[url] = re.compile(regexp)
-            except re.error as err:
-                logger.error("Failed to compile regexp pattern `%s`: %s", regexp, err)
-                new_url_map[url] = None
-        return new_url_map
+        self._publish_queue_size = cfg["kafka"]["publish_queue_size"]
+        self._max_in_flight = cfg["kafka"]["max_in_flight"]
+        self._batch_results = cfg["kafka"]["batch_results"]
+        self._batch_interval = cfg["kafka"]["batch_interval"]
+        self._linger_ms = cfg["kafka"]["linger_ms"]
+        self._max_batch_size = cfg["kafka"]["max_batch_size"]
+        self._compression_type = cfg["kafka"]["compression_type"]
+        self._results = None
+        self._batch = []
+        self._in_flight = None
+        self._sends = set()
+        self._failed_results = 0
+        self._send_latency = LatencyStats("send_latency")
+        self._cluster = cfg["cluster"]
+        self._producer_id = 0
+        self._membership = None
+        self._ring = None
+        self._control_consumer = None
 
     async def _run_action(self):
         """_run_action starts a kafka producer, creates a client session and
@@ -129,16 +205,113 @@ class Producer(ActionRunnerBase, KafkaSSLConnector):
             logger.warning("No URLs to check!")
             return
         logger.info("Starting %s", self.__class__.__name__)
+        self._producer_id = result.hash_node(self._node_id())
         await self._start_kafka_producer()
-        async with aiohttp.ClientSession(headers=self._headers) as session:
+        if self._cluster["enabled"]:
+            await self._join_cluster()
+        async with self._create_session() as session:
             self._session = session
+            if self._stats_interval:
+                self._create_task(self._report_stats)
             await self._process_urls()
         logger.debug("Waiting until all worker tasks are cancelled")
-        logger.info("Produced %d results", self._counter)
         await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pattern_pool:
+            self._pattern_pool.shutdown()
+        await self._flush_results()
+        logger.info("Produced %d results", self._counter)
+        if self._membership:
+            await self._leave_cluster()
         logger.debug("Stopping Kafka producer")
         await self._kafka_producer.stop()
 
+    def _reload(self):
+        """_reload loads the configuration again, in the background, and
+        applies the changes to the URLs"""
+        if self._reload_config is None:
+            logger.warning("Cannot reload without a config file")
+            return
+        self._create_task(self._reload_urls)
+
+    async def _reload_urls(self):
+        """_reload_urls loads the URLs of the reloaded configuration in an
+        executor, so that checks go on meanwhile, and applies them"""
+        try:
+            url_map, interval_map = await self._loop.run_in_executor(None, self._load_urls)
+        except Exception:
+            logger.exception("Failed to reload the configuration, keeping the current one")
+            return
+        self._apply_urls(url_map, interval_map)
+
+    def _load_urls(self):
+        cfg = self._reload_config()
+        url_map = load_urls(cfg["url_map"], cfg["url_source"], self._shard, self._shards)
+        return url_map, cfg["interval_map"]
+
+    def _apply_urls(self, url_map, interval_map):
+        """_apply_urls replaces the URLs and their patterns and intervals,
+        scheduling added URLs and unscheduling removed ones while URLs kept
+        stay on their schedule"""
+        old_url_map, self._url_map = self._url_map, url_map
+        self._interval_map = interval_map
+        added, removed, changed = [], 0, 0
+        for old_position, position in align(old_url_map, url_map):
+            if old_position is None:
+                added.append(url_map.url(position))
+            elif position is None:
+                removed += 1
+            elif _regexp(url_map.pattern(position)) != _regexp(old_url_map.pattern(old_position)):
+                changed += 1
+        self._forget_announced_urls()
+        if self._scheduler is not None:
+            self._scheduler.set_intervals(interval_map)
+            self._scheduler.set_urls(url_map)
+            for url in added:
+                if self._owns(url):
+                    self._scheduler.add(url)
+        logger.info(
+            "Reloaded URLs: added %d, removed %d, changed %d patterns, checking %d",
+            len(added),
+            removed,
+            changed,
+            len(self._scheduler) if self._scheduler is not None else len(url_map),
+        )
+
+    def _create_session(self):
+        """_create_session creates a client session on a connection pool
+        configured by the `http` config section, tracing connections only if
+        stats are reported and request phases only if asked to"""
+        trace_configs = []
+        if self._stats_interval:
+            self._pool_stats = ConnectionPoolStats()
+            trace_configs.append(self._pool_stats.trace_config())
+        if self._http["trace_phases"]:
+            trace_configs.append(phase_trace_config())
+        return aiohttp.ClientSession(
+            headers=self._headers,
+            connector=create_connector(self._http),
+            trace_configs=trace_configs,
+        )
+
+    def _stats(self):
+        stats = super()._stats()
+        if self._results is not None:
+            stats["publish_queue_depth"] = self._results.qsize()
+            stats["sends_in_flight"] = len(self._sends)
+            stats["failed_results"] = self._failed_results
+        stats.update(self._send_latency.report())
+        if self._limiter:
+            stats["concurrency_limit"] = self._limiter.limit
+            stats["checks_in_flight"] = self._limiter.in_flight
+            stats["loop_lag"] = round(self._limiter.loop_lag, 3)
+        if self._host_limiter:
+            stats["throttled"] = self._host_limiter.throttled
+        if self._breaker:
+            stats["open_circuits"] = self._breaker.open_circuits
+        if self._pool_stats:
+            stats.update(self._pool_stats.report())
+        return stats
+
     @async_backoff(msg="Failed to start Kafka Producer!")
     async def _start_kafka_producer(self):
         logger.debug("Starting Kafka Producer")
@@ -146,65 +319,370 @@ class Producer(ActionRunnerBase, KafkaSSLConnector):
             bootstrap_servers=self._kafka_uri,
             request_timeout_ms=self._timeout * 1000,
             retry_backoff_ms=self._interval * 1000,
+            linger_ms=self._linger_ms,
+            max_batch_size=self._max_batch_size,
+            compression_type=self._compression_type or None,
             **self._ssl_arguments,
         )
         await self._kafka_producer.start()
 
+    def _node_id(self):
+        """_node_id returns the id of this producer among all producers"""
+        return self._cluster["node_id"] or default_node_id()
+
+    async def _join_cluster(self):
+        """_join_cluster starts announcing this producer on the control topic
+        and listening to the others, then waits a heartbeat interval to hear
+        from them before taking a share of the URLs"""
+        node_id = self._node_id()
+        logger.info("Joining cluster as %s", node_id)
+        self._membership = Membership(
+            node_id,
+            self._cluster["heartbeat_interval"],
+            self._cluster["member_timeout"],
+            self._rebalance,
+        )
+        self._ring = HashRing([node_id], self._cluster["vnodes"])
+        await self._start_control_consumer()
+        self._create_task(self._membership.heartbeat, (self._send_control,))
+        self._create_task(self._membership.listen, (self._control_consumer,))
+        await asyncio.sleep(self._cluster["heartbeat_interval"])
+
+    async def _leave_cluster(self):
+        logger.info("Leaving cluster")
+        try:
+            await self._membership.leave(self._send_control)
+        except Exception:
+            logger.exception("Failed to announce leaving the cluster!")
+        logger.debug("Stopping Kafka control consumer")
+        await self._control_consumer.stop()
+
+    @async_backoff(msg="Failed to start Kafka control consumer!")
+    async def _start_control_consumer(self):
+        logger.debug("Starting Kafka control consumer")
+        self._control_consumer = aiokafka.AIOKafkaConsumer(
+            self._cluster["control_topic"],
+            bootstrap_servers=self._kafka_uri,
+            auto_offset_reset="latest",
+            request_timeout_ms=self._timeout * 1000,
+            retry_backoff_ms=self._interval * 1000,
+            **self._ssl_arguments,
+        )
+        await self._control_consumer.start()
+
+    async def _send_control(self, msg):
+        await self._kafka_producer.send_and_wait(self._cluster["control_topic"], msg)
+
+    def _owns(self, url):
+        """_owns tells whether this producer is the one checking `url`"""
+        return self._ring is None or self._ring.node_for(url) == self._membership.node_id
+
+    def _rebalance(self, members):
+        """_rebalance redistributes the URLs among `members`, scheduling the
+        URLs this producer takes over and unscheduling those it hands over"""
+        for node in self._ring.nodes - set(members):
+            self._ring.remove(node)
+        for node in set(members) - self._ring.nodes:
+            self._ring.add(node)
+        if self._scheduler is None:
+            return
+        added, removed = 0, 0
+        for url in self._url_map:
+            owned = self._owns(url)
+            if owned and url not in self._scheduler:
+                self._scheduler.add(url)
+                added += 1
+            elif not owned and url in self._scheduler:
+                self._scheduler.remove(url)
+                removed += 1
+        logger.info(
+            "Rebalanced among %d producers: took %d URLs, handed over %d, checking %d",
+            len(members),
+            added,
+            removed,
+            len(self._scheduler),
+        )
+
     async def _process_urls(self):
-        """_process_urls creates worker tasks to check the URLs"""
-        logger.info("Checking %d URLs", len(self._url_map))
-        urls = self._create_urls_queue()
-        for i in range(self._concurrent):
-            self._create_task(self._worker, (f"producer-{i+1}", urls))
+        """_process_urls creates a dispatcher task that hands due URLs over to
+        worker tasks that check them, and a publisher task that sends their
+        results. With adaptive concurrency, there are as many workers as the
+        maximum limit, but only as many as the current limit check at once"""
+        self._scheduler = self._create_scheduler()
+        self._forget_announced_urls()
+        logger.info("Checking %d URLs", len(self._scheduler))
+        self._results = asyncio.Queue(maxsize=self._publish_queue_size)
+        self._in_flight = asyncio.Semaphore(self._max_in_flight)
+        self._create_task(self._publisher)
+        due_urls = asyncio.Queue(maxsize=self._concurrent)
+        self._create_task(self._dispatcher, (due_urls,))
+        workers = self._concurrent
+        if self._concurrency["adaptive"]:
+            self._limiter = self._create_limiter()
+            self._create_task(self._limiter.monitor_loop_lag)
+            workers = self._concurrency["max"]
+        if self._host_limit["rate"] or self._host_limit["concurrent"]:
+            self._host_limiter = HostRateLimiter(
+                self._host_limit["rate"], self._host_limit["burst"], self._host_limit["concurrent"]
+            )
+        if self._circuit["failure_threshold"]:
+            self._breaker = CircuitBreaker(
+                self._circuit["failure_threshold"],
+                self._circuit["backoff"],
+                self._circuit["max_backoff"],
+            )
+        if self._pattern_pool_cfg["min_size"]:
+            self._pattern_pool = PatternPool(self._pattern_pool_cfg["workers"])
+        for i in range(workers):
+            self._create_task(self._worker, (f"producer-{i+1}", due_urls))
         logger.debug("Checking URLs")
-        await urls.join()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
 
-    def _create_urls_queue(self):
-        urls = asyncio.Queue()
-        for url in self._url_map:
-            urls.put_nowait(url)
-        if len(self._url_map) == 1:
-            # prevents `urls` from being exhausted when checking a single URL:
-            urls.put_nowait(list(self._url_map)[0])
-        return urls
+    def _create_limiter(self):
+        return AIMDLimiter(
+            self._concurrent,
+            self._concurrency["min"],
+            self._concurrency["max"],
+            self._concurrency["backoff"],
+            self._concurrency["latency_tolerance"],
+            self._concurrency["max_loop_lag"],
+        )
+
+    def _create_scheduler(self):
+        scheduler = Scheduler(self._url_map, self._interval, self._jitter, self._interval_map)
+        scheduler.add_all(self._owns if self._ring is not None else None)
+        return scheduler
 
-    async def _worker(self, name, urls):
+    async def _dispatcher(self, due_urls):
+        """_dispatcher waits for URLs to be due and queues them up for the
+        workers, blocking while all workers are busy"""
+        logger.debug("Starting dispatcher")
+        try:
+            while True:
+                url = await self._scheduler.next_due()
+                await due_urls.put(url)
+        finally:
+            logger.debug("Stopping dispatcher")
+
+    async def _worker(self, name, due_urls):
         logger.debug("Starting %s", name)
         try:
-            await self._check_urls(name, urls)
-        except asyncio.CancelledError:
-            for _ in range(urls.qsize()):
-                urls.task_done()
-            raise
+            await self._check_urls(name, due_urls)
         except Exception:
             logger.exception("%s failed!", name)
         finally:
             logger.debug("Stopping %s worker", name)
 
-    async def _check_urls(self, name, urls):
-        """_check_urls takes a URL, checks it and sends the result"""
+    async def _check_urls(self, name, due_urls):
+        """_check_urls takes a due URL, checks it, queues the result, marked
+        as this producer's, up for the publisher and reschedules the URL.
+        Queuing blocks while the publisher is behind, which in turn holds the
+        dispatcher back. URLs whose host is throttled are postponed rather
+        than waited for, and URLs a reload removed while they were queued are
+        dropped"""
         while True:
-            url = await urls.get()
-            logger.info("Checking %s", url)
-            logger.debug("%s is checking %s", name, url)
+            url = await due_urls.get()
+            if url not in self._scheduler:
+                logger.debug("%s is dropping %s, no longer checked", name, url)
+                continue
+            if not self._acquire_host(url):
+                continue
+            try:
+                logger.info("Checking %s", url)
+                logger.debug("%s is checking %s", name, url)
+                res = await self._limited_session_get(url)
+                if res is None:
+                    continue
+                res.producer_id = self._producer_id
+                self._strip_announced_url(res)
+                res_bytes = self._serde.to_bytes(res)
+                logger.debug("%s is queuing result %s", name, res_bytes)
+                await self._results.put(res_bytes)
+            finally:
+                self._release_host(url)
+                self._scheduler.reschedule(url)
+
+    def _strip_announced_url(self, res):
+        """_strip_announced_url leaves the URL of `res` out if it was already
+        announced, its id sufficing from then on. Whether URLs were announced
+        is kept in a byte per URL of the store, by position"""
+        if time.monotonic() >= self._announce_deadline:
+            self._forget_announced_urls()
+        position = self._url_map.position(res.url)
+        if position is None:
+            return
+        if self._announced_urls[position]:
+            res.url = ""
+        else:
+            self._announced_urls[position] = 1
+
+    def _forget_announced_urls(self):
+        """_forget_announced_urls has every URL sent along with its next
+        result, so that a URL whose announcement was lost, or not stored, is
+        announced again at least every `announce_interval` seconds"""
+        self._announced_urls = bytearray(len(self._url_map))
+        self._announce_deadline = time.monotonic() + (self._announce_interval or math.inf)
+
+    def _acquire_host(self, url):
+        """_acquire_host takes a slot of the host of `url`, if limited,
+        postponing `url` if there is none free"""
+        if self._host_limiter is None:
+            return True
+        delay = self._host_limiter.acquire(url)
+        if delay:
+            logger.debug("Host of %s is throttled, postponing it %.3fs", url, delay)
+            self._scheduler.postpone(url, delay)
+            return False
+        return True
+
+    def _release_host(self, url):
+        if self._host_limiter is not None:
+            self._host_limiter.release(url)
+
+    async def _publisher(self):
+        """_publisher takes results off the queue and sends them, in batches of
+        up to `batch_results` gathered for at most `batch_interval` seconds,
+        keeping at most `max_in_flight` sends waiting for the broker at a time"""
+        logger.debug("Starting publisher")
+        try:
+            while True:
+                await self._gather_batch()
+                await self._in_flight.acquire()
+                self._start_send()
+        finally:
+            logger.debug("Stopping publisher")
+
+    async def _gather_batch(self):
+        self._batch.append(await self._results.get())
+        deadline = time.monotonic() + self._batch_interval
+        while len(self._batch) < self._batch_results:
+            if self._results.empty():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._results.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                self._batch.append(self._results.get_nowait())
+
+    def _start_send(self):
+        """_start_send sends the batch, enveloped if it has more than one
+        result, in the background"""
+        batch, self._batch = self._batch, []
+        msg = batch[0] if len(batch) == 1 else envelope.pack(batch)
+        task = asyncio.create_task(self._publish(msg, len(batch)))
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    async def _publish(self, msg, count=1):
+        """_publish sends `msg` of `count` results and counts them as produced
+        only if the broker took them, as failed otherwise"""
+        start = time.monotonic()
+        try:
+            sent = await self._kafka_send(msg, count)
+        finally:
+            self._in_flight.release()
+        if not sent:
+            self._failed_results += count
+            return
+        self._send_latency.add(time.monotonic() - start)
+        await self._incr_counter(count)
+
+    async def _flush_results(self):
+        """_flush_results sends the results still batched or queued and waits
+        for all sends in flight"""
+        if self._results is None:
+            return
+        logger.debug("Flushing %d queued results", len(self._batch) + self._results.qsize())
+        while self._batch or not self._results.empty():
+            while len(self._batch) < self._batch_results and not self._results.empty():
+                self._batch.append(self._results.get_nowait())
+            await self._in_flight.acquire()
+            self._start_send()
+        await asyncio.gather(*self._sends, return_exceptions=True)
+
+    async def _limited_session_get(self, url):
+        """_limited_session_get calls _session_get within the adaptive
+        concurrency limit, if any, and feeds the limiter with the outcome. It
+        returns None if a reload removed `url` while waiting for the limiter"""
+        if self._limiter is None:
+            return await self._session_get(url)
+        started = await self._limiter.acquire()
+        latency, timed_out = None, False
+        try:
+            if url not in self._scheduler:
+                logger.debug("Dropping %s, no longer checked", url)
+                return None
             res = await self._session_get(url)
-            res_bytes = str(res).encode()
-            logger.debug("%s is sending result %s", name, res_bytes)
-            await self._kafka_send(res_bytes)
-            urls.task_done()
-            urls.put_nowait(url)
-            await self._incr_counter()
-            logger.debug("%s is going to sleep", name)
-            await asyncio.sleep(self._interval)
+            if res is None:
+                return None
+            if res.result_type is result.ResultType.RESULT:
+                latency = res.response_time
+            timed_out = res.result_type is result.ResultType.TIMEOUT_ERROR
+            return res
+        finally:
+            self._limiter.release(started, latency, timed_out)
+
+    def _headers_only_method(self, url, regexp):
+        """_headers_only_method returns the method used to fetch only the
+        headers of `url`, or an empty string if its body is needed, to search
+        `regexp`, or wanted"""
+        if regexp:
+            return ""
+        return self._headers_only_map.get(url, self._headers_only).upper()
 
     async def _session_get(self, url):
-        """_session_get fetches a URL and generates a verification result"""
+        """_session_get fetches a URL and generates a verification result,
+        unless the circuit of the URL or of its host is open, in which case a
+        result saying so is generated without fetching anything. The pattern of
+        the URL is resolved beforehand, so that a reload removing it meanwhile
+        doesn't matter, and None is returned if it's already gone"""
+        position = self._url_map.position(url)
+        if position is None:
+            logger.debug("Dropping %s, no longer checked", url)
+            return None
+        regexp = self._url_map.pattern(position)
+        if self._breaker is None:
+            return await self._fetch(url, regexp)
+        host = url_host(url)
+        if not self._breaker.allow(url, host):
+            logger.debug("Circuit open: %s", url)
+            return result.Result(result.ResultType.CIRCUIT_OPEN, url)
+        res = await self._fetch(url, regexp)
+        failed = res.result_type in (
+            result.ResultType.CLIENT_ERROR,
+            result.ResultType.TIMEOUT_ERROR,
+            result.ResultType.ERROR,
+        )
+        self._breaker.record(url, host, failed)
+        return res
+
+    async def _fetch(self, url, regexp):
+        """_fetch fetches a URL and generates a verification result, searching
+        `regexp` in its body if any"""
+        method = self._headers_only_method(url, regexp)
+        kwargs = {"timeout": self._timeout}
+        timings = None
+        if self._http["trace_phases"]:
+            timings = kwargs["trace_request_ctx"] = PhaseTimings()
         try:
             start = time.monotonic()
-            async with self._session.get(url, timeout=self._timeout) as resp:
-                pattern = await self._check_pattern(url, resp)
-                spent = time.monotonic() - start
-                return result.Result(result.ResultType.RESULT, url, spent, resp.status, pattern)
+            if method == "HEAD":
+                request = self._session.head(url, allow_redirects=True, **kwargs)
+            else:
+                request = self._session.get(url, **kwargs)
+            async with request as resp:
+                if method:
+                    res = self._headers_result(url, resp, time.monotonic() - start)
+                else:
+                    pattern = await self._check_pattern(url, regexp, resp)
+                    spent = time.monotonic() - start
+                    res = result.Result(result.ResultType.RESULT, url, spent, resp.status, pattern)
+                if timings:
+                    timings.fill(res)
+                return res
         except aiohttp.ClientError as err:
             logger.error("ClientError (%s): %s", err.__class__.__name__, url)
             return result.Result(result.ResultType.CLIENT_ERROR, url)
@@ -215,34 +693,114 @@ class Producer(ActionRunnerBase, KafkaSSLConnector):
             logger.exception("Failed to fetch %s", url)
             return result.Result(result.ResultType.ERROR, url)
 
-    async def _check_pattern(self, url, resp):
-        regexp = self._url_map[url]
+    @staticmethod
+    def _headers_result(url, resp, spent):
+        """_headers_result generates a result out of the response headers,
+        closing the connection so that no body is downloaded"""
+        resp.close()
+        return result.Result(
+            result.ResultType.RESULT, url, spent, resp.status, result.Pattern.NO_PATTERN
+        )
+
+    async def _check_pattern(self, url, regexp, resp):
+        """_check_pattern searches `regexp` while reading the body of `url` in
+        chunks, stopping as soon as it is found or `max_body_bytes` is read.
+        Searching in the pattern pool for longer than its budget gives up"""
         if not regexp:
             return result.Pattern.NO_PATTERN
-        text = await resp.text()
-        if regexp.search(text, re.MULTILINE):
+        matcher = StreamMatcher(regexp, resp.charset, self._pattern_overlap)
+        budget = self._pattern_pool_cfg["budget"] or None
+        remaining = self._max_body_bytes
+        try:
+            async for chunk in resp.content.iter_chunked(self._body_chunk_size):
+                found, budget = await self._search(matcher, chunk[:remaining], budget)
+                if found:
+                    return result.Pattern.FOUND
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    logger.debug("Stopped reading %s after %d bytes", url, self._max_body_bytes)
+                    break
+            found, budget = await self._search(matcher, b"", budget, final=True)
+        except asyncio.TimeoutError:
+            logger.warning("Searching %s exceeded its budget", url)
+            return result.Pattern.BUDGET_EXCEEDED
+        if found:
             return result.Pattern.FOUND
         return result.Pattern.NOT_FOUND
 
-    async def _kafka_send(self, msg):
+    async def _search(self, matcher, chunk, budget, final=False):
+        """_search feeds `chunk` to `matcher` and returns whether the pattern
+        has been found so far, along with what's left of the `budget`. Windows
+        of at least `min_size` characters are searched in the pattern pool,
+        within the budget, others right here"""
+        window = matcher.window(chunk, final)
+        if self._pattern_pool is None or len(window.text) < self._pattern_pool_cfg["min_size"]:
+            return matcher.update(search_window(window)), budget
+        start = time.monotonic()
+        found = await self._pattern_pool.search(window, budget)
+        if budget is not None:
+            budget -= time.monotonic() - start
+        return matcher.update(found), budget
+
+    async def _kafka_send(self, msg, count=1):
+        """_kafka_send sends `msg` of `count` results and returns whether it
+        was sent"""
         try:
-            await self._kafka_producer.send(self._kafka_topic, msg)
+            await self._kafka_producer.send_and_wait(self._kafka_topic, msg)
         except Exception:
-            logger.exception("Failed to send {msg} to {self._kafka_topic}!")
+            logger.exception(
+                "Failed to send %d results (%d bytes) to %s!", count, len(msg), self._kafka_topic
+            )
+            self._forget_announced_urls()  # the lost message might have announced URLs
+            return False
+        return True
+
+
+def _regexp(pattern):
+    return pattern.pattern if pattern is not None else None
+
+
+class DrainOnRevoke(aiokafka.ConsumerRebalanceListener):
+    """DrainOnRevoke waits for a Consumer to store the results it has fetched,
+    and to commit their offsets, before its partitions are handed over to
+    another consumer"""
+
+    def __init__(self, drain):
+        self._drain = drain
+
+    async def on_partitions_revoked(self, revoked):
+        logger.info("Partitions revoked: %s", sorted(revoked))
+        await self._drain()
+
+    async def on_partitions_assigned(self, assigned):
+        logger.info("Partitions assigned: %s", sorted(assigned))
 
 
 class Consumer(ActionRunnerBase, KafkaSSLConnector):
     """Consumer consumes data from a Kafka topic, runs it through a deserializer
-    and delivers it to a data storage"""
+    and delivers it to a data storage, in a pipeline of stages linked by
+    bounded queues. Consumers in several processes share the partitions of the
+    topic as members of the same consumer group"""
 
-    def __init__(self, cfg, storage, serde):
-        ActionRunnerBase.__init__(self)
+    def __init__(self, cfg, storage, serde, shared_counter=None):
+        ActionRunnerBase.__init__(self, cfg["stats_interval"], shared_counter, cfg["event_loop"])
         KafkaSSLConnector.__init__(self, cfg)
         self._interval = cfg["interval"]
         self._timeout = cfg["timeout"]
         self._kafka_uri = cfg["kafka"]["uri"]
         self._kafka_topic = cfg["kafka"]["topic"]
         self._kafka_consumer = None
+        self._batch_size = cfg["consumer"]["batch_size"]
+        self._batch_timeout = cfg["consumer"]["batch_timeout"]
+        self._copy = cfg["consumer"]["copy"]
+        self._group_id = cfg["consumer"]["group_id"]
+        self._queue_size = cfg["consumer"]["queue_size"]
+        self._fetches = None
+        self._batches = None
+        self._fetch_latency = LatencyStats("fetch_latency")
+        self._decode_latency = LatencyStats("decode_latency")
+        self._store_latency = LatencyStats("store_latency")
+        self._undecodable = 0
         self._storage = storage
         self._serde = serde
 
@@ -252,11 +810,7 @@ class Consumer(ActionRunnerBase, KafkaSSLConnector):
         await self._connect_storage()
         logger.info("Consuming results")
         try:
-            async for msg in self._kafka_consumer:
-                logger.info("Consumed a message with value: %s", msg.value)
-                value = self._serde.from_bytes(msg.value)
-                await self._storage.save(value)
-                await self._incr_counter()
+            await self._consume()
         finally:
             logger.debug("Disconnecting storage")
             await self._storage.disconnect()
@@ -264,16 +818,166 @@ class Consumer(ActionRunnerBase, KafkaSSLConnector):
             await self._kafka_consumer.stop()
             logger.info("Consumed %d messages", self._counter)
 
+    async def _consume(self):
+        """_consume runs the fetch, decode and store stages, each a task of its
+        own, so that Kafka is fetched from while the database is written to.
+        Queues between stages are bounded so that a slow stage holds back the
+        ones before it"""
+        self._fetches = asyncio.Queue(maxsize=self._queue_size)
+        self._batches = asyncio.Queue(maxsize=self._queue_size)
+        stages = [self._fetcher(), self._decoder(), self._storer()]
+        if self._stats_interval:
+            stages.append(self._report_stats())
+        tasks = [asyncio.create_task(stage) for stage in stages]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetcher(self):
+        """_fetcher fetches up to `batch_size` messages at a time, or as many
+        as available without `batch_size`, and queues them to be decoded"""
+        max_records = self._batch_size or None
+        while True:
+            start = time.monotonic()
+            records = await self._kafka_consumer.getmany(
+                timeout_ms=int(self._batch_timeout * 1000), max_records=max_records
+            )
+            msgs = [msg for partition_msgs in records.values() for msg in partition_msgs]
+            if msgs:
+                self._fetch_latency.add(time.monotonic() - start)
+                await self._fetches.put(msgs)
+
+    async def _decoder(self):
+        """_decoder decodes fetched messages into batches of at least
+        `batch_size` results gathered for at most `batch_timeout` seconds, or a
+        batch per fetch without `batch_size`, and queues them to be stored
+        along with the offsets to commit once they are. Fetches are only done
+        once their batch is queued, so that draining waits for them"""
+        while True:
+            batch, offsets, fetches = [], {}, 0
+            msgs = await self._fetches.get()
+            deadline = time.monotonic() + self._batch_timeout
+            while True:
+                fetches += 1
+                start = time.monotonic()
+                for msg in msgs:
+                    batch.extend(self._decode(msg))
+                    offsets[aiokafka.TopicPartition(msg.topic, msg.partition)] = msg.offset + 1
+                self._decode_latency.add(time.monotonic() - start)
+                timeout = deadline - time.monotonic()
+                if len(batch) >= self._batch_size or timeout <= 0:
+                    break
+                try:
+                    msgs = await asyncio.wait_for(self._fetches.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            await self._batches.put((batch, offsets))
+            for _ in range(fetches):
+                self._fetches.task_done()
+
+    async def _storer(self):
+        """_storer stores batches and commits their offsets once they're
+        stored"""
+        while True:
+            batch, offsets = await self._batches.get()
+            start = time.monotonic()
+            await self._store_batch(batch)
+            self._store_latency.add(time.monotonic() - start)
+            await self._incr_counter(len(batch))
+            await self._commit(offsets)
+            self._batches.task_done()
+
+    async def _store_batch(self, batch):
+        """_store_batch stores results one at a time without `batch_size`, or
+        else the whole batch in a transaction, copied if so configured"""
+        if not batch:
+            return
+        if not self._batch_size:
+            for res in batch:
+                await self._store(self._storage.save, res)
+        elif self._copy:
+            await self._store(self._storage.copy_many, batch, self._copy)
+        else:
+            await self._store(self._storage.save_many, batch)
+
+    @async_backoff(msg="Failed to store results!")
+    async def _store(self, save, *args):
+        """_store retries `save` until it stores `args`, so that no offset is
+        committed past results that are not stored"""
+        await save(*args)
+
+    async def _commit(self, offsets):
+        """_commit commits `offsets`. Failures are only logged: their results
+        are stored and replaying them is safe"""
+        try:
+            await self._kafka_consumer.commit(offsets)
+        except aiokafka.errors.KafkaError:
+            logger.exception("Failed to commit offsets")
+
+    async def _drain(self):
+        """_drain waits for the messages fetched so far to be stored and their
+        offsets committed"""
+        if self._fetches is None:
+            return
+        await self._fetches.join()
+        await self._batches.join()
+
+    def _stats(self):
+        stats = super()._stats()
+        if self._fetches is not None:
+            stats["decode_queue_depth"] = self._fetches.qsize()
+            stats["store_queue_depth"] = self._batches.qsize()
+        stats["undecodable"] = self._undecodable
+        stats.update(self._fetch_latency.report())
+        stats.update(self._decode_latency.report())
+        stats.update(self._store_latency.report())
+        return stats
+
+    def _decode(self, msg):
+        """_decode returns the Results of `msg`, dropping those that cannot be
+        decoded so that consuming goes on past them"""
+        logger.info("Consumed a message with value: %s", msg.value)
+        try:
+            values = envelope.unpack(msg.value)
+        except ValueError as err:
+            self._drop_undecodable(msg, err)
+            return []
+        results = []
+        for value in values:
+            try:
+                results.append(self._serde.from_bytes(value))
+            except ValueError as err:
+                self._drop_undecodable(msg, err)
+        return results
+
+    def _drop_undecodable(self, msg, err):
+        logger.error(
+            "Dropping undecodable message at offset %d of %s-%d: %s",
+            msg.offset,
+            msg.topic,
+            msg.partition,
+            err,
+        )
+        self._undecodable += 1
+
     @async_backoff(msg="Failed to start Kafka Consumer!")
     async def _start_kafka_consumer(self):
         logger.debug("Starting Kafka Consumer")
         self._kafka_consumer = aiokafka.AIOKafkaConsumer(
-            self._kafka_topic,
             bootstrap_servers=self._kafka_uri,
             request_timeout_ms=self._timeout * 1000,
             retry_backoff_ms=self._interval * 1000,
+            group_id=self._group_id,
+            enable_auto_commit=False,
             **self._ssl_arguments,
         )
+        listener = DrainOnRevoke(self._drain)
+        self._kafka_consumer.subscribe([self._kafka_topic], listener=listener)
         await self._kafka_consumer.start()
 
     @async_backoff(msg="Failed to connect storage!")
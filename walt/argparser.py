@@ -17,6 +17,7 @@ from argparse import ArgumentParser
 from argparse import FileType
 
 from walt import __version__
+from walt.event_loop import EVENT_LOOPS
 
 
 class PropertyMetaClass(type):
@@ -65,6 +66,12 @@ class ActionArgParser(metaclass=PropertyMetaClass):
             cls._parser.add_argument(
                 "-c", "--config", type=FileType("r"), help="path to configuration file"
             )
+            cls._parser.add_argument(
+                "-p", "--processes", type=int, help="number of processes to run the action in"
+            )
+            cls._parser.add_argument(
+                "-e", "--event-loop", choices=EVENT_LOOPS, help="event loop implementation"
+            )
             cls._parser.add_argument(
                 "-v", "--verbose", action="store_true", help="activate verbose mode"
             )
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""circuit provides a circuit breaker that stops checking URLs and hosts that
+keep failing, probing them now and then until they recover"""
+
+import time
+
+from walt import logger
+
+
+class _Circuit:
+    def __init__(self):
+        self.failures = 0
+        self.backoff = 0
+        self.open_until = None
+        self.probing = False
+
+
+class CircuitBreaker:
+    """CircuitBreaker opens the circuit of a URL or of a host after
+    `failure_threshold` consecutive failed checks, a success closing it. An open
+    circuit lets a single probe check through after `backoff` seconds, doubled
+    on every failed probe up to `max_backoff` seconds"""
+
+    def __init__(self, failure_threshold, backoff, max_backoff):
+        self._failure_threshold = failure_threshold
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._urls = {}
+        self._hosts = {}
+
+    @property
+    def open_circuits(self):
+        circuits = list(self._urls.values()) + list(self._hosts.values())
+        return sum(1 for circuit in circuits if circuit.open_until is not None)
+
+    def allow(self, url, host):
+        """allow tells whether `url`, on `host`, can be checked, letting it
+        through as the probe of the open circuits it is due to probe"""
+        circuits = [
+            circuit
+            for circuit in (self._urls.get(url), self._hosts.get(host))
+            if circuit is not None and circuit.open_until is not None
+        ]
+        now = time.monotonic()
+        if any(circuit.probing or now < circuit.open_until for circuit in circuits):
+            return False
+        for circuit in circuits:
+            circuit.probing = True
+        return True
+
+    def record(self, url, host, failed):
+        """record accounts for a check of `url`, on `host`, that `failed` or
+        not, opening or closing their circuits accordingly"""
+        for key, circuits in ((url, self._urls), (host, self._hosts)):
+            circuit = circuits.get(key)
+            if failed:
+                if circuit is None:
+                    circuit = circuits[key] = _Circuit()
+                self._fail(key, circuit)
+            elif circuit is not None:
+                if circuit.open_until is not None:
+                    logger.info("Circuit of %s closed", key)
+                del circuits[key]
+
+    def _fail(self, key, circuit):
+        if circuit.open_until is not None:
+            if not circuit.probing:
+                return
+            circuit.backoff = min(circuit.backoff * 2, self._max_backoff)
+        else:
+            circuit.failures += 1
+            if circuit.failures < self._failure_threshold:
+                return
+            circuit.backoff = self._backoff
+        circuit.probing = False
+        circuit.open_until = time.monotonic() + circuit.backoff
+        logger.warning("Circuit of %s open, probing it in %ss", key, circuit.backoff)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""cluster keeps track of the producers that share the URL inventory by means of
+heartbeats exchanged through a Kafka control topic"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+
+from walt import async_backoff
+from walt import logger
+
+
+ALIVE = "alive"
+LEAVING = "leaving"
+
+
+def default_node_id():
+    """default_node_id identifies this process among all producers"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Membership:
+    """Membership announces this node on a control topic every
+    `heartbeat_interval` seconds and tracks the other nodes from their own
+    announcements, considering a node gone if it leaves or isn't heard from for
+    `member_timeout` seconds. `on_change` is called with the sorted list of
+    members whenever it changes"""
+
+    def __init__(self, node_id, heartbeat_interval, member_timeout, on_change):
+        self.node_id = node_id
+        self._heartbeat_interval = heartbeat_interval
+        self._member_timeout = member_timeout
+        self._on_change = on_change
+        self._last_seen = {node_id: time.monotonic()}
+
+    @property
+    def members(self):
+        return sorted(self._last_seen)
+
+    def _message(self, state):
+        return json.dumps({"node": self.node_id, "state": state}).encode()
+
+    async def heartbeat(self, send):
+        """heartbeat announces this node through `send` and expires silent
+        members until cancelled"""
+        while True:
+            try:
+                await send(self._message(ALIVE))
+            except Exception:
+                logger.exception("Failed to send heartbeat of %s", self.node_id)
+            self.expire()
+            await asyncio.sleep(self._heartbeat_interval)
+
+    @async_backoff(msg="Failed to consume control messages!")
+    async def listen(self, consumer):
+        """listen handles the announcements consumed from `consumer`, retrying
+        with backoff if consuming fails, so that this node doesn't end up
+        owning all URLs for not hearing from the others"""
+        async for msg in consumer:
+            self.handle(msg.value)
+
+    async def leave(self, send):
+        """leave announces that this node is leaving"""
+        await send(self._message(LEAVING))
+
+    def handle(self, value):
+        """handle updates the members from an announcement"""
+        try:
+            message = json.loads(value)
+            node, state = message["node"], message["state"]
+        except (ValueError, KeyError, TypeError):
+            logger.error("Invalid control message: %s", value)
+            return
+        if node == self.node_id:
+            return
+        if state == LEAVING:
+            if self._last_seen.pop(node, None) is not None:
+                logger.info("Node %s left", node)
+                self._changed()
+            return
+        is_new = node not in self._last_seen
+        self._last_seen[node] = time.monotonic()
+        if is_new:
+            logger.info("Node %s joined", node)
+            self._changed()
+
+    def expire(self):
+        """expire forgets members not heard from for `member_timeout` seconds"""
+        deadline = time.monotonic() - self._member_timeout
+        expired = [n for n, t in self._last_seen.items() if t < deadline and n != self.node_id]
+        for node in expired:
+            logger.warning("Node %s timed out", node)
+            del self._last_seen[node]
+        if expired:
+            self._changed()
+
+    def _changed(self):
+        self._on_change(self.members)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""concurrency provides a limiter that adapts the number of checks in flight
+to how the targets and the event loop are coping"""
+
+import asyncio
+import collections
+import time
+
+
+SHORT_LATENCY_WEIGHT = 0.3
+LONG_LATENCY_WEIGHT = 0.02
+
+
+class AIMDLimiter:
+    """AIMDLimiter bounds the number of checks in flight by a limit between
+    `min_limit` and `max_limit`. The limit grows additively, by one for every
+    `limit` checks done while others wait for a slot, and shrinks
+    multiplicatively by `backoff` on congestion: a timeout, a recent latency
+    average above `latency_tolerance` times the long-term one, or an event
+    loop lagging more than `max_loop_lag` seconds. Only checks started after
+    the last decrease can trigger another, so a burst of timeouts counts once"""
+
+    def __init__(
+        self,
+        limit,
+        min_limit,
+        max_limit,
+        backoff=0.9,
+        latency_tolerance=2,
+        max_loop_lag=0.1,
+    ):
+        self._min_limit, self._max_limit = min_limit, max_limit
+        self._limit = float(min(max(limit, min_limit), max_limit))
+        self._backoff = backoff
+        self._latency_tolerance = latency_tolerance
+        self._max_loop_lag = max_loop_lag
+        self._short_latency = self._long_latency = None
+        self._last_decrease = float("-inf")
+        self._waiters = collections.deque()
+        self.in_flight = 0
+        self.loop_lag = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    async def acquire(self):
+        """acquire waits for a free slot and returns the time it was taken"""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return time.monotonic()
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake_up()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return time.monotonic()
+
+    def release(self, started, latency=None, timed_out=False):
+        """release frees the slot taken at `started` and adjusts the limit
+        according to the `latency` of the check or whether it `timed_out`"""
+        self.in_flight -= 1
+        self._adjust(started, latency, timed_out)
+        self._wake_up()
+
+    async def monitor_loop_lag(self, interval=0.1):
+        """monitor_loop_lag measures how late the event loop wakes up from
+        sleeping `interval` seconds, until cancelled"""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(time.monotonic() - start - interval, 0)
+
+    def _adjust(self, started, latency, timed_out):
+        if latency is not None:
+            self._update_latency(latency)
+        if self._congested(timed_out):
+            if started > self._last_decrease:
+                self._limit = max(self._min_limit, self._limit * self._backoff)
+                self._last_decrease = time.monotonic()
+        elif self._waiters:
+            self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+
+    def _update_latency(self, latency):
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+        self._short_latency += SHORT_LATENCY_WEIGHT * (latency - self._short_latency)
+        self._long_latency += LONG_LATENCY_WEIGHT * (latency - self._long_latency)
+
+    def _congested(self, timed_out):
+        if timed_out or self.loop_lag > self._max_loop_lag:
+            return True
+        if self._short_latency is None:
+            return False
+        return self._short_latency > self._long_latency * self._latency_tolerance
+
+    def _wake_up(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
@@ -25,29 +25,104 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 HEADERS = {"Pragma": "no-cache"}
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.141 Safari/537.36"  # NOQA
 
+PROCESSES = 1  # Number of processes to run the action in
+EVENT_LOOP = "asyncio"  # Event loop implementation: "asyncio" or "uvloop" (if installed)
+SERDE = "binary"  # Result format sent: "binary", "text", "json" or "msgpack" (if installed)
 CONCURRENT = 2  # Number of concurrent workers
-INTERVAL = 2  # Sleep interval for each worker
+INTERVAL = 2  # Interval between consecutive checks of the same URL
+JITTER = 0.1  # Random shift of each check, as a fraction of the interval
 TIMEOUT = 30  # Timeout for HTTP connections
+MAX_BODY_BYTES = 1048576  # Maximum number of bytes read from a page looking for a pattern
+BODY_CHUNK_SIZE = 65536  # Number of bytes read from a page at a time
+PATTERN_OVERLAP = 1024  # Number of characters of a chunk also searched along with the next
+HEADERS_ONLY = ""  # "HEAD" or "GET" to fetch only headers of URLs without a pattern
+STATS_INTERVAL = 0  # Interval between statistics reports, 0 disables them and tracing
 
 CONFIG = {
     "log_level": LOG_LEVEL,
+    "processes": PROCESSES,
+    "event_loop": EVENT_LOOP,
+    "serde": SERDE,
     "concurrent": CONCURRENT,
     "interval": INTERVAL,
+    "jitter": JITTER,
     "timeout": TIMEOUT,
+    "max_body_bytes": MAX_BODY_BYTES,
+    "body_chunk_size": BODY_CHUNK_SIZE,
+    "pattern_overlap": PATTERN_OVERLAP,
+    "headers_only": HEADERS_ONLY,
+    "stats_interval": STATS_INTERVAL,
     "user_agent": USER_AGENT,
     "headers": HEADERS,
+    "url_source": "",  # Path of a CSV or JSONL file of more URLs and patterns
+    "announce_interval": 300,  # Seconds between sends of each URL with a result, 0 sends it once
     "url_map": {  # A dictionary of URL => regexp pattern
         "https://duckduckgo.com/?q=walt": "Walt Disney",
         "https://www.google.com/search?q=walt": "Walt Disney",
         "https://duckduckgo.com/?q=doge+meme": "Kabosu",
         "https://www.google.com/search?q=doge+meme": "Kabosu",
     },
+    "interval_map": {},  # A dictionary of URL => interval overriding `interval`
+    "headers_only_map": {},  # A dictionary of URL => method overriding `headers_only`
+    "concurrency": {
+        "adaptive": False,  # Adapt the number of concurrent checks, starting from `concurrent`
+        "min": 1,  # Minimum number of concurrent checks
+        "max": 100,  # Maximum number of concurrent checks
+        "backoff": 0.9,  # Factor the limit is multiplied by on congestion
+        "latency_tolerance": 2,  # Recent to long-term latency ratio considered congestion
+        "max_loop_lag": 0.1,  # Seconds of event loop lag considered congestion
+    },
+    "host_limit": {
+        "rate": 0,  # Checks per second of the same host, 0 is no limit
+        "burst": 1,  # Checks of the same host allowed at once above `rate`
+        "concurrent": 0,  # Concurrent checks of the same host, 0 is no limit
+    },
+    "circuit": {
+        "failure_threshold": 0,  # Consecutive failures opening a circuit, 0 disables circuits
+        "backoff": 30,  # Seconds before probing an open circuit for the first time
+        "max_backoff": 600,  # Maximum seconds between probes, doubled after each failure
+    },
+    "pattern_pool": {
+        "min_size": 0,  # Characters from which a page window is searched in the pool, 0 is never
+        "workers": 2,  # Number of processes searching patterns
+        "budget": 5,  # Seconds a check may spend searching in the pool, 0 is no limit
+    },
+    "http": {
+        "limit": 100,  # Total number of simultaneous connections
+        "limit_per_host": 0,  # Number of simultaneous connections to the same host, 0 is no limit
+        "ttl_dns_cache": 10,  # Seconds DNS resolutions are cached for, 0 disables the cache
+        "keepalive_timeout": 15,  # Seconds idle connections are kept open for reuse
+        "reuse_tls_context": True,  # Share a TLS context among connections, false makes one each
+        "trace_phases": False,  # Time DNS, connect, time to headers and body of each request
+    },
     "kafka": {
         "uri": "localhost:9092",  # Kafka server URI
         "cafile": "",  # Certificate Authority file path
         "certfile": "",  # Client Certificate file path
         "keyfile": "",  # Client Private Key file path
         "topic": "walt",  # Default topic
+        "publish_queue_size": 1000,  # Number of results waiting to be sent before checks pause
+        "max_in_flight": 100,  # Number of sends waiting for the broker at a time
+        "batch_results": 1,  # Number of results packed into one message, 1 sends them one by one
+        "batch_interval": 0.1,  # Seconds to wait for `batch_results` results before sending fewer
+        "linger_ms": 0,  # Milliseconds the Kafka producer waits to batch messages together
+        "max_batch_size": 16384,  # Maximum bytes of a Kafka producer batch per partition
+        "compression_type": "",  # "gzip", "snappy", "lz4", "zstd" or "" for no compression
+    },
+    "consumer": {
+        "batch_size": 0,  # Number of results stored in one transaction, 0 stores them one by one
+        "batch_timeout": 1,  # Seconds to wait for `batch_size` results before storing fewer
+        "group_id": "walt",  # Kafka consumer group, committing offsets only of stored results
+        "queue_size": 4,  # Number of fetches, and of batches, waiting for the next stage
+        "copy": "",  # "text" or "binary" to store batches with COPY instead of multi-row INSERTs
+    },
+    "cluster": {
+        "enabled": False,  # Share the URLs with other producers in the cluster
+        "node_id": "",  # Unique producer identifier, defaults to hostname and process id
+        "control_topic": "walt-control",  # Topic producers announce themselves on
+        "heartbeat_interval": 3,  # Interval between announcements
+        "member_timeout": 10,  # Time after which a silent producer leaves the cluster
+        "vnodes": 64,  # Number of points each producer takes on the hash ring
     },
     "postgres": {
         "host": "localhost",  # Database host address
@@ -59,8 +134,9 @@ CONFIG = {
 }
 
 
-def load(config_toml):
-    """load returns CONFIG updated with values loaded from a TOML file"""
+def load(config_toml, strict=False):
+    """load returns CONFIG updated with values loaded from a TOML file. Errors
+    are logged and leave the defaults, or are raised if `strict`"""
     cfg = deepcopy(CONFIG)
     if not config_toml:
         return cfg
@@ -68,11 +144,26 @@ def load(config_toml):
     try:
         logger.info("[config] loading from %s", file_name)
         deep_update(cfg, toml.load(config_toml))
+        check(cfg)
     except Exception as err:
+        if strict:
+            raise
         logger.error("[config] could not load from %s: %s", file_name, err)
     return cfg
 
 
+def check(cfg):
+    """check warns about settings that can never take effect"""
+    max_window = cfg["body_chunk_size"] + cfg["pattern_overlap"] + 1
+    if cfg["pattern_pool"]["min_size"] > max_window:
+        logger.warning(
+            "[config] pattern_pool.min_size %d exceeds the largest window of %d characters, "
+            "which body_chunk_size and pattern_overlap allow: the pattern pool is never used",
+            cfg["pattern_pool"]["min_size"],
+            max_window,
+        )
+
+
 def deep_update(cfg, other):
     """deep_update recursively mutates `cfg`, copying items from `other`,
     recursing when both values are dictionaries and overriding otherwise"""
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""envelope packs many serialized Results into a single Kafka message and
+unpacks them back"""
+
+import struct
+
+
+ENVELOPE_VERSION = 2  # First byte of envelopes, none of a serialized Result
+ENVELOPE_HEADER = struct.Struct("!BI")  # Followed by the messages
+MESSAGE_HEADER = struct.Struct("!I")  # Followed by the message
+
+
+def pack(messages):
+    """pack returns an envelope of `messages`, each prefixed by its length"""
+    parts = [ENVELOPE_HEADER.pack(ENVELOPE_VERSION, len(messages))]
+    for msg in messages:
+        parts.append(MESSAGE_HEADER.pack(len(msg)))
+        parts.append(msg)
+    return b"".join(parts)
+
+
+def is_envelope(value):
+    return value[:1] == ENVELOPE_VERSION.to_bytes(1, "big")
+
+
+def unpack(value):
+    """unpack returns the messages of an envelope as memoryviews of it, or a
+    list of just `value` if it's not an envelope"""
+    if not is_envelope(value):
+        return [value]
+    try:
+        _, count = ENVELOPE_HEADER.unpack_from(value)
+        view, offset, messages = memoryview(value), ENVELOPE_HEADER.size, []
+        for _ in range(count):
+            (length,) = MESSAGE_HEADER.unpack_from(view, offset)
+            offset += MESSAGE_HEADER.size
+            if offset + length > len(view):
+                raise ValueError(f"message of {length} bytes overflows the envelope")
+            messages.append(view[offset : offset + length])
+            offset += length
+        if offset != len(view):
+            raise ValueError(f"{len(view) - offset} bytes left after {count} messages")
+        return messages
+    except struct.error as err:
+        raise ValueError(f"Invalid envelope: {err}") from err
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""event_loop chooses the implementation of the event loop actions run on"""
+
+import asyncio
+
+from walt import logger
+
+
+ASYNCIO = "asyncio"
+UVLOOP = "uvloop"
+EVENT_LOOPS = (ASYNCIO, UVLOOP)
+
+
+def set_event_loop_policy(name):
+    """set_event_loop_policy makes asyncio create event loops of the `name`
+    implementation, falling back to asyncio's own if it's unknown or not
+    installed, and returns the name of the implementation in use"""
+    if name == UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("uvloop is not installed, falling back to asyncio")
+        else:
+            if not isinstance(asyncio.get_event_loop_policy(), uvloop.EventLoopPolicy):
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return UVLOOP
+    elif name != ASYNCIO:
+        logger.warning("Unknown event loop %s, falling back to asyncio", name)
+    if not isinstance(asyncio.get_event_loop_policy(), asyncio.DefaultEventLoopPolicy):
+        asyncio.set_event_loop_policy(None)
+    return ASYNCIO
+
+
+def get_event_loop(name):
+    """get_event_loop returns the event loop of this thread, of the `name`
+    implementation if possible, creating it if there is none"""
+    set_event_loop_policy(name)
+    try:
+        return asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""http_client configures the HTTP connection pool used to check URLs and
+collects statistics about it and about the phases of each request"""
+
+import functools
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def url_host(url):
+    """url_host returns the host of `url`, along with its port if any"""
+    return urlsplit(url).netloc
+
+
+def create_connector(cfg):
+    """create_connector returns a TCP connector configured with the `http`
+    section of the configuration"""
+    if cfg["reuse_tls_context"]:
+        connector_class, ssl_context = aiohttp.TCPConnector, ssl.create_default_context()
+    else:
+        connector_class, ssl_context = FreshTLSContextConnector, True
+    return connector_class(
+        limit=cfg["limit"],
+        limit_per_host=cfg["limit_per_host"],
+        ttl_dns_cache=cfg["ttl_dns_cache"] or None,
+        use_dns_cache=cfg["ttl_dns_cache"] != 0,
+        keepalive_timeout=cfg["keepalive_timeout"],
+        ssl=ssl_context,
+    )
+
+
+class FreshTLSContextConnector(aiohttp.TCPConnector):
+    """FreshTLSContextConnector creates a TLS context for each connection it
+    verifies, instead of sharing aiohttp's, so that connections share neither
+    TLS sessions nor loaded certificates, at the cost of loading the CA
+    certificates every time"""
+
+    def _get_ssl_context(self, req):
+        ssl_context = super()._get_ssl_context(req)
+        if ssl_context is None or ssl_context.verify_mode == ssl.CERT_NONE:
+            return ssl_context
+        return ssl.create_default_context()
+
+
+class ConnectionPoolStats:
+    """ConnectionPoolStats counts new and reused connections through aiohttp
+    tracing and reports them since the last report"""
+
+    def __init__(self):
+        self.created, self.reused = 0, 0
+        self._last_created, self._last_reused = 0, 0
+        self._last_time = time.monotonic()
+
+    def trace_config(self):
+        """trace_config returns a TraceConfig that feeds these statistics"""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        return trace_config
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        self.created += 1
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        self.reused += 1
+
+    def report(self):
+        """report returns the reuse ratio and the rate of new connections
+        since the last report"""
+        now = time.monotonic()
+        created = self.created - self._last_created
+        reused = self.reused - self._last_reused
+        elapsed = now - self._last_time
+        self._last_created, self._last_reused, self._last_time = self.created, self.reused, now
+        return {
+            "connections_created": self.created,
+            "connections_reused": self.reused,
+            "reuse_ratio": round(reused / (created + reused), 3) if created + reused else 0,
+            "new_connections_per_second": round(created / elapsed, 3) if elapsed else 0,
+        }
+
+
+class PhaseTimings:
+    """PhaseTimings measures the phases of one request, in seconds: DNS
+    resolution, connection establishment (TCP and TLS, as aiohttp doesn't tell
+    them apart), time to the response headers since the request started, and
+    body download. It's fed by the hooks of `phase_trace_config` when passed as
+    the `trace_request_ctx` of a request. Phases a reused connection skips
+    take 0 seconds"""
+
+    def __init__(self):
+        self.dns_time, self.connect_time = 0, 0
+        self._request_start = self._headers_end = None
+        self._dns_start = self._connect_start = None
+        self._dns_before_connect = 0
+
+    def fill(self, res):
+        """fill sets the phase timings of `res`, considering its body done
+        downloading now"""
+        if self._headers_end is None:
+            return
+        res.dns_time = self.dns_time
+        res.connect_time = self.connect_time
+        res.ttfb = self._headers_end - self._request_start
+        res.body_time = time.monotonic() - self._headers_end
+
+
+def phase_trace_config():
+    """phase_trace_config returns a TraceConfig that feeds the PhaseTimings
+    passed to requests"""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config
+
+
+async def _on_request_start(session, ctx, params):
+    if ctx.trace_request_ctx:
+        ctx.trace_request_ctx._request_start = time.monotonic()
+
+
+async def _on_dns_resolvehost_start(session, ctx, params):
+    if ctx.trace_request_ctx:
+        ctx.trace_request_ctx._dns_start = time.monotonic()
+
+
+async def _on_dns_resolvehost_end(session, ctx, params):
+    timings = ctx.trace_request_ctx
+    if timings and timings._dns_start is not None:
+        timings.dns_time += time.monotonic() - timings._dns_start
+
+
+async def _on_connection_create_start(session, ctx, params):
+    timings = ctx.trace_request_ctx
+    if timings:
+        timings._connect_start = time.monotonic()
+        timings._dns_before_connect = timings.dns_time
+
+
+async def _on_connection_create_end(session, ctx, params):
+    timings = ctx.trace_request_ctx
+    if timings and timings._connect_start is not None:
+        dns_time = timings.dns_time - timings._dns_before_connect
+        timings.connect_time += time.monotonic() - timings._connect_start - dns_time
+
+
+async def _on_request_end(session, ctx, params):
+    if ctx.trace_request_ctx:
+        ctx.trace_request_ctx._headers_end = time.monotonic()
@@ -10,6 +10,7 @@
 
 """main contains the `walt` entry point along with main actions"""
 
+import functools
 import logging
 import os
 import sys
@@ -20,8 +21,9 @@ from walt.action_runners import Consumer
 from walt.action_runners import Producer
 from walt.argparser import ActionArgParser
 from walt.argparser import action
-from walt.result import ResultSerde
+from walt.serdes import get_serde
 from walt.storages import PostgresResultStorage
+from walt.supervisor import Supervisor
 
 
 def walt():  # pragma: no cover
@@ -33,6 +35,9 @@ def walt():  # pragma: no cover
 
         $ walt [-c config.toml] <action>
         $ walt -c config.toml produce  # to start a producer
+        $ walt -c config.toml -p 4 produce  # to start 4 producer processes
+        $ walt -c config.toml -e uvloop produce  # to produce on uvloop
+        $ walt -c config.toml -p 4 consume  # to start 4 consumer processes
 
     """
     set_verbosity(ActionArgParser.args.verbose)
@@ -47,14 +52,35 @@ def walt():  # pragma: no cover
             logger.fatal("Cannot proceed with no config file")
             sys.exit(1)
         else:
-            cfg = config.load(ActionArgParser.args.config)
-            config.override_from(cfg, os.environ)
+            cfg = load_config(ActionArgParser.args.config)
+            cfg["config_path"] = ActionArgParser.args.config.name
+            if ActionArgParser.args.processes:
+                cfg["processes"] = ActionArgParser.args.processes
+            if ActionArgParser.args.event_loop:
+                cfg["event_loop"] = ActionArgParser.args.event_loop
             set_verbosity(level_name=cfg.get("log_level"))
             ActionArgParser.run_action(cfg)
     else:
         ActionArgParser.print_usage()
 
 
+def load_config(config_toml, strict=False):
+    """load_config loads the configuration from `config_toml`, overridden by
+    environment variables"""
+    cfg = config.load(config_toml, strict)
+    config.override_from(cfg, os.environ)
+    return cfg
+
+
+def config_reloader(cfg):
+    """config_reloader returns a function that loads the configuration again
+    from the file `cfg` was loaded from, raising errors, or None if there is
+    no such file"""
+    if not cfg.get("config_path"):
+        return None
+    return functools.partial(load_config, cfg["config_path"], strict=True)
+
+
 def set_verbosity(verbose=False, level_name=""):  # pragma: no cover
     level = level_name and getattr(logging, level_name.upper())
     if level:
@@ -91,12 +117,51 @@ def drop_tables(cfg):
 
 @action
 def produce(cfg):
-    producer = Producer(cfg)
+    if cfg["processes"] > 1:
+        target = functools.partial(produce_shard, cfg)
+        supervisor = Supervisor(
+            "Producer", target, cfg["processes"], stats_interval=cfg["stats_interval"]
+        )
+        supervisor.run()
+        return
+    producer = Producer(cfg, reload_config=config_reloader(cfg))
+    producer.run()
+
+
+def produce_shard(cfg, shard, shards, counter):
+    """produce_shard runs a producer that checks the `shard` out of `shards`
+    shards of the URLs, counting the results it produces on the shared
+    `counter`. In a cluster, each process is a member on its own, with the
+    shard appended to a configured node id, and takes its share of all URLs"""
+    reload_config = config_reloader(cfg)
+    if not cfg["cluster"]["enabled"]:
+        producer = Producer(cfg, counter, shard, shards, reload_config=reload_config)
+    else:
+        if cfg["cluster"]["node_id"]:
+            node_id = f"{cfg['cluster']['node_id']}-{shard}"
+            cfg = {**cfg, "cluster": {**cfg["cluster"], "node_id": node_id}}
+        producer = Producer(cfg, counter, reload_config=reload_config)
     producer.run()
 
 
 @action
 def consume(cfg):
+    if cfg["processes"] > 1:
+        target = functools.partial(consume_shard, cfg)
+        supervisor = Supervisor(
+            "Consumer", target, cfg["processes"], stats_interval=cfg["stats_interval"]
+        )
+        supervisor.run()
+        return
+    storage = PostgresResultStorage(**cfg["postgres"])
+    consumer = Consumer(cfg, storage, get_serde(cfg["serde"]))
+    consumer.run()
+
+
+def consume_shard(cfg, shard, shards, counter):
+    """consume_shard runs a consumer in the consumer group, which spreads the
+    partitions of the topic among all of them, counting the results it stores
+    on the shared `counter`. `shard` and `shards` are only for the Supervisor"""
     storage = PostgresResultStorage(**cfg["postgres"])
-    consumer = Consumer(cfg, storage, ResultSerde)
+    consumer = Consumer(cfg, storage, get_serde(cfg["serde"]), counter)
     consumer.run()
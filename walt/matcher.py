@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""matcher provides a regexp matcher that searches a page as it is downloaded
+and a process pool to search large pages off the event loop"""
+
+import asyncio
+import codecs
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import NamedTuple
+from typing import Pattern
+
+
+DEFAULT_ENCODING = "utf-8"
+
+
+class Window(NamedTuple):
+    """Window is a piece of a page to be searched from `pos` on"""
+
+    regexp: Pattern
+    text: str
+    pos: int
+    final: bool
+
+
+def search_window(window):
+    """search_window tells whether the regexp of `window` matches its text.
+    Unless `window` is the final one, matches ending on its last two
+    characters are not trusted, as they might change with what comes next"""
+    regexp, text, pos, final = window
+    if final:
+        return regexp.search(text, pos) is not None
+    return any(match.end() < len(text) - 1 for match in regexp.finditer(text, pos))
+
+
+class StreamMatcher:
+    """StreamMatcher decodes a body fed in chunks of bytes and searches a regexp
+    pattern in it. The last `overlap` characters of each chunk are kept and
+    searched along with the next one, so that matches up to `overlap`
+    characters long are found even if they cross chunk boundaries.
+
+    Anchors keep their meaning: `^` and `\\A` only match at the beginning of
+    the body, since one more character before the kept ones is retained as
+    context and the search starts after it. Until the body is over, matches
+    ending on the last two characters of a window are not trusted, as `$`,
+    `\\Z`, `\\b` and lookaheads can't see what comes next; they are found
+    again along with the next chunk. Hence a match that keeps running up to the
+    end of every window, like an unbounded `.*` on a body with no newlines, is
+    only found if it starts within the last `overlap` characters of the body"""
+
+    def __init__(self, regexp, encoding=None, overlap=0):
+        self._regexp = regexp
+        self._decoder = self._incremental_decoder(encoding)
+        self._overlap = overlap
+        self._tail = ""
+        self._pos = 0
+        self.found = False
+
+    @staticmethod
+    def _incremental_decoder(encoding):
+        try:
+            decoder_class = codecs.getincrementaldecoder(encoding or DEFAULT_ENCODING)
+        except LookupError:
+            decoder_class = codecs.getincrementaldecoder(DEFAULT_ENCODING)
+        return decoder_class(errors="replace")
+
+    def feed(self, chunk, final=False):
+        """feed decodes and searches `chunk`, returning whether the pattern has
+        been found so far"""
+        if self.found:
+            return True
+        return self.update(search_window(self.window(chunk, final)))
+
+    def window(self, chunk, final=False):
+        """window decodes `chunk` and returns the Window to search next, so
+        that it can be searched elsewhere and the outcome given to `update`"""
+        text = self._tail + self._decoder.decode(chunk, final)
+        window = Window(self._regexp, text, self._pos, final)
+        if len(text) > self._overlap + 1:
+            self._tail, self._pos = text[-self._overlap - 1 :], 1
+        else:
+            self._tail = text
+        return window
+
+    def update(self, found):
+        """update takes whether the last window was matched and returns
+        whether the pattern has been found so far"""
+        self.found = self.found or found
+        return self.found
+
+
+class PatternPool:
+    """PatternPool searches windows in `workers` processes, since the regexp
+    engine holds the GIL and a thread would block the event loop just the
+    same. A search taking longer than its timeout kills the processes, so a
+    runaway pattern can't hold a worker forever, and the searches caught in
+    the middle are retried in the new processes"""
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            self._workers, mp_context=get_context("spawn"), initializer=_ignore_signals
+        )
+
+    async def search(self, window, timeout=None):
+        """search tells whether `window` matches, raising asyncio.TimeoutError
+        if it takes longer than `timeout` seconds"""
+        loop = asyncio.get_event_loop()
+        while True:
+            executor = self._executor
+            try:
+                future = loop.run_in_executor(executor, search_window, window)
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self._restart(executor)
+                raise
+            except BrokenProcessPool:
+                self._restart(executor)
+
+    def _restart(self, executor):
+        if executor is not self._executor:
+            return
+        # The executor has no public way to stop a running call
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+        self._executor = self._create_executor()
+
+    def shutdown(self):
+        """shutdown stops the processes"""
+        self._executor.shutdown(wait=False)
+
+
+def _ignore_signals():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
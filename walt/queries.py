@@ -11,48 +11,188 @@
 """queries collects all queries used by walt"""
 
 DROP_TABLES_SQL = """
+DROP TABLE IF EXISTS url;
 DROP TABLE IF EXISTS result;
 DROP TYPE IF EXISTS pattern_type;
 DROP TABLE IF EXISTS error;
 DROP TYPE IF EXISTS error_type;
 """
 
+TABLES_EXIST_SQL = "SELECT to_regclass('result') IS NOT NULL;"
+
 CREATE_TABLES_SQL = """
-CREATE TYPE pattern_type AS ENUM ('FOUND', 'NO_PATTERN', 'NOT_FOUND', 'IRRELEVANT');
+CREATE TABLE IF NOT EXISTS url (
+    url_id BIGINT PRIMARY KEY,
+    url VARCHAR NOT NULL
+);
+
+CREATE TYPE pattern_type AS ENUM (
+    'FOUND', 'NO_PATTERN', 'NOT_FOUND', 'IRRELEVANT', 'BUDGET_EXCEEDED'
+);
 
 CREATE TABLE IF NOT EXISTS result (
     result_id INT GENERATED ALWAYS AS IDENTITY,
-    url VARCHAR NOT NULL,
+    url_id BIGINT NOT NULL,
     response_time decimal not null,
     status_code int not null,
     pattern pattern_type not null,
-    timestamp timestamptz
+    timestamp timestamptz,
+    dns_time decimal,
+    connect_time decimal,
+    ttfb decimal,
+    body_time decimal,
+    producer_id BIGINT NOT NULL DEFAULT 0
 );
 
-CREATE INDEX result_url_index ON result(url ASC NULLS LAST);
+CREATE UNIQUE INDEX result_dedupe_index ON result(url_id, timestamp, producer_id);
 
-CREATE TYPE error_type AS ENUM ('CLIENT_ERROR', 'TIMEOUT_ERROR', 'ERROR');
+CREATE TYPE error_type AS ENUM ('CLIENT_ERROR', 'TIMEOUT_ERROR', 'ERROR', 'CIRCUIT_OPEN');
 
 CREATE TABLE IF NOT EXISTS error (
     error_id INT GENERATED ALWAYS AS IDENTITY,
-    url VARCHAR NOT NULL,
+    url_id BIGINT NOT NULL,
     error error_type not null,
-    timestamp timestamptz
+    timestamp timestamptz,
+    producer_id BIGINT NOT NULL DEFAULT 0
 );
 
-CREATE INDEX error_url_index ON error(url ASC NULLS LAST);
+CREATE UNIQUE INDEX error_dedupe_index ON error(url_id, timestamp, producer_id);
 """
 
-RESULT_INSERT_SQL = """
-INSERT INTO result (url, response_time, status_code, pattern, timestamp) VALUES (
-    %(url)s, %(response_time)s, %(status_code)s, %(pattern)s,
-    TIMESTAMP 'epoch' + %(utc_timestamp_ms)s * INTERVAL '1 millisecond'
+ADD_ENUM_VALUES_SQLS = (
+    "ALTER TYPE pattern_type ADD VALUE IF NOT EXISTS 'BUDGET_EXCEEDED';",
+    "ALTER TYPE error_type ADD VALUE IF NOT EXISTS 'CIRCUIT_OPEN';",
+)
+
+MIGRATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS url (
+    url_id BIGINT PRIMARY KEY,
+    url VARCHAR NOT NULL
 );
+
+ALTER TABLE result
+    ADD COLUMN IF NOT EXISTS url_id BIGINT,
+    ADD COLUMN IF NOT EXISTS dns_time decimal,
+    ADD COLUMN IF NOT EXISTS connect_time decimal,
+    ADD COLUMN IF NOT EXISTS ttfb decimal,
+    ADD COLUMN IF NOT EXISTS body_time decimal,
+    ADD COLUMN IF NOT EXISTS producer_id BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE error
+    ADD COLUMN IF NOT EXISTS url_id BIGINT,
+    ADD COLUMN IF NOT EXISTS producer_id BIGINT NOT NULL DEFAULT 0;
+"""
+
+URL_COLUMN_EXISTS_SQL = """
+SELECT EXISTS (
+    SELECT FROM information_schema.columns
+    WHERE table_name = 'result' AND column_name = 'url'
+);
+"""
+
+LEGACY_URLS_SQL = "SELECT url FROM result UNION SELECT url FROM error;"
+
+MIGRATE_URL_IDS_SQL = """
+UPDATE result SET url_id = url.url_id FROM url WHERE result.url = url.url;
+UPDATE error SET url_id = url.url_id FROM url WHERE error.url = url.url;
+
+DROP INDEX IF EXISTS result_url_index;
+DROP INDEX IF EXISTS error_url_index;
+
+ALTER TABLE result DROP COLUMN url, ALTER COLUMN url_id SET NOT NULL;
+ALTER TABLE error DROP COLUMN url, ALTER COLUMN url_id SET NOT NULL;
+
+CREATE INDEX result_url_index ON result(url_id);
+CREATE INDEX error_url_index ON error(url_id);
 """
 
-ERROR_INSERT_SQL = """
-INSERT INTO error (url, error, timestamp) VALUES (
-    %(url)s, %(result_type)s,
-    TIMESTAMP 'epoch' + %(utc_timestamp_ms)s * INTERVAL '1 millisecond'
+DEDUPE_INDEXES_EXIST_SQL = """
+SELECT EXISTS (
+    SELECT FROM pg_indexes
+    WHERE indexname = 'result_dedupe_index' AND indexdef LIKE '%producer_id%'
 );
 """
+
+MIGRATE_DEDUPE_SQL = """
+DELETE FROM result a USING result b
+    WHERE a.result_id > b.result_id AND a.url_id = b.url_id AND a.timestamp = b.timestamp
+    AND a.producer_id = b.producer_id;
+DELETE FROM error a USING error b
+    WHERE a.error_id > b.error_id AND a.url_id = b.url_id AND a.timestamp = b.timestamp
+    AND a.producer_id = b.producer_id;
+
+DROP INDEX IF EXISTS result_url_index;
+DROP INDEX IF EXISTS error_url_index;
+DROP INDEX IF EXISTS result_dedupe_index;
+DROP INDEX IF EXISTS error_dedupe_index;
+
+CREATE UNIQUE INDEX result_dedupe_index ON result(url_id, timestamp, producer_id);
+CREATE UNIQUE INDEX error_dedupe_index ON error(url_id, timestamp, producer_id);
+"""
+
+URL_VALUES = "(%s, %s)"
+
+URL_INSERT_MANY_SQL = """
+INSERT INTO url (url_id, url) VALUES {values} ON CONFLICT (url_id) DO NOTHING;
+"""
+
+RESULT_VALUES = """(
+    %s, %s, %s, %s, TIMESTAMP 'epoch' + %s * INTERVAL '1 millisecond', %s, %s, %s, %s, %s
+)"""
+
+RESULT_INSERT_MANY_SQL = """
+INSERT INTO result (
+    url_id, response_time, status_code, pattern, timestamp, dns_time, connect_time, ttfb,
+    body_time, producer_id
+) VALUES {values}
+ON CONFLICT (url_id, timestamp, producer_id) DO NOTHING;
+"""
+
+ERROR_VALUES = "(%s, %s, TIMESTAMP 'epoch' + %s * INTERVAL '1 millisecond', %s)"
+
+ERROR_INSERT_MANY_SQL = """
+INSERT INTO error (url_id, error, timestamp, producer_id) VALUES {values}
+ON CONFLICT (url_id, timestamp, producer_id) DO NOTHING;
+"""
+
+URL_INSERT_SQL = URL_INSERT_MANY_SQL.format(values=URL_VALUES)
+
+RESULT_INSERT_SQL = RESULT_INSERT_MANY_SQL.format(values=RESULT_VALUES)
+
+ERROR_INSERT_SQL = ERROR_INSERT_MANY_SQL.format(values=ERROR_VALUES)
+
+COPY_TABLES_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS result_copy ON COMMIT DELETE ROWS AS SELECT
+    url_id, response_time, status_code, pattern, timestamp, dns_time, connect_time, ttfb,
+    body_time, producer_id
+FROM result WITH NO DATA;
+
+CREATE TEMP TABLE IF NOT EXISTS error_copy ON COMMIT DELETE ROWS AS SELECT
+    url_id, error, timestamp, producer_id
+FROM error WITH NO DATA;
+"""
+
+RESULT_COPY_SQL = """
+COPY result_copy (
+    url_id, response_time, status_code, pattern, timestamp, dns_time, connect_time, ttfb,
+    body_time, producer_id
+) FROM STDIN WITH (FORMAT {copy_format});
+"""
+
+RESULT_COPY_INSERT_SQL = """
+INSERT INTO result (
+    url_id, response_time, status_code, pattern, timestamp, dns_time, connect_time, ttfb,
+    body_time, producer_id
+) SELECT * FROM result_copy
+ON CONFLICT (url_id, timestamp, producer_id) DO NOTHING;
+"""
+
+ERROR_COPY_SQL = """
+COPY error_copy (url_id, error, timestamp, producer_id)
+FROM STDIN WITH (FORMAT {copy_format});
+"""
+
+ERROR_COPY_INSERT_SQL = """
+INSERT INTO error (url_id, error, timestamp, producer_id)
+SELECT * FROM error_copy ON CONFLICT (url_id, timestamp, producer_id) DO NOTHING;
+"""
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""ratelimit provides a per-host limiter that keeps checks polite to the
+websites they target"""
+
+import time
+
+from walt.http_client import url_host
+
+
+BUSY_RETRY_DELAY = 0.1  # Seconds to wait for a host with all connections busy
+
+
+class _Bucket:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        self.in_flight = 0
+
+
+class HostRateLimiter:
+    """HostRateLimiter bounds the checks of each host to `rate` per second,
+    with bursts of up to `burst` checks, by means of a token bucket, and to
+    `concurrent` checks at a time. A 0 `rate` or `concurrent` is no limit.
+    Instead of waiting, `acquire` tells how long to wait before trying again"""
+
+    def __init__(self, rate=0, burst=1, concurrent=0):
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._concurrent = concurrent
+        self._buckets = {}
+        self.throttled = 0
+
+    def acquire(self, url):
+        """acquire takes a slot of the host of `url` and returns 0 if it's
+        free, otherwise the seconds until it is expected to be"""
+        bucket = self._bucket(url_host(url))
+        if self._concurrent and bucket.in_flight >= self._concurrent:
+            self.throttled += 1
+            return BUSY_RETRY_DELAY
+        if self._rate:
+            now = time.monotonic()
+            elapsed, bucket.updated = now - bucket.updated, now
+            bucket.tokens = min(self._burst, bucket.tokens + elapsed * self._rate)
+            if bucket.tokens < 1:
+                self.throttled += 1
+                return (1 - bucket.tokens) / self._rate
+            bucket.tokens -= 1
+        bucket.in_flight += 1
+        return 0
+
+    def release(self, url):
+        """release frees the slot of the host of `url` taken by `acquire`"""
+        self._bucket(url_host(url)).in_flight -= 1
+
+    def _bucket(self, host):
+        try:
+            return self._buckets[host]
+        except KeyError:
+            bucket = self._buckets[host] = _Bucket(self._burst)
+            return bucket
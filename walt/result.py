@@ -10,14 +10,21 @@
 
 """result defines Result, its attributes types and a de/serializer"""
 
-from dataclasses import dataclass
-from dataclasses import field
-from datetime import datetime
+import hashlib
+import struct
+import time
 from enum import Enum
 from enum import auto
+from typing import Optional
 
 
-EPOCH = datetime(1970, 1, 1)  # timezone-naïve epoch time
+BINARY_VERSION = 4  # First byte of binary Results, not a digit, an envelope or msgpack one
+BINARY_HEADER = struct.Struct("!BBBBHdqqqI")  # Followed by the phases present and the URL
+LEGACY_BINARY_VERSION = 1
+LEGACY_BINARY_HEADER = struct.Struct("!BBBBHdqqI")  # Without the producer id
+BINARY_HEADERS = {LEGACY_BINARY_VERSION: LEGACY_BINARY_HEADER, BINARY_VERSION: BINARY_HEADER}
+BINARY_MAGICS = tuple(version.to_bytes(1, "big") for version in BINARY_HEADERS)
+PHASE = struct.Struct("!d")
 
 
 class ResultType(Enum):
@@ -27,6 +34,7 @@ class ResultType(Enum):
     CLIENT_ERROR = auto()
     TIMEOUT_ERROR = auto()
     ERROR = auto()
+    CIRCUIT_OPEN = auto()
 
 
 class Pattern(Enum):
@@ -36,41 +44,106 @@ class Pattern(Enum):
     NO_PATTERN = auto()
     NOT_FOUND = auto()
     IRRELEVANT = auto()
+    BUDGET_EXCEEDED = auto()
+
+
+def hash_url(url):
+    """hash_url returns the stable id of `url`: a signed 64-bit integer, as
+    fits a Postgres BIGINT, taken from its BLAKE2b digest"""
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def hash_node(node_id):
+    """hash_node returns the stable id of the producer `node_id`, the same
+    way hash_url does for URLs"""
+    return hash_url(node_id)
 
 
 def utc_now_ms():
     """utc_now_ms returns the current UTC timestamp in milliseconds"""
-    return round((datetime.utcnow() - EPOCH).total_seconds() * 1e3)
+    return time.time_ns() // 1_000_000
 
 
-@dataclass
 class Result:
-    """Result stores website verification results"""
+    """Result stores website verification results. Request phase timings are
+    only present if traced. The URL is identified by `url_id`, computed from
+    `url` if missing, so that `url` can be left empty once its id is known.
+    The producer that checked the URL is identified by `producer_id`, so that
+    results of distinct producers never pass for duplicates. Attributes are
+    slotted, as a Result is created for every check and every consumed
+    message"""
+
+    __slots__ = (
+        "result_type",
+        "url",
+        "response_time",
+        "status_code",
+        "pattern",
+        "utc_timestamp_ms",
+        "dns_time",
+        "connect_time",
+        "ttfb",
+        "body_time",
+        "url_id",
+        "producer_id",
+    )
 
-    result_type: ResultType
-    url: str
-    response_time: float = 0
-    status_code: int = 0
-    pattern: Pattern = Pattern.IRRELEVANT
-    utc_timestamp_ms: int = field(default_factory=utc_now_ms)
+    def __init__(
+        self,
+        result_type: ResultType,
+        url: str,
+        response_time: float = 0,
+        status_code: int = 0,
+        pattern: Pattern = Pattern.IRRELEVANT,
+        utc_timestamp_ms: Optional[int] = None,
+        dns_time: Optional[float] = None,
+        connect_time: Optional[float] = None,
+        ttfb: Optional[float] = None,
+        body_time: Optional[float] = None,
+        url_id: Optional[int] = None,
+        producer_id: int = 0,
+    ):
+        self.result_type = result_type
+        self.url = url
+        self.response_time = response_time
+        self.status_code = status_code
+        self.pattern = pattern
+        self.utc_timestamp_ms = utc_now_ms() if utc_timestamp_ms is None else utc_timestamp_ms
+        self.dns_time = dns_time
+        self.connect_time = connect_time
+        self.ttfb = ttfb
+        self.body_time = body_time
+        self.url_id = hash_url(url) if url_id is None else url_id
+        self.producer_id = producer_id
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None  # Results are mutable
 
     def __repr__(self):
+        phases = "\n".join("" if t is None else str(t) for t in _phases(self))
         return (
             f"{self.result_type.value}\n{self.url}\n{self.response_time}"
             f"\n{self.status_code}\n{self.pattern.value}\n{self.utc_timestamp_ms}"
+            f"\n{phases}\n{self.url_id}\n{self.producer_id}"
         )
 
     @staticmethod
     def from_str(result_str):
+        """from_str parses the representation of a Result, with or without
+        phase timings, URL id and producer id"""
         try:
-            (
-                result_type,
-                url,
-                response_time,
-                status_code,
-                pattern,
-                utc_timestamp_ms,
-            ) = result_str.splitlines()
+            lines = result_str.split("\n")
+            if len(lines) not in (6, 10, 11, 12):
+                raise ValueError(f"expected 6, 10, 11 or 12 lines, got {len(lines)}")
+            result_type, url, response_time, status_code, pattern, utc_timestamp_ms = lines[:6]
+            phases = [float(t) if t else None for t in lines[6:10]]
+            url_id = int(lines[10]) if len(lines) > 10 else None
+            producer_id = int(lines[11]) if len(lines) > 11 else 0
             return Result(
                 ResultType(int(result_type)),
                 url,
@@ -78,6 +151,9 @@ class Result:
                 int(status_code),
                 Pattern(int(pattern)),
                 int(utc_timestamp_ms),
+                *(phases or [None] * 4),
+                url_id,
+                producer_id,
             )
         except ValueError as err:
             raise ValueError(
@@ -85,19 +161,113 @@ class Result:
             ) from err
 
     def as_dict(self):
-        result = vars(self).copy()
+        result = {name: getattr(self, name) for name in self.__slots__}
         result["result_type"] = self.result_type.name
         result["pattern"] = self.pattern.name
         return result
 
+    def url_params(self):
+        """url_params returns the parameters of URL_INSERT_SQL"""
+        return self.url_id, self.url
+
+    def result_params(self):
+        """result_params returns the parameters of RESULT_INSERT_SQL"""
+        return (
+            self.url_id,
+            self.response_time,
+            self.status_code,
+            self.pattern.name,
+            self.utc_timestamp_ms,
+            self.dns_time,
+            self.connect_time,
+            self.ttfb,
+            self.body_time,
+            self.producer_id,
+        )
+
+    def error_params(self):
+        """error_params returns the parameters of ERROR_INSERT_SQL"""
+        return self.url_id, self.result_type.name, self.utc_timestamp_ms, self.producer_id
+
 
 class ResultSerde:
-    """ResultSerde serializes and deserializes Result into/from bytes"""
+    """ResultSerde serializes and deserializes Result into/from bytes, in a
+    fixed-layout binary format led by its version byte. Results in the text
+    format of their representation, or in the binary format of version 1,
+    which has no producer id, are deserialized as well"""
 
     @staticmethod
     def from_bytes(result_bytes):
-        return Result.from_str(result_bytes.decode())
+        """from_bytes deserializes a Result from bytes or a memoryview"""
+        if result_bytes[:1] in BINARY_MAGICS:
+            return ResultSerde._from_binary(result_bytes)
+        return Result.from_str(str(result_bytes, "utf-8"))
 
     @staticmethod
     def to_bytes(result):
-        return str(result.encode())
+        """to_bytes serializes a Result, with a bit per phase timing telling
+        whether it follows the header"""
+        url = result.url.encode()
+        phases = [t for t in _phases(result) if t is not None]
+        header = BINARY_HEADER.pack(
+            BINARY_VERSION,
+            result.result_type.value,
+            result.pattern.value,
+            sum(1 << i for i, t in enumerate(_phases(result)) if t is not None),
+            result.status_code,
+            result.response_time,
+            result.utc_timestamp_ms,
+            result.url_id,
+            result.producer_id,
+            len(url),
+        )
+        return b"".join([header, *map(PHASE.pack, phases), url])
+
+    @staticmethod
+    def _from_binary(result_bytes):
+        try:
+            header = BINARY_HEADERS[result_bytes[0]]
+            fields = header.unpack_from(result_bytes)
+            if header is LEGACY_BINARY_HEADER:
+                fields = (*fields[:-1], 0, fields[-1])
+            (
+                _,
+                result_type,
+                pattern,
+                phases_present,
+                status_code,
+                response_time,
+                utc_timestamp_ms,
+                url_id,
+                producer_id,
+                url_length,
+            ) = fields
+            offset, phases = header.size, []
+            for i in range(4):
+                if phases_present & 1 << i:
+                    phases.append(PHASE.unpack_from(result_bytes, offset)[0])
+                    offset += PHASE.size
+                else:
+                    phases.append(None)
+            url = memoryview(result_bytes)[offset:]
+            if len(url) != url_length:
+                raise ValueError(f"expected a URL of {url_length} bytes, got {len(url)}")
+            return Result(
+                ResultType(result_type),
+                str(url, "utf-8"),
+                response_time,
+                status_code,
+                Pattern(pattern),
+                utc_timestamp_ms,
+                *phases,
+                url_id,
+                producer_id,
+            )
+        except (struct.error, ValueError) as err:
+            raise ValueError(
+                f"{bytes(result_bytes)!r} is not a valid binary Result: {err}"
+            ) from err
+
+
+def _phases(result):
+    return result.dns_time, result.connect_time, result.ttfb, result.body_time
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""scheduler provides a deadline-driven scheduler that fires each URL at its
+own next-due time"""
+
+import array
+import asyncio
+import heapq
+import random
+import time
+
+from walt.url_store import align
+
+
+TICK = 1e-3  # Seconds per tick of the due times kept in the heap
+UNSCHEDULED = -(2 ** 63)
+POPPED = UNSCHEDULED + 1  # Due tick of URLs returned by next_due until rescheduled
+
+
+class Scheduler:
+    """Scheduler keeps the URLs of a URLStore in a heap ordered by their
+    next-due time. Each URL is checked every `interval` seconds (or its own
+    interval, if present in `intervals`), randomly shifted by up to `jitter`
+    times the interval. The state of each URL is kept in arrays indexed by its
+    position in the store, and heap entries are integers packing its due tick
+    and position, so that no object is kept per URL"""
+
+    def __init__(self, urls, interval, jitter=0, intervals=None):
+        self._interval = interval
+        self._jitter = jitter
+        self._intervals = intervals if intervals is not None else {}
+        self._epoch = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._reset(urls)
+
+    def __len__(self):
+        return self._scheduled
+
+    def __contains__(self, url):
+        return self._scheduled_position(url) is not None
+
+    def _reset(self, urls):
+        self._urls = urls
+        self._position_bits = len(urls).bit_length()
+        self._mask = (1 << self._position_bits) - 1
+        self._base = array.array("d", [0]) * len(urls)
+        self._due = array.array("q", [UNSCHEDULED]) * len(urls)
+        self._heap = []
+        self._scheduled = 0
+
+    def interval(self, url):
+        """interval returns the check interval of `url`"""
+        return self._intervals.get(url, self._interval)
+
+    def set_intervals(self, intervals):
+        """set_intervals replaces the intervals of URLs, which take effect as
+        they are rescheduled"""
+        self._intervals = intervals
+
+    def set_urls(self, urls):
+        """set_urls replaces the URL store, keeping URLs also in `urls` on
+        their schedule and unscheduling the others. URLs popped but not yet
+        rescheduled stay out of the heap until they are"""
+        old_urls, old_base, old_due = self._urls, self._base, self._due
+        self._reset(urls)
+        for old_position, position in align(old_urls, urls):
+            if old_position is None or position is None or old_due[old_position] == UNSCHEDULED:
+                continue
+            self._base[position] = old_base[old_position]
+            self._due[position] = old_due[old_position]
+            self._scheduled += 1
+            if old_due[old_position] != POPPED:
+                self._heap.append(old_due[old_position] << self._position_bits | position)
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def due(self, url):
+        """due returns the next-due time of `url`, or None if it isn't
+        scheduled or was popped and not rescheduled yet"""
+        position = self._scheduled_position(url)
+        if position is None or self._due[position] == POPPED:
+            return None
+        return self._epoch + self._due[position] * TICK
+
+    def add(self, url, due=None):
+        """add schedules `url` of the store to be due at `due` or, if omitted,
+        after a random fraction of the jitter window so that URLs don't all
+        fire at once"""
+        position = self._urls.position(url)
+        if position is None:
+            raise KeyError(url)
+        self._add(position, due)
+
+    def add_all(self, accept=None):
+        """add_all schedules every URL of the store, or those `accept` returns
+        True for, like `add` does"""
+        for position in range(len(self._urls)):
+            if accept is None or accept(self._urls.url(position)):
+                self._add(position, None)
+
+    def remove(self, url):
+        """remove unschedules `url`, whose heap entry is skipped lazily"""
+        position = self._scheduled_position(url)
+        if position is not None:
+            self._due[position] = UNSCHEDULED
+            self._scheduled -= 1
+
+    def reschedule(self, url):
+        """reschedule sets the next-due time of `url` one interval after its
+        previous unjittered due time, or after now if it is running late. The
+        jitter is applied to that base only so that it doesn't accumulate"""
+        position = self._scheduled_position(url)
+        if position is None:
+            return
+        base = max(self._base[position] + self.interval(url), time.monotonic())
+        self._base[position] = base
+        self._push(position, base + self._shift(url, self._jitter / 2))
+
+    def postpone(self, url, delay):
+        """postpone makes `url` due again `delay` seconds from now, keeping
+        its unjittered due time so that later checks stay on their cadence"""
+        position = self._scheduled_position(url)
+        if position is not None:
+            self._push(position, time.monotonic() + delay)
+
+    async def next_due(self):
+        """next_due waits until the earliest URL is due and returns it, which
+        stays scheduled but out of the heap until rescheduled or postponed"""
+        while True:
+            self._wakeup.clear()
+            delay = self._pop_delay()
+            if delay is not None and delay <= 0:
+                position = heapq.heappop(self._heap) & self._mask
+                self._due[position] = POPPED
+                return self._urls.url(position)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _scheduled_position(self, url):
+        position = self._urls.position(url)
+        if position is None or self._due[position] == UNSCHEDULED:
+            return None
+        return position
+
+    def _add(self, position, due):
+        if due is None:
+            interval = self._interval
+            if self._jitter and self._intervals:
+                interval = self.interval(self._urls.url(position))
+            due = time.monotonic() + self._jitter * random.random() * interval
+        if self._due[position] == UNSCHEDULED:
+            self._scheduled += 1
+        self._base[position] = due
+        self._push(position, due)
+
+    def _push(self, position, due):
+        tick = round((due - self._epoch) / TICK)
+        self._due[position] = tick
+        heapq.heappush(self._heap, tick << self._position_bits | position)
+        self._wakeup.set()
+
+    def _pop_delay(self):
+        """_pop_delay drops stale heap entries and returns the delay until the
+        earliest URL is due, or None if there is no URL"""
+        while self._heap:
+            entry = self._heap[0]
+            tick = entry >> self._position_bits
+            if self._due[entry & self._mask] == tick:
+                return self._epoch + tick * TICK - time.monotonic()
+            heapq.heappop(self._heap)
+        return None
+
+    def _shift(self, url, center):
+        """_shift returns a random shift in the window of `jitter` times the
+        interval of `url`, displaced by `center` times the interval"""
+        if not self._jitter:
+            return 0
+        return (random.random() * self._jitter - center) * self.interval(url)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""serdes provides a registry of Result serializers and a serde that tells
+them apart by the first byte of what they serialize"""
+
+import json
+
+from walt import logger
+from walt.result import BINARY_MAGICS
+from walt.result import Pattern
+from walt.result import Result
+from walt.result import ResultSerde
+from walt.result import ResultType
+
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+
+BINARY = "binary"
+TEXT = "text"
+JSON = "json"
+MSGPACK = "msgpack"
+
+MSGPACK_MAGIC = b"\x03"  # First byte of msgpack Results, none of the other formats
+
+
+class TextSerde:
+    """TextSerde serializes Result into its representation, one attribute per
+    line, always starting with a digit"""
+
+    @staticmethod
+    def from_bytes(result_bytes):
+        return Result.from_str(str(result_bytes, "utf-8"))
+
+    @staticmethod
+    def to_bytes(result):
+        return repr(result).encode()
+
+
+class JSONSerde:
+    """JSONSerde serializes Result into a JSON object of its attributes, with
+    result type and pattern by name"""
+
+    @staticmethod
+    def from_bytes(result_bytes):
+        try:
+            obj = json.loads(bytes(result_bytes))
+            obj["result_type"] = ResultType[obj["result_type"]]
+            obj["pattern"] = Pattern[obj["pattern"]]
+            return Result(**obj)
+        except (KeyError, TypeError) as err:
+            raise ValueError(f"{bytes(result_bytes)!r} is not a valid JSON Result: {err}") from err
+
+    @staticmethod
+    def to_bytes(result):
+        return json.dumps(result.as_dict(), separators=(",", ":")).encode()
+
+
+class MsgpackSerde:
+    """MsgpackSerde serializes Result into a msgpack array of its attributes,
+    after a magic byte. It needs msgpack installed"""
+
+    @staticmethod
+    def from_bytes(result_bytes):
+        if msgpack is None:
+            raise ValueError("Cannot deserialize a msgpack Result: msgpack is not installed")
+        try:
+            result_type, pattern, *attrs = msgpack.unpackb(memoryview(result_bytes)[1:])
+            return Result(ResultType(result_type), *attrs[:3], Pattern(pattern), *attrs[3:])
+        except (ValueError, TypeError) as err:
+            raise ValueError(
+                f"{bytes(result_bytes)!r} is not a valid msgpack Result: {err}"
+            ) from err
+
+    @staticmethod
+    def to_bytes(result):
+        return MSGPACK_MAGIC + msgpack.packb(
+            [
+                result.result_type.value,
+                result.pattern.value,
+                result.url,
+                result.response_time,
+                result.status_code,
+                result.utc_timestamp_ms,
+                result.dns_time,
+                result.connect_time,
+                result.ttfb,
+                result.body_time,
+                result.url_id,
+                result.producer_id,
+            ]
+        )
+
+
+SERDES = {BINARY: ResultSerde, TEXT: TextSerde, JSON: JSONSerde, MSGPACK: MsgpackSerde}
+
+
+class DetectingSerde:
+    """DetectingSerde serializes Result with `serde` and deserializes it with
+    whichever serde it was serialized with, told by its first byte"""
+
+    def __init__(self, serde):
+        self._serde = serde
+
+    def to_bytes(self, result):
+        return self._serde.to_bytes(result)
+
+    @staticmethod
+    def from_bytes(result_bytes):
+        first = result_bytes[:1]
+        if first in BINARY_MAGICS:
+            return ResultSerde.from_bytes(result_bytes)
+        if first == MSGPACK_MAGIC:
+            return MsgpackSerde.from_bytes(result_bytes)
+        if first == b"{":
+            return JSONSerde.from_bytes(result_bytes)
+        return TextSerde.from_bytes(result_bytes)
+
+
+def get_serde(name):
+    """get_serde returns a DetectingSerde that serializes with the `name`
+    serde, falling back to binary if it's unknown or msgpack isn't installed"""
+    if name == MSGPACK and msgpack is None:
+        logger.warning("msgpack is not installed, falling back to %s", BINARY)
+        name = BINARY
+    elif name not in SERDES:
+        logger.warning("Unknown serde %s, falling back to %s", name, BINARY)
+        name = BINARY
+    return DetectingSerde(SERDES[name])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""sharding splits the URL inventory among producers"""
+
+import bisect
+import hashlib
+import zlib
+
+
+def stable_hash(key):
+    """stable_hash hashes `key` to the same integer in every process, unlike
+    the builtin `hash` that is salted per process"""
+    return zlib.crc32(key.encode())
+
+
+def in_shard(url, shard, shards):
+    """in_shard tells whether `url` belongs to `shard` out of `shards` shards"""
+    return stable_hash(url) % shards == shard
+
+
+def ring_hash(key):
+    """ring_hash hashes `key` to a 64-bit integer evenly spread on a ring"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """HashRing assigns keys to nodes by consistent hashing: each node is
+    placed on the ring at `vnodes` points and a key belongs to the node at the
+    first point after the key's hash. When a node joins or leaves, only the
+    keys between its points and the previous ones move"""
+
+    def __init__(self, nodes=(), vnodes=64):
+        self._vnodes = vnodes
+        self._points = []
+        self._nodes = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        """add places `node` on the ring"""
+        self.nodes.add(node)
+        for i in range(self._vnodes):
+            point = ring_hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._nodes.insert(index, node)
+
+    def remove(self, node):
+        """remove takes `node` off the ring"""
+        self.nodes.discard(node)
+        kept = [(p, n) for p, n in zip(self._points, self._nodes) if n != node]
+        self._points = [p for p, _ in kept]
+        self._nodes = [n for _, n in kept]
+
+    def node_for(self, key):
+        """node_for returns the node `key` belongs to, or None if the ring is
+        empty"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, ring_hash(key)) % len(self._points)
+        return self._nodes[index]
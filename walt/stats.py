@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""stats provides helpers to collect statistics reported by action runners"""
+
+
+class LatencyStats:
+    """LatencyStats accumulates latencies and reports their count, mean and
+    maximum since the last report"""
+
+    def __init__(self, name):
+        self._name = name
+        self._count, self._total, self._max = 0, 0, 0
+
+    def add(self, latency):
+        self._count += 1
+        self._total += latency
+        self._max = max(self._max, latency)
+
+    def report(self):
+        """report returns the statistics since the last report and resets them"""
+        mean = self._total / self._count if self._count else 0
+        stats = {
+            f"{self._name}_count": self._count,
+            f"{self._name}_mean": round(mean, 6),
+            f"{self._name}_max": round(self._max, 6),
+        }
+        self._count, self._total, self._max = 0, 0, 0
+        return stats
@@ -10,6 +10,14 @@
 
 """storages provides entities responsible for writing a Result to external resources"""
 
+import asyncio
+import io
+import struct
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from decimal import Decimal
+
 import aiopg
 import psycopg2
 from psycopg2 import sql
@@ -17,6 +25,135 @@ from psycopg2 import sql
 from walt import logger
 from walt import queries
 from walt.result import ResultType
+from walt.result import hash_url
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+PG_EPOCH_MS = 946684800000  # Milliseconds from the Unix epoch to the Postgres one, in 2000
+RESULT_TIMESTAMP_INDEX = 4  # Position of the timestamp in Result.result_params
+ERROR_TIMESTAMP_INDEX = 2  # Position of the timestamp in Result.error_params
+
+BAD_DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, ValueError)
+
+COPY_TEXT = "text"
+COPY_BINARY = "binary"
+
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\0" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+NUMERIC_NEGATIVE = 0x4000
+
+
+def _multi_row(template, values, rows):
+    """_multi_row returns `template` with a `values` placeholder per row and
+    the parameters of all `rows`, in order"""
+    query = template.format(values=", ".join([values] * len(rows)))
+    return query, tuple(param for row in rows for param in row)
+
+
+def _text_buffer(rows, timestamp_index):
+    """_text_buffer returns a file of `rows` in the text format of COPY, with
+    the milliseconds since epoch at `timestamp_index` turned into timestamps"""
+    buffer = io.StringIO()
+    for row in rows:
+        values = list(row)
+        values[timestamp_index] = EPOCH + timedelta(milliseconds=values[timestamp_index])
+        buffer.write("\t".join(r"\N" if value is None else str(value) for value in values))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _bigint(value):
+    return struct.pack(">q", value)
+
+
+def _int(value):
+    return struct.pack(">i", value)
+
+
+def _enum(value):
+    return value.encode()
+
+
+def _timestamp(value):
+    """_timestamp encodes milliseconds since the Unix epoch as a timestamptz:
+    microseconds since the Postgres epoch"""
+    return struct.pack(">q", (value - PG_EPOCH_MS) * 1000)
+
+
+def _numeric(value):
+    """_numeric encodes a number as a Postgres numeric: its base 10000 digits
+    led by their count, the weight of the first one, the sign and the scale"""
+    text = str(value)
+    if "e" in text:
+        text = format(Decimal(text), "f")
+    negative = text.startswith("-")
+    integer, _, fraction = text.lstrip("-").partition(".")
+    integer = integer.lstrip("0")
+    digits = "0" * (-len(integer) % 4) + integer + fraction + "0" * (-len(fraction) % 4)
+    groups = [int(digits[i : i + 4]) for i in range(0, len(digits), 4)]
+    weight = (len(integer) + 3) // 4 - 1
+    while groups and not groups[0]:
+        groups.pop(0)
+        weight -= 1
+    while groups and not groups[-1]:
+        groups.pop()
+    if not groups:
+        weight = 0
+    sign = NUMERIC_NEGATIVE if negative else 0
+    return struct.pack(f">hhHH{len(groups)}H", len(groups), weight, sign, len(fraction), *groups)
+
+
+RESULT_ENCODERS = (_bigint, _numeric, _int, _enum, _timestamp, *(_numeric,) * 4, _bigint)
+ERROR_ENCODERS = (_bigint, _enum, _timestamp, _bigint)
+
+
+def _binary_buffer(rows, encoders):
+    """_binary_buffer returns a file of `rows` in the binary format of COPY,
+    each value encoded by the encoder at its position"""
+    buffer = io.BytesIO()
+    buffer.write(BINARY_HEADER)
+    field_count = struct.pack(">h", len(encoders))
+    null = _int(-1)
+    for row in rows:
+        buffer.write(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                buffer.write(null)
+                continue
+            data = encode(value)
+            buffer.write(_int(len(data)))
+            buffer.write(data)
+    buffer.write(BINARY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_buffers(rows, errors, copy_format):
+    """_copy_buffers returns files of result `rows` and `errors` in the text
+    or binary `copy_format` of COPY"""
+    if copy_format == COPY_BINARY:
+        return _binary_buffer(rows, RESULT_ENCODERS), _binary_buffer(errors, ERROR_ENCODERS)
+    if copy_format == COPY_TEXT:
+        return (
+            _text_buffer(rows, RESULT_TIMESTAMP_INDEX),
+            _text_buffer(errors, ERROR_TIMESTAMP_INDEX),
+        )
+    raise ValueError(f"Unknown COPY format {copy_format!r}")
+
+
+def _split(results):
+    """_split returns the URL, result and error parameters of `results`, URLs
+    deduplicated"""
+    urls, rows, errors = {}, [], []
+    for res in results:
+        if res.url:
+            urls[res.url_id] = res.url_params()
+        if res.result_type is ResultType.RESULT:
+            rows.append(res.result_params())
+        else:
+            errors.append(res.error_params())
+    return list(urls.values()), rows, errors
 
 
 class PostgresResultStorage:
@@ -27,6 +164,7 @@ class PostgresResultStorage:
         self._dbname = dbname
         self._dsn = f"host={host} port={port} user={user} password={password}"
         self._pool = None
+        self._copy_conn = None
 
     def create_database(self):
         """create_database creates the database"""
@@ -36,11 +174,44 @@ class PostgresResultStorage:
             cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self._dbname)))
 
     def create_tables(self):
-        """create_tables creates all tables"""
+        """create_tables creates all tables or, if they already exist, migrates
+        them to the current schema"""
         with psycopg2.connect(f"{self._dsn} dbname={self._dbname}") as conn, conn.cursor() as cur:
+            cur.execute(queries.TABLES_EXIST_SQL)
+            if cur.fetchone()[0]:
+                self._migrate_tables(conn, cur)
+                return
             logger.info("Creating tables on %s", self._dbname)
             cur.execute(queries.CREATE_TABLES_SQL)
 
+    def _migrate_tables(self, conn, cur):
+        """_migrate_tables adds the types, tables and columns missing from the
+        existing tables, moves their URLs to the url table, leaving their ids
+        in place, and removes duplicates before indexing their dedupe keys"""
+        logger.info("Migrating tables on %s", self._dbname)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        for query in queries.ADD_ENUM_VALUES_SQLS:
+            cur.execute(query)  # can't run inside a transaction
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_DEFAULT)
+        cur.execute(queries.MIGRATE_TABLES_SQL)
+        cur.execute(queries.URL_COLUMN_EXISTS_SQL)
+        if cur.fetchone()[0]:
+            self._migrate_url_ids(cur)
+        cur.execute(queries.DEDUPE_INDEXES_EXIST_SQL)
+        if not cur.fetchone()[0]:
+            logger.info("Removing duplicates and indexing dedupe keys")
+            cur.execute(queries.MIGRATE_DEDUPE_SQL)
+
+    @staticmethod
+    def _migrate_url_ids(cur):
+        """_migrate_url_ids moves the URLs of results and errors to the url
+        table and refers to them by their ids"""
+        cur.execute(queries.LEGACY_URLS_SQL)
+        urls = [(hash_url(url), url) for url, in cur.fetchall()]
+        logger.info("Moving %d URLs to the url table", len(urls))
+        cur.executemany(queries.URL_INSERT_SQL, urls)
+        cur.execute(queries.MIGRATE_URL_IDS_SQL)
+
     def drop_database(self):
         """drop_database drops the database"""
         with psycopg2.connect(self._dsn) as conn, conn.cursor() as cur:
@@ -60,24 +231,102 @@ class PostgresResultStorage:
     async def disconnect(self):
         self._pool.close()
         await self._pool.wait_closed()
+        if self._copy_conn is not None:
+            self._copy_conn.close()
 
     async def save(self, result):
-        """save wraps _save and logs exceptions if any"""
+        """save wraps _save and drops a Result of bad data, logging it. Other
+        exceptions are logged and raised, as the Result is not stored"""
         try:
             await self._save(result)
+        except BAD_DATA_ERRORS:
+            logger.exception("Dropping bad result %s", repr(str(result)))
         except Exception:
             logger.exception("Failed to save result %s", repr(str(result)))
+            raise
 
     async def _save(self, result):
-        """_save inserts one Result according on its type"""
+        """_save inserts one Result according on its type, and its URL as well
+        if the Result comes with it"""
         if not self._pool:
             raise RuntimeError("Not connected. Did you forget to call `connect()`?")
         async with self._pool.acquire() as conn, conn.cursor() as cur:
             logger.info("Saving a result of type %s", result.result_type.name)
-            result_dict = result.as_dict()
+            if result.url:
+                await cur.execute(queries.URL_INSERT_SQL, result.url_params())
             if result.result_type is ResultType.RESULT:
-                logger.debug("Inserting a result: %s", result_dict)
-                await cur.execute(queries.RESULT_INSERT_SQL, result_dict)
+                logger.debug("Inserting a result: %r", result)
+                await cur.execute(queries.RESULT_INSERT_SQL, result.result_params())
             else:
-                logger.debug("Inserting an error: %s", result_dict)
-                await cur.execute(queries.ERROR_INSERT_SQL, result_dict)
+                logger.debug("Inserting an error: %r", result)
+                await cur.execute(queries.ERROR_INSERT_SQL, result.error_params())
+
+    async def save_many(self, results):
+        """save_many wraps _save_many and, if a Result is of bad data, saves
+        them one by one so that only bad ones are dropped. Other exceptions are
+        logged and raised, as the Results are not stored"""
+        try:
+            await self._save_many(results)
+        except BAD_DATA_ERRORS:
+            logger.exception("Failed to save %d results, saving them one by one", len(results))
+            for res in results:
+                await self.save(res)
+        except Exception:
+            logger.exception("Failed to save %d results", len(results))
+            raise
+
+    async def _save_many(self, results):
+        """_save_many inserts Results in a single transaction, with one
+        multi-row insert for URLs, one for results and one for errors"""
+        if not self._pool:
+            raise RuntimeError("Not connected. Did you forget to call `connect()`?")
+        urls, rows, errors = _split(results)
+        async with self._pool.acquire() as conn, conn.cursor() as cur:
+            logger.info("Saving %d results and %d errors", len(rows), len(errors))
+            async with cur.begin():
+                for template, values, params in (
+                    (queries.URL_INSERT_MANY_SQL, queries.URL_VALUES, urls),
+                    (queries.RESULT_INSERT_MANY_SQL, queries.RESULT_VALUES, rows),
+                    (queries.ERROR_INSERT_MANY_SQL, queries.ERROR_VALUES, errors),
+                ):
+                    if params:
+                        await cur.execute(*_multi_row(template, values, params))
+
+    async def copy_many(self, results, copy_format=COPY_TEXT):
+        """copy_many copies Results into their tables in a separate thread and,
+        if a Result is of bad data, saves them one by one so that only bad ones
+        are dropped. Other exceptions are logged and raised, as the Results are
+        not stored"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._copy_many, results, copy_format
+            )
+        except BAD_DATA_ERRORS:
+            logger.exception("Failed to copy %d results, saving them one by one", len(results))
+            for res in results:
+                await self.save(res)
+        except Exception:
+            logger.exception("Failed to copy %d results", len(results))
+            raise
+
+    def _copy_many(self, results, copy_format):
+        """_copy_many inserts URLs with a multi-row insert and streams results
+        and errors with COPY FROM STDIN in `copy_format` into temporary tables,
+        whence they're inserted skipping duplicates, all in a single
+        transaction, on a connection of its own since aiopg can't COPY"""
+        urls, rows, errors = _split(results)
+        rows_buffer, errors_buffer = _copy_buffers(rows, errors, copy_format)
+        if self._copy_conn is None or self._copy_conn.closed:
+            self._copy_conn = psycopg2.connect(f"{self._dsn} dbname={self._dbname}")
+        with self._copy_conn as conn, conn.cursor() as cur:
+            logger.info("Copying %d results and %d errors", len(rows), len(errors))
+            cur.execute(queries.COPY_TABLES_SQL)
+            if urls:
+                cur.execute(*_multi_row(queries.URL_INSERT_MANY_SQL, queries.URL_VALUES, urls))
+            for copy_query, insert_query, params, buffer in (
+                (queries.RESULT_COPY_SQL, queries.RESULT_COPY_INSERT_SQL, rows, rows_buffer),
+                (queries.ERROR_COPY_SQL, queries.ERROR_COPY_INSERT_SQL, errors, errors_buffer),
+            ):
+                if params:
+                    cur.copy_expert(copy_query.format(copy_format=copy_format), buffer)
+                    cur.execute(insert_query)
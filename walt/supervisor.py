@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""supervisor runs an action in several processes and keeps them running"""
+
+import multiprocessing
+import os
+import signal
+import time
+
+from walt import logger
+
+
+class Supervisor:
+    """Supervisor runs `target(shard, shards, counter)` in `processes` worker
+    processes, restarts those that crash and sums up their counters. `counter`
+    is a shared `multiprocessing.Value` the target increments as it goes, kept
+    across restarts of the shard so that counts of crashed runs aren't lost.
+    Their sum is reported every `stats_interval` seconds, if any. SIGHUP is
+    passed on to the worker processes"""
+
+    def __init__(self, name, target, processes, backoff=1, stats_interval=0):
+        self._name = name
+        self._target = target
+        self._shards = processes
+        self._backoff = backoff
+        self._stats_interval = stats_interval
+        self._report_at = None
+        self._processes = {}
+        self._restart_at = {}
+        self._restarts = {}
+        self._counters = None
+        self._stopping = False
+
+    def run(self):
+        """run starts all worker processes, supervises them until they all
+        finish and returns the sum of their counters"""
+        self._counters = [multiprocessing.Value("q", 0) for _ in range(self._shards)]
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._signal_handler)
+        signal.signal(signal.SIGHUP, self._sighup_handler)
+        logger.info("Starting %d %s processes", self._shards, self._name)
+        for shard in range(self._shards):
+            self._start(shard)
+        if self._stats_interval:
+            self._report_at = time.monotonic() + self._stats_interval
+        while self._processes or self._restart_at:
+            self._supervise()
+            self._maybe_report_stats()
+        total = sum(counter.value for counter in self._counters)
+        logger.info("%s processes finished with a total count of %d", self._name, total)
+        return total
+
+    def _maybe_report_stats(self):
+        """_maybe_report_stats logs the sum of the counters and each of them
+        once `stats_interval` seconds have passed since the last report"""
+        if self._report_at is None or time.monotonic() < self._report_at:
+            return
+        self._report_at += self._stats_interval
+        counts = [counter.value for counter in self._counters]
+        counters = ",".join(map(str, counts))
+        logger.info("%s stats: counter=%d counters=%s", self._name, sum(counts), counters)
+
+    def _signal_handler(self, signum, frame):
+        logger.info("Stopping %s processes", self._name)
+        self._stopping = True
+        self._restart_at.clear()
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def _sighup_handler(self, signum, frame):
+        logger.info("Reloading %s processes", self._name)
+        for process in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def _start(self, shard):
+        process = multiprocessing.Process(
+            target=self._run_shard,
+            args=(self._target, shard, self._shards, self._counters[shard]),
+            name=f"{self._name}-{shard + 1}",
+        )
+        process.start()
+        logger.debug("Started %s with pid %d", process.name, process.pid)
+        self._processes[shard] = process
+
+    @staticmethod
+    def _run_shard(target, shard, shards, counter):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        target(shard, shards, counter)
+
+    def _supervise(self):
+        """_supervise reaps finished processes, schedules crashed ones to be
+        restarted with backoff and restarts those whose time has come"""
+        for shard, process in list(self._processes.items()):
+            process.join(timeout=0.1 / self._shards)
+            if process.exitcode is None:
+                continue
+            del self._processes[shard]
+            if process.exitcode == 0 or self._stopping:
+                self._restarts.pop(shard, None)
+                continue
+            backoff = min(self._backoff * 8, self._backoff * 2 ** self._restarts.get(shard, 0))
+            logger.error(
+                "%s crashed with exit code %d, restarting in %ds",
+                process.name,
+                process.exitcode,
+                backoff,
+            )
+            self._restarts[shard] = self._restarts.get(shard, 0) + 1
+            self._restart_at[shard] = time.monotonic() + backoff
+        for shard, restart_at in list(self._restart_at.items()):
+            if restart_at <= time.monotonic() and not self._stopping:
+                self._restart_at.pop(shard, None)
+                self._start(shard)
+        if not self._processes and self._restart_at:
+            time.sleep(0.1)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of walt
+# https://github.com/scorphus/walt
+
+# Licensed under the BSD-3-Clause license:
+# https://opensource.org/licenses/BSD-3-Clause
+# Copyright (c) 2021, Pablo S. Blum de Aguiar <scorphus@gmail.com>
+
+"""url_store keeps the URL inventory compactly in memory and loads it from the
+configuration and, lazily, from CSV or JSONL files"""
+
+import array
+import csv
+import itertools
+import json
+import re
+
+from walt import logger
+from walt.sharding import in_shard
+
+
+NO_PATTERN = 0
+
+
+class URLStore:
+    """URLStore maps URLs to their compiled regexp patterns, read-only. URLs
+    are kept sorted and UTF-8 encoded in a single buffer, delimited by an
+    array of offsets and looked up by bisection, and each refers to its
+    pattern by position in an array. Each distinct pattern is compiled and
+    kept only once. Erroneous patterns are logged and treated as no pattern.
+    If a URL comes more than once in `items`, its last pattern prevails"""
+
+    def __init__(self, items=()):
+        self._patterns = [None]
+        self._pattern_ids_by_regexp = {"": NO_PATTERN}
+        urls, pattern_ids = [], array.array("I")
+        for url, regexp in items:
+            urls.append(url.encode())
+            pattern_ids.append(self._intern(regexp or ""))
+        order = sorted(range(len(urls)), key=urls.__getitem__)
+        self._blob, self._offsets = bytearray(), array.array("Q", [0])
+        self._pattern_ids = array.array("I")
+        for k, i in enumerate(order, 1):
+            if k == len(order) or urls[i] != urls[order[k]]:
+                self._blob += urls[i]
+                self._offsets.append(len(self._blob))
+                self._pattern_ids.append(pattern_ids[i])
+            urls[i] = None
+
+    def __len__(self):
+        return len(self._pattern_ids)
+
+    def __iter__(self):
+        return (self.url(position) for position in range(len(self)))
+
+    def __contains__(self, url):
+        return self.position(url) is not None
+
+    def __getitem__(self, url):
+        position = self.position(url)
+        if position is None:
+            raise KeyError(url)
+        return self.pattern(position)
+
+    def position(self, url):
+        """position returns the position of `url` in the store, or None if it
+        isn't there"""
+        key, blob, offsets = url.encode(), self._blob, self._offsets
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if blob[offsets[mid] : offsets[mid + 1]] < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(self) and blob[offsets[low] : offsets[low + 1]] == key:
+            return low
+        return None
+
+    def url(self, position):
+        """url returns the URL at `position`"""
+        return self._encoded(position).decode()
+
+    def pattern(self, position):
+        """pattern returns the compiled pattern of the URL at `position`"""
+        return self._patterns[self._pattern_ids[position]]
+
+    def _encoded(self, position):
+        return self._blob[self._offsets[position] : self._offsets[position + 1]]
+
+    def _intern(self, regexp):
+        try:
+            return self._pattern_ids_by_regexp[regexp]
+        except KeyError:
+            pass
+        try:
+            self._patterns.append(re.compile(regexp))
+            pattern_id = len(self._patterns) - 1
+        except re.error as err:
+            logger.error("Failed to compile regexp pattern `%s`: %s", regexp, err)
+            pattern_id = NO_PATTERN
+        self._pattern_ids_by_regexp[regexp] = pattern_id
+        return pattern_id
+
+
+def align(old, new):
+    """align walks two URL stores in URL order and yields, for each URL in
+    either, its position in `old` and in `new`, None where it is missing"""
+    old_position, position = 0, 0
+    while old_position < len(old) or position < len(new):
+        if position == len(new):
+            yield old_position, None
+            old_position += 1
+        elif old_position == len(old):
+            yield None, position
+            position += 1
+        else:
+            old_url, url = old._encoded(old_position), new._encoded(position)
+            if old_url == url:
+                yield old_position, position
+                old_position, position = old_position + 1, position + 1
+            elif old_url < url:
+                yield old_position, None
+                old_position += 1
+            else:
+                yield None, position
+                position += 1
+
+
+def load_urls(url_map, url_source="", shard=0, shards=1):
+    """load_urls returns a URLStore of the URLs of `url_map` followed by those
+    read from the `url_source` file, if any, that belong to `shard` out of
+    `shards` shards"""
+    items = url_map.items()
+    if url_source:
+        items = itertools.chain(items, read_url_source(url_source))
+    if shards > 1:
+        items = (item for item in items if in_shard(item[0], shard, shards))
+    return URLStore(items)
+
+
+def read_url_source(path):
+    """read_url_source lazily yields the URLs and patterns of a CSV file of
+    `url,pattern` rows, the pattern being optional, or of a JSONL file of
+    `{"url": ..., "pattern": ...}` objects, the pattern being optional too"""
+    if path.endswith(".csv"):
+        return _read_csv(path)
+    if path.endswith((".jsonl", ".ndjson")):
+        return _read_jsonl(path)
+    raise ValueError(f"Unknown format of URL source {path}: expected .csv or .jsonl")
+
+
+def _read_csv(path):
+    logger.info("Loading URLs from %s", path)
+    with open(path, newline="") as csv_file:
+        for row in csv.reader(csv_file):
+            if not row or not row[0].strip() or row[0].startswith("#"):
+                continue
+            yield row[0].strip(), row[1] if len(row) > 1 else ""
+
+
+def _read_jsonl(path):
+    logger.info("Loading URLs from %s", path)
+    with open(path) as jsonl_file:
+        for line_number, line in enumerate(jsonl_file, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+                url, regexp = obj["url"], obj.get("pattern", "")
+            except (ValueError, KeyError, TypeError, AttributeError) as err:
+                logger.error("Invalid URL at %s:%d: %s", path, line_number, err)
+                continue
+            yield url, regexp